@@ -141,13 +141,21 @@ def preprocess_dsl(
 
     assert len(node_dsl_list) == len(sub_dsl_result), "[SHould not happen] Node DSL count and sub DSL count mismatch!"
     if do_format:
-        # Format the DSL text
+        # Format all the DSL texts in one batch: (node_index, sub_index or None, dsl_text)
+        format_items = []
         for i, node_dsl in enumerate(node_dsl_list):
-            logger.info(f"Formatting [#{i + 1}] Node DSL~")
-            node_dsl_list[i] = KirinRunner.format_dsl_text(node_dsl)
+            format_items.append((i, None, node_dsl))
             for j, sub_dsl in enumerate(sub_dsl_result[i]):
-                logger.info(f"Formatting [#{i + 1}] Node DSL - (#{j+1}) Sub DSL~")
-                sub_dsl_result[i][j] = KirinRunner.format_dsl_text(sub_dsl)
+                format_items.append((i, j, sub_dsl))
+        logger.info(f"Formatting {len(node_dsl_list)} Node DSLs and {len(format_items) - len(node_dsl_list)} Sub DSLs~")
+        formatted_dsl_list = KirinRunner.format_dsl_texts([item[2] for item in format_items])
+        for (i, j, _), formatted_dsl in zip(format_items, formatted_dsl_list):
+            if j is None:
+                assert formatted_dsl, f"--> Kirin formatter failed for [#{i + 1}] Node DSL"
+                node_dsl_list[i] = formatted_dsl
+            else:
+                assert formatted_dsl, f"--> Kirin formatter failed for [#{i + 1}] Node DSL - (#{j+1}) Sub DSL"
+                sub_dsl_result[i][j] = formatted_dsl
 
     return DslPrepResDict(
         node_dsl_list=node_dsl_list,
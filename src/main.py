@@ -1,20 +1,25 @@
-import json, shutil
+import json, shutil, argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from src.tester.build_test import TestCompiler
 from src.tester.manage_test import TestManager
-from src.tester.validate_test import validate_tests
+from src.tester.validate_test import validate_tests, validate_tests_batch
 from src.checker.parse_kirin import preprocess_dsl, save_dsl_prep_res
 
 from src.utils._llm import LLMWrapper
+from src.utils._kirin import KirinRunner
 from src.utils.types import DslInfoDict, TestInfoDict
-from src.tester.gen_test import gen_checker_tests, refine_checker_tests
+from src.tester.gen_test import gen_checker_tests, gen_checker_tests_many, refine_checker_tests
 from src.utils._logger import logger, set_log_file, unset_log_file
 from src.utils._helper import create_dir_with_path, collect_failed_dsl_paths
 
 
 COMPILATION_FAIL_THRESHOLD = 0.6  # Threshold for test compilation failure ratio
 RECALL_THRESHOLD = 0.6  # Threshold for test mismatch ratio for each type of test (positive/negative) 0.6
+DSL_DONE_MARKER = "done"  # Written into a DSL workspace once its result is saved
+DSL_GENERATED_MARKER = "generated"  # Written once the tests are generated and only the batch validation is pending
+DSL_RUNNING_MARKER = "running"  # Written into a DSL workspace while it is processed, workspaces with it are incomplete
 
 
 def initialize_dsl_ws(dsl_info: DslInfoDict, do_clean_up: bool = False):
@@ -121,8 +126,10 @@ def gen_compilable_tests(dsl_id: str, checker_dsl: str, gen_type: str = "all", u
     # Invoke LLM to generate tests
     if not skip_gen_flag:
         if gen_type == "all":
-            alerting_test_list, _ = gen_checker_tests(checker_dsl, gen_type="alerting")
-            _, non_alerting_tests = gen_checker_tests(checker_dsl, gen_type="non-alerting")
+            # independent LLM generations (incl. syntax fixing), overlap them within the LLM rate limits
+            (alerting_test_list, _), (_, non_alerting_tests) = gen_checker_tests_many(
+                checker_dsl, ["alerting", "non-alerting"]
+            )
         else:
             alerting_test_list, non_alerting_tests = gen_checker_tests(checker_dsl, gen_type)
         # alerting_test_list, non_alerting_tests = gen_checker_tests(checker_dsl, gen_type)
@@ -251,10 +258,11 @@ def gen_flow_once(
     return gen_flow_status
 
 
-def gen_flow_regression(dsl_info: DslInfoDict, gen_flow_max_retries: int = 0):
+def gen_flow_regression(dsl_info: DslInfoDict, gen_flow_max_retries: int = 0, do_validate: bool = True):
     """
     Generate tests and validate for a single DSL as a regression flow.
     :param dsl_info: The DSL information dictionary containing 'id' and 'dsl'.
+    :param do_validate: Whether to run the final validation, False to leave it to a batch of DSLs (returns None).
     """
     dsl_id = dsl_info["id"]
     dsl_ws = Path("kirin_ws") / dsl_id
@@ -270,6 +278,9 @@ def gen_flow_regression(dsl_info: DslInfoDict, gen_flow_max_retries: int = 0):
             gen_flow_status = gen_flow_once(dsl_info["id"], dsl_info["dsl"], gen_type="all", use_exist_tests=False)
             gen_flow_max_retries -= 1
 
+    if not do_validate:
+        return None
+
     # TODO)) set to "all", validate with all checker dsls and aggregated tests
     full_val_res = validate_tests(dsl_id, val_type="tmp")
 
@@ -287,9 +298,53 @@ def gen_flow_regression(dsl_info: DslInfoDict, gen_flow_max_retries: int = 0):
     return full_val_res
 
 
-def main():
+def run_dsl_flow(
+    dsl_info: DslInfoDict, defer_validation: bool = False, do_clean_up: bool = True
+) -> tuple[str, dict, list[list[str]]]:
+    """
+    Run the full pipeline (init workspace -> prep dsl -> regression flow) for a single DSL.
+    Safe to be used as a worker in a process pool: all outputs are returned instead of shared.
+    :param dsl_info: The DSL information dictionary containing 'id' and 'dsl'.
+    :param defer_validation: Skip the final validation (result is None), so that it is run in a batch of DSLs.
+    :param do_clean_up: Whether to clean up the existing DSL workspace, False to augment its existing tests.
+    :return: (dsl_id, validation result, LLM call records of this DSL)
+    """
+    dsl_id = dsl_info["id"]
+    # initialize the DSL workspace and mark it as incomplete until its result is saved, set log file for each dsl
+    initialize_dsl_ws(dsl_info, do_clean_up=do_clean_up)
+    (Path("kirin_ws") / dsl_id / DSL_RUNNING_MARKER).touch()
+    set_log_file(Path("kirin_ws") / dsl_id / f"run.log")
+    try:
+        # prepare kirin_ws/{dsl_id}/dsl
+        prep_dsl_dir(dsl_info)
+
+        # [Main] generate tests, LLM calls are recorded and limited per DSL
+        with LLMWrapper.session(dsl_id) as llm_session:
+            gen_res = gen_flow_regression(dsl_info, do_validate=not defer_validation)
+            LLMWrapper.log_single_record()
+
+        single_record_path = Path("kirin_ws") / dsl_id / f"llm-record.json"
+        with open(single_record_path, "w", encoding="utf-8") as f:
+            json.dump(llm_session.call_chain, f, indent=4, ensure_ascii=False)
+        return dsl_id, gen_res, list(llm_session.call_chain)
+    finally:
+        unset_log_file()
+
+
+def init_dsl_worker(workers: int):
+    """
+    Initialize a DSL worker process: the LLM rate limits and the resources for kirin scans are shared among workers.
+    """
+    LLMWrapper.share_rate_limits(workers)
+    KirinRunner.share_scan_resources(workers)
+
+
+def main(workers: int = 1, batch_validation: bool = False):
     """
     Main function to run the Kirin DSL analysis.
+    :param workers: Number of DSLs processed concurrently in separate processes (1 means sequential).
+    :param batch_validation: Run the final validations of all DSLs after the generations, one kirin run per batch of
+        DSLs. Generated DSLs are marked, so that a failed run only redoes their validation.
     """
     # Load the dataset
     dataset_path = Path("data/test/test_unit.json")
@@ -297,44 +352,96 @@ def main():
         dsl_info_list: list[DslInfoDict] = json.load(f)[:30]
 
     res_path = dataset_path.parent / f"{dataset_path.stem}_result.json"
-    final_result = []
+    final_result_map = dict()  # dataset index -> {dsl_id: gen_res}, saved in dataset order
+    # keep the results saved by previous runs
+    dsl_idx_map = {dsl_info["id"]: i for i, dsl_info in enumerate(dsl_info_list)}
+    if res_path.is_file():
+        with open(res_path, "r", encoding="utf-8") as f:
+            for dsl_res in json.load(f):
+                for dsl_id, gen_res in dsl_res.items():
+                    if dsl_id in dsl_idx_map:
+                        final_result_map[dsl_idx_map[dsl_id]] = {dsl_id: gen_res}
     # create the general kirin workspace if not exists
     kirin_ws_dir = Path("kirin_ws")
     if not kirin_ws_dir.is_dir():
         logger.info(f"Creating general kirin workspace at {kirin_ws_dir}")
         kirin_ws_dir.mkdir(parents=True, exist_ok=True)
 
+    # skip dsls that already have a complete workspace, incomplete ones (e.g. the worker failed) are cleaned up,
+    # other existing workspaces (e.g. created by hand) are augmented
+    pending_dsl_infos = []  # (dataset index, dsl_info, do_clean_up)
+    generated_dsl_ids: dict[int, str] = dict()  # dataset index -> dsl_id, waiting for the final validation
     for i, dsl_info in enumerate(dsl_info_list):
-        logger.info(f"====== Processing DSL #{i + 1}/{len(dsl_info_list)} ======")
-        # initialize the DSL workspace and set log file for each dsl
-        dsl_id = dsl_info["id"]
-        if Path(f"kirin_ws/{dsl_id}").is_dir():
+        dsl_ws_dir = kirin_ws_dir / dsl_info["id"]
+        if (dsl_ws_dir / DSL_DONE_MARKER).is_file():
             logger.info(f"Found existing DSL workspace for {dsl_info['id']}, skip...")
             continue
-        # if (kirin_ws_dir / dsl_id).is_dir():
-        #     logger.info(f"Found existing DSL workspace for {dsl_id}, skip...")
-        #     continue
-
-        initialize_dsl_ws(dsl_info)
-        set_log_file(kirin_ws_dir / dsl_id / f"run.log")
-
-        # prepare kirin_ws/{dsl_id}/dsl
-        prep_dsl_dir(dsl_info)
-
-        # [Main] generate tests
-        LLMWrapper.reset_single_record()
-        gen_res = gen_flow_regression(dsl_info)
+        if (dsl_ws_dir / DSL_GENERATED_MARKER).is_file():
+            logger.info(f"Found generated DSL workspace for {dsl_info['id']}, only validate it...")
+            generated_dsl_ids[i] = dsl_info["id"]
+            continue
+        if (dsl_ws_dir / DSL_RUNNING_MARKER).is_file():
+            logger.warning(f"--> Found incomplete DSL workspace for {dsl_info['id']}, will process it again...")
+            pending_dsl_infos.append((i, dsl_info, True))
+            continue
+        if dsl_ws_dir.is_dir() and i in final_result_map:
+            # workspaces saved before the markers were introduced
+            logger.info(f"Found existing DSL workspace with result for {dsl_info['id']}, skip...")
+            (dsl_ws_dir / DSL_DONE_MARKER).touch()
+            continue
+        if dsl_ws_dir.is_dir():
+            logger.info(f"Found existing DSL workspace for {dsl_info['id']}, will augment its tests...")
+        pending_dsl_infos.append((i, dsl_info, False))
 
-        # collect results
-        final_result.append({dsl_info["id"]: gen_res})
+    def collect_result(i: int, dsl_id: str, gen_res: dict):
+        final_result_map[i] = {dsl_id: gen_res}
         with open(res_path, "w", encoding="utf-8") as f:
+            final_result = [final_result_map[k] for k in sorted(final_result_map)]
             json.dump(final_result, f, indent=4, ensure_ascii=False, sort_keys=True)
+        (kirin_ws_dir / dsl_id / DSL_DONE_MARKER).touch()
+        (kirin_ws_dir / dsl_id / DSL_RUNNING_MARKER).unlink(missing_ok=True)
         logger.info(f"DSL #{i+1} validation result saved to {res_path}")
-        LLMWrapper.log_single_record()
-        single_record_path = Path("kirin_ws") / dsl_info["id"] / f"llm-record.json"
-        with open(single_record_path, "w", encoding="utf-8") as f:
-            json.dump(LLMWrapper.single_call_chain, f, indent=4, ensure_ascii=False)
-        unset_log_file()
+
+    def collect_flow_result(i: int, dsl_id: str, gen_res: dict):
+        if batch_validation:
+            (kirin_ws_dir / dsl_id / DSL_GENERATED_MARKER).touch()
+            generated_dsl_ids[i] = dsl_id
+        else:
+            collect_result(i, dsl_id, gen_res)
+
+    if workers <= 1:
+        for i, dsl_info, do_clean_up in pending_dsl_infos:
+            logger.info(f"====== Processing DSL #{i + 1}/{len(dsl_info_list)} ======")
+            dsl_id, gen_res, _ = run_dsl_flow(dsl_info, defer_validation=batch_validation, do_clean_up=do_clean_up)
+            collect_flow_result(i, dsl_id, gen_res)
+    else:
+        logger.info(f"====== Processing {len(pending_dsl_infos)} DSLs with {workers} workers ======")
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_dsl_worker, initargs=(workers,)) as executor:
+            future_to_idx = {
+                executor.submit(run_dsl_flow, dsl_info, batch_validation, do_clean_up): i
+                for i, dsl_info, do_clean_up in pending_dsl_infos
+            }
+            for future in as_completed(future_to_idx):
+                i = future_to_idx[future]
+                try:
+                    dsl_id, gen_res, call_chain = future.result()
+                except Exception as e:
+                    logger.error(f"--> DSL #{i + 1} ({dsl_info_list[i]['id']}) failed in worker: {e}")
+                    continue
+                # LLM records of workers are not shared with the main process, merge them here
+                LLMWrapper.merge_call_chain(call_chain)
+                collect_flow_result(i, dsl_id, gen_res)
+
+    if generated_dsl_ids:
+        logger.info(f"====== Validating {len(generated_dsl_ids)} generated DSLs ======")
+        if batch_validation:
+            val_res_map = validate_tests_batch(list(generated_dsl_ids.values()), val_type="tmp")
+        else:
+            val_res_map = {dsl_id: validate_tests(dsl_id, val_type="tmp") for dsl_id in generated_dsl_ids.values()}
+        for i, dsl_id in sorted(generated_dsl_ids.items()):
+            failed_dsl_paths = collect_failed_dsl_paths(dsl_id, val_res_map[dsl_id])
+            logger.info(f"Identified {len(failed_dsl_paths)} failed checker DSLs of {dsl_id} to augment tests.")
+            collect_result(i, dsl_id, val_res_map[dsl_id])
 
     # save LLM API call record
     LLMWrapper.log_all_record()
@@ -344,4 +451,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Generate and validate tests for Kirin DSLs.")
+    arg_parser.add_argument("--workers", type=int, default=1, help="number of DSLs processed in parallel")
+    arg_parser.add_argument(
+        "--batch-validation", action="store_true", help="validate all DSLs in batches after generating their tests"
+    )
+    args = arg_parser.parse_args()
+    main(workers=args.workers, batch_validation=args.batch_validation)
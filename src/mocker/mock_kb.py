@@ -0,0 +1,215 @@
+"""
+This module keeps a third-party mock knowledge base shared by all DSL workspaces, so that the mocks of popular classes
+are generated (or fixed by LLM) once and then reused by other workspaces.
+"""
+
+import json, re
+from typing import Callable, Optional
+
+from src.utils._cache import CACHE_DIR, SqliteCache
+from src.utils._logger import logger
+from src.utils._helper import is_third_class
+from src.utils.config import USE_MOCK_KB
+
+USAGE_KEYS = ["constructors", "methods", "fields"]
+DOTTED_NAME_PATTERN = re.compile(r"[A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)+")
+# class references in mock code: qualified names (incl. imports) and simple names (resolved in the same package)
+QUALIFIED_CLASS_PATTERN = re.compile(r"\b[a-z_][\w$]*(?:\.[a-z_][\w$]*)+\.[A-Z][\w$]*")
+SIMPLE_CLASS_PATTERN = re.compile(r"(?<![\w$.])[A-Z][\w$]*")
+
+
+class MockKnowledgeBase:
+    """
+    MockKnowledgeBase maps each third-party class fqn to an entry:
+        usage: member signatures collected by tree-sitter in all workspaces, {usage_key: {sig_hash: signature}}
+        code: the last mock code compiled successfully
+        covered: member keys used by tests which compiled against the code
+    Entries are merged in sqlite transactions, so that workers processing dsls concurrently keep each other's updates.
+    """
+
+    kb_cache = SqliteCache(CACHE_DIR / "mock_kb.db", max_bytes=256 * 1024 * 1024)
+
+    @classmethod
+    def _load_entry(cls, class_fqn: str) -> Optional[dict]:
+        if not USE_MOCK_KB:
+            return None
+        entry_str = cls.kb_cache.get(class_fqn)
+        return json.loads(entry_str) if entry_str is not None else None
+
+    @staticmethod
+    def get_member_keys(class_usage: dict) -> set[str]:
+        """
+        Get the keys of the members in the usage of a class, e.g. "methods:static foo(Object)".
+        The "class" key stands for the class itself, so that unverified code never covers a usage.
+        """
+        member_keys = {"class"}
+        member_keys |= {f"{key}:{sig_hash}" for key in USAGE_KEYS for sig_hash in class_usage.get(key, {})}
+        if "annotation" in class_usage:
+            member_keys |= {f"annotation:{arg_name}" for arg_name in class_usage["annotation"]["arg_type_map"]}
+        return member_keys
+
+    @staticmethod
+    def get_referenced_fqns(class_fqn: str, lib_code: str, is_class: Callable[[str], bool]) -> set[str]:
+        """
+        Get the third-party classes referenced by the mock code of a class.
+        :param is_class: Whether a class of the same package exists, since simple names may also be java.lang classes.
+        :return: The referenced class fqns, excluding the class itself.
+        """
+        package_name = class_fqn.rsplit(".", 1)[0]
+        ref_fqns = {
+            class_name for class_name in QUALIFIED_CLASS_PATTERN.findall(lib_code) if is_third_class(class_name)
+        }
+        for class_name in set(SIMPLE_CLASS_PATTERN.findall(lib_code)):
+            if is_class(f"{package_name}.{class_name}"):
+                ref_fqns.add(f"{package_name}.{class_name}")
+        ref_fqns.discard(class_fqn)
+        return ref_fqns
+
+    @classmethod
+    def get_known_code(
+        cls, class_fqns: list[str], usage_info: Optional[dict] = None, available_fqns: Optional[set[str]] = None
+    ) -> dict[str, str]:
+        """
+        Get the known compilable mock code of the classes.
+        :param class_fqns: The third-party classes to mock.
+        :param usage_info: The tree-sitter usage of the tests, if given, only mocks covering the used members are returned.
+        :param available_fqns: The third-party classes mocked in the current workspace, if given, only mocks whose
+        referenced third-party classes are available or known are returned (known ones out of them are returned too).
+        :return: {"{class_fqn}": "{mock_code}"}
+        """
+        entry_map = dict()
+
+        def _get_code(class_fqn: str) -> str:
+            if class_fqn not in entry_map:
+                entry_map[class_fqn] = cls._load_entry(class_fqn)
+            return entry_map[class_fqn]["code"] if entry_map[class_fqn] else ""
+
+        known_code_map = dict()
+        for class_fqn in class_fqns:
+            if not _get_code(class_fqn):
+                continue
+            if usage_info is not None:
+                member_keys = cls.get_member_keys(usage_info.get(class_fqn, {}))
+                if not member_keys <= set(entry_map[class_fqn]["covered"]):
+                    continue
+            known_code_map[class_fqn] = _get_code(class_fqn)
+
+        if available_fqns is not None:
+            # add the known mocks of the referenced classes out of available_fqns (transitively)
+            ref_map = dict()
+            pending_fqns = list(known_code_map)
+            while pending_fqns:
+                class_fqn = pending_fqns.pop()
+                ref_map[class_fqn] = cls.get_referenced_fqns(
+                    class_fqn, known_code_map[class_fqn], lambda fqn: fqn in available_fqns or bool(_get_code(fqn))
+                )
+                for ref_fqn in ref_map[class_fqn]:
+                    if ref_fqn not in available_fqns and ref_fqn not in known_code_map and _get_code(ref_fqn):
+                        known_code_map[ref_fqn] = _get_code(ref_fqn)
+                        pending_fqns.append(ref_fqn)
+            # drop the mocks referring to unresolved classes and the added mocks no longer referenced
+            while True:
+                resolved_fqns = available_fqns | set(known_code_map)
+                referenced_fqns = set().union(*(ref_map[class_fqn] for class_fqn in known_code_map))
+                dropped_fqns = {
+                    class_fqn
+                    for class_fqn in known_code_map
+                    if not ref_map[class_fqn] <= resolved_fqns
+                    or (class_fqn not in available_fqns and class_fqn not in referenced_fqns)
+                }
+                if not dropped_fqns:
+                    break
+                for class_fqn in dropped_fqns:
+                    del known_code_map[class_fqn]
+
+        if known_code_map:
+            logger.info(
+                f"Found {len(known_code_map)} known mocks in the mock knowledge base: {', '.join(known_code_map)}"
+            )
+        return known_code_map
+
+    @classmethod
+    def get_known_usage(cls, class_fqns: list[str], available_fqns: set[str]) -> dict:
+        """
+        Get the member signatures of the classes collected in other workspaces.
+        Signatures referring to third-party classes out of available_fqns are skipped, since they cannot be compiled.
+        :return: {class_fqn: {usage_key: {sig_hash: signature}}}, same as JavaDependencyParser.usage_info
+        """
+
+        def _is_available(signature: dict) -> bool:
+            type_texts = [signature.get("type", "")] + signature.get("arg_type_list", [])
+            type_texts += list(signature.get("arg_type_map", {}).values())
+            for type_text in type_texts:
+                for type_name in DOTTED_NAME_PATTERN.findall(type_text):
+                    if is_third_class(type_name) and type_name not in available_fqns:
+                        return False
+            return True
+
+        known_usage_info = dict()
+        for class_fqn in class_fqns:
+            entry = cls._load_entry(class_fqn)
+            if not entry:
+                continue
+            class_usage = {
+                usage_key: {h: sig for h, sig in entry["usage"].get(usage_key, {}).items() if _is_available(sig)}
+                for usage_key in USAGE_KEYS
+            }
+            if "annotation" in entry["usage"] and _is_available(entry["usage"]["annotation"]):
+                class_usage["annotation"] = entry["usage"]["annotation"]
+            known_usage_info[class_fqn] = class_usage
+        return known_usage_info
+
+    @classmethod
+    def record_mock_code(cls, lib_code_res: dict[str, str], usage_info: dict):
+        """
+        Record the mock code compiled successfully and merge the member signatures used by the tests.
+        :param lib_code_res: {"{class_fqn}": "{mock_code}"} of the compiled mock jar
+        :param usage_info: The tree-sitter usage of the tests, only for classes whose code compiles the signatures.
+        """
+        if not USE_MOCK_KB:
+            return
+
+        def _merge_entry(entry_str: Optional[str], lib_code: str, class_usage: dict) -> Optional[str]:
+            entry = json.loads(entry_str) if entry_str is not None else {"usage": {}, "code": "", "covered": []}
+            for usage_key in USAGE_KEYS:
+                sig_index = entry["usage"].setdefault(usage_key, {})
+                for sig_hash, signature in class_usage.get(usage_key, {}).items():
+                    sig_index.setdefault(sig_hash, signature)
+            if "annotation" in class_usage:
+                ann_sig = entry["usage"].setdefault("annotation", class_usage["annotation"])
+                for arg_name, arg_type in class_usage["annotation"]["arg_type_map"].items():
+                    ann_sig["arg_type_map"].setdefault(arg_name, arg_type)
+            if entry["code"] != lib_code:
+                # members are covered by the new code only after tests compile against it
+                entry["code"] = lib_code
+                entry["covered"] = []
+            new_entry_str = json.dumps(entry)
+            return new_entry_str if new_entry_str != entry_str else None
+
+        updated_count = 0
+        for class_fqn, lib_code in lib_code_res.items():
+            class_usage = usage_info.get(class_fqn, {})
+            if cls.kb_cache.update(class_fqn, lambda entry_str: _merge_entry(entry_str, lib_code, class_usage)):
+                updated_count += 1
+        logger.info(f"Mock knowledge base: {updated_count}/{len(lib_code_res)} classes updated.")
+
+    @classmethod
+    def record_covered_members(cls, lib_code_res: dict[str, str], usage_info: dict):
+        """
+        Record the members used by the tests as covered by the mock code, after the tests compiled against it.
+        :param lib_code_res: {"{class_fqn}": "{mock_code}"} of the mock jar used by the tests
+        :param usage_info: The tree-sitter usage of the tests.
+        """
+        if not USE_MOCK_KB:
+            return
+
+        def _merge_covered(entry_str: Optional[str], lib_code: str, member_keys: set[str]) -> Optional[str]:
+            entry = json.loads(entry_str) if entry_str is not None else None
+            if not entry or entry["code"] != lib_code or member_keys <= set(entry["covered"]):
+                return None
+            entry["covered"] = sorted(set(entry["covered"]) | member_keys)
+            return json.dumps(entry)
+
+        for class_fqn, lib_code in lib_code_res.items():
+            member_keys = cls.get_member_keys(usage_info.get(class_fqn, {}))
+            cls.kb_cache.update(class_fqn, lambda entry_str: _merge_covered(entry_str, lib_code, member_keys))
@@ -10,6 +10,7 @@ from src.prompts import PROMPTS
 from src.utils._logger import logger
 from src.utils._llm import LLMWrapper
 from src.utils._helper import is_third_class, parse_lib_code
+from src.mocker.mock_kb import MockKnowledgeBase
 
 
 class MockLibGenLLM:
@@ -46,6 +47,15 @@ class MockLibGenLLM:
         potential_libs = ""
         if self.potential_third_fqns:
             potential_libs = f"""### Potential Third-party Classes\n{", ".join(self.potential_third_fqns)}"""
+            # mocks compiled in other workspaces are extended instead of written from scratch
+            known_code_map = MockKnowledgeBase.get_known_code(self.potential_third_fqns)
+            if known_code_map:
+                potential_libs += (
+                    "\n\n### Known Mock Classes (compiled before, keep them and add the missing members)\n"
+                )
+                for class_fqn, lib_code in known_code_map.items():
+                    potential_libs += f"<lib-{class_fqn}>\n{lib_code}\n</lib-{class_fqn}>\n"
+                potential_libs = potential_libs.rstrip()
         prompt = PROMPTS["gen_mock_lib_code"].format(code_snippets=self.all_test_code, potential_libs=potential_libs)
 
         for attempts in range(retry_max_attempts + 1):
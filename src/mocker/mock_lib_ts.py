@@ -4,14 +4,19 @@ This module is used to generate mock libraries for third-party packages using tr
 It can also be used to detect whether the Java codes is using third-party libraries (refer to the res_status and lib_code_map).
 """
 
-import json, re
+import copy, json, os, re, sys
 import tree_sitter_java as tsjava
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import TypedDict
+from typing import Optional, TypedDict
 from tree_sitter import Language, Parser
 
 from src.utils._logger import logger
+from src.utils._cache import CACHE_DIR, SqliteCache, get_file_hash, get_text_hash
+from src.utils.config import TS_PARSE_MIN_FILES, TS_PARSE_WORKERS
 from src.utils._helper import is_third_class, is_standard_class
+from src.mocker.mock_kb import MockKnowledgeBase
 
 # Java Premitive Types -> defult value
 PREMITIVE_TYPE_DEFAULT = {
@@ -53,14 +58,59 @@ class ConstructorSignature(TypedDict):
 
 
 class LibUsageInfo(TypedDict):
-    constructors: list[ConstructorSignature]
-    methods: list[MethodSignature]
-    fields: list[FieldSignature]
+    # {normalized signature hash: signature}, in the order of first usage
+    constructors: dict[str, ConstructorSignature]
+    methods: dict[str, MethodSignature]
+    fields: dict[str, FieldSignature]
 
 
 class JavaDependencyParser:
+    JAVA_LANGUAGE = Language(tsjava.language())
+    # one combined query gathering all nodes of interest in a single pass over the tree
+    DEPENDENCY_QUERY_SOURCE = """
+        (class_declaration) @class_decl
+        (method_declaration) @method_decl
+        (scoped_identifier) @scoped_class
+        (scoped_type_identifier) @scoped_class_type
+        ; String s = com.exp.Class.staticMethod(), class fqn must follow best-practice
+        [
+            (method_invocation
+                object: (field_access
+                    object: (field_access
+                        object: [
+                        (field_access)
+                        (identifier)
+                        ]
+                    )
+                ) @fqn_field
+            )
+            (field_access
+                object: (field_access
+                    object: (field_access
+                        object: [
+                        (field_access)
+                        (identifier)
+                        ]
+                    )
+                ) @fqn_field
+            )
+        ]
+        [
+            (local_variable_declaration)
+            (formal_parameter)
+            (object_creation_expression)
+            (method_invocation)
+            (field_access)
+            (annotation)
+            (marker_annotation)
+        ] @usage
+    """
+    _dependency_query = None
+    # {hash(parser version, file content): [usage_info, sorted expected_third_fqn_set]} of each parsed file
+    usage_cache = SqliteCache(CACHE_DIR / "ts_usage.db", max_bytes=64 * 1024 * 1024)
+    usage_cache_tag = ""
+
     def __init__(self):
-        self.JAVA_LANGUAGE = Language(tsjava.language())
         self.parser = Parser(self.JAVA_LANGUAGE)
 
         self.inner_class_types = set()  # only single file: inner class types
@@ -68,9 +118,18 @@ class JavaDependencyParser:
         self.method_decl_map = {}  # only single file: method_name -> ([arg1_type, arg2_type, ...], ret_type)
         self.type_info = {}  # only single file: x -> String
 
-        self.usage_info = {}  # share among dir: x.y.z.Cls -> {methods: [], fields: []}
+        self.usage_info = {}  # share among dir: x.y.z.Cls -> {methods: {sig_hash: sig}, fields: {sig_hash: sig}, ...}
         self.expected_third_fqn_set = set()  # share among dir: third-party class fqn set
 
+    @classmethod
+    def _get_dependency_query(cls):
+        """
+        Get the combined dependency query, compiled once on first use.
+        """
+        if cls._dependency_query is None:
+            cls._dependency_query = cls.JAVA_LANGUAGE.query(cls.DEPENDENCY_QUERY_SOURCE)
+        return cls._dependency_query
+
     def parse_file(self, file_path: Path):
         """Parse a Java file and extract third-party dependency information."""
         with open(file_path, "rb") as f:
@@ -84,32 +143,115 @@ class JavaDependencyParser:
         self.type_info.clear()
         self.method_decl_map.clear()
 
+        # gather all nodes of interest with one query pass
+        captures = self._get_dependency_query().captures(tree.root_node)
+
         # Extract inner class types to self.inner_class_types
-        self._extract_inner_class_types(tree.root_node)
+        self._extract_inner_class_types(captures.get("class_decl", []))
 
         # Extract imports to self.scoped_class_info
-        self._extract_imports(tree.root_node)
+        self._extract_imports(
+            captures.get("scoped_class", []), captures.get("scoped_class_type", []), captures.get("fqn_field", [])
+        )
 
         # Extract method declarations to self.method_decl_map
-        self._extract_method_decl(tree.root_node)
+        self._extract_method_decl(captures.get("method_decl", []))
 
         if self.scoped_class_info:
-            # Extract usage of imported classes to self.usage_info
+            # Extract usage of imported classes to self.usage_info, in the pre-order of the tree
             self.expected_third_fqn_set.update(self.scoped_class_info.values())
-            self._visit_node(tree.root_node)
+            usage_node_map = dict()
+            for capture_name in ["class_decl", "method_decl", "usage"]:
+                for node in captures.get(capture_name, []):
+                    usage_node_map[(node.start_byte, -node.end_byte, node.type)] = node
+            for node_key in sorted(usage_node_map):
+                self._process_usage_node(usage_node_map[node_key])
 
         return self.usage_info
 
-    def parse_directory(self, directory_path: Path):
-        """Parse all Java files in a directory and extract third-party dependency information."""
+    @classmethod
+    def get_parse_worker_count(cls, file_count: int) -> int:
+        """
+        Get the number of processes parsing files: TS_PARSE_WORKERS if set, otherwise bounded by cores and file count.
+        """
+        if TS_PARSE_WORKERS > 0:
+            return max(1, min(TS_PARSE_WORKERS, file_count))
+        return max(1, min(os.cpu_count() or 1, file_count // TS_PARSE_MIN_FILES))
+
+    @classmethod
+    def get_usage_cache_tag(cls) -> str:
+        """
+        Get the parser version (checksum of this module), cached usage of other versions is invalidated once it changes.
+        """
+        parser_hash = get_file_hash(Path(__file__))
+        if parser_hash != cls.usage_cache_tag:
+            cls.usage_cache.invalidate_other_tags(parser_hash)
+            cls.usage_cache_tag = parser_hash
+        return parser_hash
+
+    def parse_directory(self, directory_path: Path, workers: Optional[int] = None):
+        """
+        Parse all Java files in a directory (in sorted order) and extract third-party dependency information.
+        The usage of each file is cached by its content, only new or changed files are parsed.
+        :param workers: number of processes parsing files, decided by get_parse_worker_count if None
+        """
         assert directory_path.is_dir(), f"directory_path {directory_path} is not a directory"
-        java_files = list(directory_path.rglob("*.java"))
-        for java_file in java_files:
-            logger.info(f"Parsing lib code for file: {java_file}")
-            file_path = java_file.resolve()
-            self.parse_file(file_path)
+        java_files = sorted(java_file.resolve() for java_file in directory_path.rglob("*.java"))
+
+        # per-file usage: (usage_info, expected_third_fqn_set), None if not cached
+        cache_tag = self.get_usage_cache_tag()
+        cache_keys = [get_text_hash(cache_tag, get_file_hash(java_file)) for java_file in java_files]
+        file_usage_list = []
+        for cache_key in cache_keys:
+            cached_usage = self.usage_cache.get(cache_key)
+            file_usage_list.append(json.loads(cached_usage) if cached_usage is not None else None)
+        missed_ids = [i for i, file_usage in enumerate(file_usage_list) if file_usage is None]
+        logger.info(
+            f"Lib usage cache for {directory_path}: {len(java_files) - len(missed_ids)}/{len(java_files)} hits "
+            f"(process total: {self.usage_cache.stats_str()})"
+        )
+
+        missed_files = [java_files[i] for i in missed_ids]
+        workers = min(workers or self.get_parse_worker_count(len(missed_files)), len(missed_files))
+        missed_usage_list = None
+        if workers > 1:
+            logger.info(f"Parsing lib code for {len(missed_files)} files in {directory_path} with {workers} processes")
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    chunk_size = max(1, len(missed_files) // (workers * 4))
+                    missed_usage_list = list(executor.map(_parse_file_usage, missed_files, chunksize=chunk_size))
+            except (OSError, BrokenProcessPool) as e:
+                logger.warning(f"--> Failed to parse lib code in processes ({e}), parsing sequentially...")
+        if missed_usage_list is None:
+            missed_usage_list = []
+            for java_file in missed_files:
+                logger.info(f"Parsing lib code for file: {java_file}")
+                missed_usage_list.append(_parse_file_usage(java_file))
+        for i, (usage_info, third_fqn_set) in zip(missed_ids, missed_usage_list):
+            file_usage_list[i] = (usage_info, third_fqn_set)
+            self.usage_cache.set(cache_keys[i], json.dumps([usage_info, sorted(third_fqn_set)]), tag=cache_tag)
+
+        # merge in the file order, same as parsing the files one by one
+        for usage_info, third_fqn_set in file_usage_list:
+            self.merge_usage(usage_info, set(third_fqn_set))
         return self.usage_info
 
+    def merge_usage(self, usage_info: dict, third_fqn_set: set[str]):
+        """
+        Merge the usage information of other parsed files, as if they were parsed after the current ones.
+        Signatures are collected again, so that duplicates are dropped and annotation arg types are reconciled.
+        """
+        self.expected_third_fqn_set.update(third_fqn_set)
+        for class_fqn, usage in usage_info.items():
+            class_usage = self.usage_info.setdefault(class_fqn, {"constructors": {}, "methods": {}, "fields": {}})
+            for usage_key in ["constructors", "methods", "fields"]:
+                sig_index = class_usage[usage_key]
+                for sig_hash, signature in usage.get(usage_key, {}).items():
+                    if sig_hash not in sig_index:
+                        sig_index[sig_hash] = self._intern_signature(signature)
+            if "annotation" in usage:
+                self._collect_usage(class_fqn, usage["annotation"], "annotation")
+
     def gen_third_party_lib_code(self) -> dict[str, str]:
         """
         Convert the usage information and expected_third_fqn_set to a dictionary of mock code.
@@ -140,7 +282,7 @@ class JavaDependencyParser:
                     res[class_fqn] = lib_code
                     continue
                 # add fields
-                field_sig_list = usage.get("fields", [])
+                field_sig_list = usage.get("fields", {}).values()
                 for field_sig in field_sig_list:
                     if field_sig["is_static"]:
                         field_sig_str = f"public static {field_sig['type']} {field_sig['name']};"
@@ -149,14 +291,14 @@ class JavaDependencyParser:
                     class_body += f"\t{field_sig_str}\n"
                 class_body += "\n"
                 # add constructors
-                constructor_sig_list = usage.get("constructors", [])
+                constructor_sig_list = usage.get("constructors", {}).values()
                 for constructor_sig in constructor_sig_list:
                     arg_str_list = [f"{x} arg_{i+1}" for i, x in enumerate(constructor_sig["arg_type_list"])]
                     class_name = class_fqn.split(".")[-1]
                     constructor_str = f"public {class_name}({', '.join(arg_str_list)}) {{\n\t\t// pass\n\t}}\n"
                     class_body += f"\t{constructor_str}\n"
                 # add methods
-                method_sig_list = usage.get("methods", [])
+                method_sig_list = usage.get("methods", {}).values()
                 for method_sig in method_sig_list:
                     method_name = method_sig["name"]
                     method_type = method_sig["type"]
@@ -190,33 +332,16 @@ class JavaDependencyParser:
             res[class_fqn] = lib_code
         return res
 
-    def _extract_inner_class_types(self, root_node):
-        """Extract all inner class types from the AST."""
-        # inner class types
-        inner_class_query = self.JAVA_LANGUAGE.query(
-            """
-            (class_declaration
-            (identifier) @inner_class_type
-            )
-        """
-        )
-        captures = inner_class_query.captures(root_node)
-        for node in captures.get("inner_class_type", []):
-            class_name = node.text.decode("utf-8")
-            if class_name in self.inner_class_types:
-                continue
+    def _extract_inner_class_types(self, class_decl_nodes):
+        """Extract all inner class types from the class declarations."""
+        for node in class_decl_nodes:
+            class_name = node.child_by_field_name("name").text.decode("utf-8")
             self.inner_class_types.add(class_name)
 
-    def _extract_imports(self, root_node):
-        """Extract all third-party scope classes from the AST."""
+    def _extract_imports(self, scoped_id_nodes, scoped_type_nodes, fqn_field_nodes):
+        """Extract all third-party scope classes from the captured scoped nodes."""
         # scoped_identifiers: import classes, fqn annotations, etc.
-        scoped_id_query = self.JAVA_LANGUAGE.query(
-            """
-            (scoped_identifier) @scoped_class
-        """
-        )
-        captures = scoped_id_query.captures(root_node)
-        for node in captures.get("scoped_class", []):
+        for node in scoped_id_nodes:
             # only get the outer class name
             if node.parent.type == "scoped_identifier":
                 continue
@@ -230,13 +355,7 @@ class JavaDependencyParser:
                 self.scoped_class_info[access_name] = class_fqn
 
         # Process scoped type identifiers, use full name in the code
-        scoped_type_query = self.JAVA_LANGUAGE.query(
-            """
-            (scoped_type_identifier) @scoped_class_type
-        """
-        )
-        captures = scoped_type_query.captures(root_node)
-        for node in captures.get("scoped_class_type", []):
+        for node in scoped_type_nodes:
             # only get the outer class name
             if node.parent.type == "scoped_type_identifier":
                 continue
@@ -246,34 +365,7 @@ class JavaDependencyParser:
             self.scoped_class_info[class_fqn] = class_fqn
 
         # String s = com.exp.Class.staticMethod(), class fqn must follow best-practice
-        static_fqn_query = self.JAVA_LANGUAGE.query(
-            """
-            [
-                (method_invocation
-                    object: (field_access
-                        object: (field_access
-                            object: [
-                            (field_access)
-                            (identifier)
-                            ]
-                        )
-                    ) @fqn_field
-                )
-                (field_access
-                    object: (field_access
-                        object: (field_access
-                            object: [
-                            (field_access)
-                            (identifier)
-                            ]
-                        )
-                    ) @fqn_field
-                )
-            ]
-        """
-        )
-        captures = static_fqn_query.captures(root_node)
-        for node in captures.get("fqn_field", []):
+        for node in fqn_field_nodes:
             if node.parent.type == "field_access":
                 if node.parent.parent.type in ["method_invocation", "field_access"]:
                     continue
@@ -284,16 +376,9 @@ class JavaDependencyParser:
                 continue
             self.scoped_class_info[class_fqn] = class_fqn
 
-    def _extract_method_decl(self, root_node):
-        """Extract all method declarations from the AST."""
-        # method declaration
-        method_decl_query = self.JAVA_LANGUAGE.query(
-            """
-            (method_declaration) @method_decl
-            """
-        )
-        captures = method_decl_query.captures(root_node)
-        for node in captures.get("method_decl", []):
+    def _extract_method_decl(self, method_decl_nodes):
+        """Extract all method declarations from the captured method declarations."""
+        for node in method_decl_nodes:
             method_name = node.child_by_field_name("name").text.decode("utf-8")
             if method_name in self.method_decl_map:
                 continue
@@ -316,66 +401,62 @@ class JavaDependencyParser:
                 arg_types.append(arg_type)
             self.method_decl_map[method_name] = (arg_types, ret_type)
 
-    def _visit_node(self, node):
+    def _process_usage_node(self, node):
         """
-        Visit the program and extract usage information.
+        Extract usage information from a node, nodes must be processed in the pre-order of the tree.
         Since generated by LLM, we assume that the variables using the same name share the same type.
         """
-        # Visit all nodes on the tree
-        for child in node.named_children:
-            if child.type == "local_variable_declaration":
-                var_type = child.child_by_field_name("type").text.decode("utf-8")
-                var_name = child.child_by_field_name("declarator").child_by_field_name("name").text.decode("utf-8")
-                self.type_info[var_name] = var_type
-            elif child.type == "formal_parameter":
-                var_type = child.child_by_field_name("type").text.decode("utf-8")
-                var_name = child.child_by_field_name("name").text.decode("utf-8")
-                self.type_info[var_name] = var_type
-            elif child.type == "class_declaration":
-                self.type_info["this"] = child.child_by_field_name("name").text.decode("utf-8")
-                super_class_node = child.child_by_field_name("superclass")
-                if super_class_node:
-                    super_class_name = super_class_node.named_child(0).text.decode("utf-8")
-                    if super_class_name in self.scoped_class_info:
-                        self.type_info["super"] = self.scoped_class_info[super_class_name]
-                else:
-                    self.type_info.pop("super", None)
-            elif child.type == "method_declaration" and "super" in self.type_info:
-                modifier = ""
-                for sub_node in child.named_children:
-                    if sub_node.type == "modifiers":
-                        modifier = sub_node.text.decode("utf-8")
-                        break
-                if "@Override" in modifier:
-                    modifier = re.sub(r"@\S+", "", modifier).strip()
-                    method_type = child.child_by_field_name("type").text.decode("utf-8")
-                    method_name = child.child_by_field_name("name").text.decode("utf-8")
-                    args_node = child.child_by_field_name("parameters")
-                    arg_type_list = []
-                    for i in range(args_node.named_child_count):
-                        arg_node = args_node.named_child(i)
-                        arg_type = arg_node.child_by_field_name("type").text.decode("utf-8")
-                        arg_type_list.append(arg_type)
-                    method_sig = MethodSignature(
-                        modifier=modifier,
-                        is_static="static" in modifier,
-                        name=method_name,
-                        arg_type_list=arg_type_list,
-                        type=method_type,
-                    )
-                    class_fqn = self.scoped_class_info[self.type_info["super"]]
-                    self._collect_usage(class_fqn, method_sig, "method")
-
-            elif child.type == "object_creation_expression":
-                self._process_constructor(child)
-            elif child.type == "method_invocation":
-                self._process_method_call(child)
-            elif child.type == "field_access":
-                self._process_field_access(child)
-            elif child.type == "annotation" or child.type == "marker_annotation":
-                self._process_annotation(child)
-            # keep traversing
-            self._visit_node(child)
+        if node.type == "local_variable_declaration":
+            var_type = node.child_by_field_name("type").text.decode("utf-8")
+            var_name = node.child_by_field_name("declarator").child_by_field_name("name").text.decode("utf-8")
+            self.type_info[var_name] = var_type
+        elif node.type == "formal_parameter":
+            var_type = node.child_by_field_name("type").text.decode("utf-8")
+            var_name = node.child_by_field_name("name").text.decode("utf-8")
+            self.type_info[var_name] = var_type
+        elif node.type == "class_declaration":
+            self.type_info["this"] = node.child_by_field_name("name").text.decode("utf-8")
+            super_class_node = node.child_by_field_name("superclass")
+            if super_class_node:
+                super_class_name = super_class_node.named_child(0).text.decode("utf-8")
+                if super_class_name in self.scoped_class_info:
+                    self.type_info["super"] = self.scoped_class_info[super_class_name]
+            else:
+                self.type_info.pop("super", None)
+        elif node.type == "method_declaration" and "super" in self.type_info:
+            modifier = ""
+            for sub_node in node.named_children:
+                if sub_node.type == "modifiers":
+                    modifier = sub_node.text.decode("utf-8")
+                    break
+            if "@Override" in modifier:
+                modifier = re.sub(r"@\S+", "", modifier).strip()
+                method_type = node.child_by_field_name("type").text.decode("utf-8")
+                method_name = node.child_by_field_name("name").text.decode("utf-8")
+                args_node = node.child_by_field_name("parameters")
+                arg_type_list = []
+                for i in range(args_node.named_child_count):
+                    arg_node = args_node.named_child(i)
+                    arg_type = arg_node.child_by_field_name("type").text.decode("utf-8")
+                    arg_type_list.append(arg_type)
+                method_sig = MethodSignature(
+                    modifier=modifier,
+                    is_static="static" in modifier,
+                    name=method_name,
+                    arg_type_list=arg_type_list,
+                    type=method_type,
+                )
+                class_fqn = self.scoped_class_info[self.type_info["super"]]
+                self._collect_usage(class_fqn, method_sig, "method")
+
+        elif node.type == "object_creation_expression":
+            self._process_constructor(node)
+        elif node.type == "method_invocation":
+            self._process_method_call(node)
+        elif node.type == "field_access":
+            self._process_field_access(node)
+        elif node.type == "annotation" or node.type == "marker_annotation":
+            self._process_annotation(node)
 
     def _process_constructor(self, constructor_node):
         """Process constructor nodes."""
@@ -653,7 +734,7 @@ class JavaDependencyParser:
         """
         assert usage_type in ["constructor", "method", "field", "annotation"], f"Invalid usage type {usage_type}"
         if class_fqn not in self.usage_info:
-            self.usage_info[class_fqn] = {"constructors": [], "methods": [], "fields": []}
+            self.usage_info[class_fqn] = {"constructors": {}, "methods": {}, "fields": {}}
         usage_key = f"{usage_type}s"
 
         if usage_type == "annotation":
@@ -671,9 +752,19 @@ class JavaDependencyParser:
                 self.usage_info[class_fqn]["annotation"] = signature
         else:
             # check if the signature is already collected
-            hash_list = [self._get_sig_hash(sig, usage_type) for sig in self.usage_info[class_fqn][usage_key]]
-            if not self._get_sig_hash(signature, usage_type) in hash_list:
-                self.usage_info[class_fqn][usage_key].append(signature)
+            sig_index = self.usage_info[class_fqn][usage_key]
+            sig_hash = self._get_sig_hash(signature, usage_type)
+            if sig_hash not in sig_index:
+                sig_index[sig_hash] = self._intern_signature(signature)
+
+    def _intern_signature(self, signature):
+        """Intern the names and types of a stored signature, which are shared by many signatures."""
+        for key in ["name", "type", "modifier"]:
+            if key in signature:
+                signature[key] = sys.intern(signature[key])
+        if "arg_type_list" in signature:
+            signature["arg_type_list"] = [sys.intern(arg_type) for arg_type in signature["arg_type_list"]]
+        return signature
 
     def _get_sig_hash(self, signature, usage_type):
         assert usage_type in ["constructor", "method", "field"], f"Invalid usage type {usage_type}"
@@ -693,6 +784,23 @@ class JavaDependencyParser:
             return hash_str
 
 
+_worker_parser: Optional[JavaDependencyParser] = None
+
+
+def _parse_file_usage(file_path: Path) -> tuple[dict, set[str]]:
+    """
+    Parse a Java file in a worker process, independent of the other files.
+    :return: (usage_info, expected_third_fqn_set) of the file
+    """
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = JavaDependencyParser()
+    _worker_parser.usage_info = {}
+    _worker_parser.expected_third_fqn_set = set()
+    _worker_parser.parse_file(file_path)
+    return _worker_parser.usage_info, _worker_parser.expected_third_fqn_set
+
+
 class MockLibGenTS:
     """
     A wrapper class for gen_mock_lib_code_ts.
@@ -706,17 +814,32 @@ class MockLibGenTS:
         assert len(self.test_filepaths) > 0, f"Test directory {test_dir} does not contain any Java files!"
 
         self.parser = JavaDependencyParser()
+        # usage info of the tests (without the members known from other workspaces)
+        self.usage_info = dict()
 
     def gen_mock_lib_code_ts(self) -> dict[str, str]:
         """
         Use tree-sitter to get all the mock lib codes for each third-party package.
+        Known mocks covering the usage are taken from the mock knowledge base.
         :return: lib_code_map:{"{class_fqn}": "{mock_code}"}
         """
         logger.info(f"Generating mock lib for {len(self.test_filepaths)} tests in {self.test_dir} with tree-sitter...")
         jd_parser = JavaDependencyParser()
         jd_parser.parse_directory(self.test_dir)
         logger.info(f"Lib Parser usage info for {self.test_dir}: \n{json.dumps(jd_parser.usage_info, indent=2)}")
+        self.usage_info = copy.deepcopy(jd_parser.usage_info)
+
+        third_class_fqns = sorted(jd_parser.expected_third_fqn_set)
+        known_code_map = MockKnowledgeBase.get_known_code(
+            third_class_fqns, self.usage_info, jd_parser.expected_third_fqn_set
+        )
+        # also mock the members used in other workspaces, so that the mocks of a class converge across workspaces
+        gen_class_fqns = [class_fqn for class_fqn in third_class_fqns if class_fqn not in known_code_map]
+        jd_parser.merge_usage(
+            MockKnowledgeBase.get_known_usage(gen_class_fqns, jd_parser.expected_third_fqn_set), set()
+        )
         lib_code_map = jd_parser.gen_third_party_lib_code()
+        lib_code_map.update(known_code_map)
 
         if not lib_code_map:
             logger.info(f"No third-party dependencies output by tree-sitter.")
@@ -0,0 +1,174 @@
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PrintStream;
+import java.io.StringWriter;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Locale;
+import java.util.jar.Attributes;
+import java.util.jar.JarEntry;
+import java.util.jar.JarOutputStream;
+import java.util.jar.Manifest;
+import java.util.stream.Stream;
+
+/**
+ * Long-lived javac server used by src/utils/_javac.py, so that each compilation does not launch a new JVM.
+ * Protocol over stdin/stdout, payloads are length-prefixed UTF-8 strings ("{byte_len}\n{bytes}"):
+ * - request "COMPILE {n_options} {n_sources}\n" + n_options * payload(option) + n_sources * (payload(path) + payload(code))
+ * - request "JAR\n" + payload(jar_path) + payload(class_dir)
+ * - request "EXIT\n"
+ * - response: "DIAG\t{kind}\t{line}\t{column}\t{code}\t{path}\t{message}\n" for each diagnostic,
+ *   then "END\t{0|1}\t{info}\n" (tab, newline and backslash in strings are escaped)
+ */
+public class CompileServer {
+
+    /** In-memory compilation unit, keeping the path given by the client. */
+    static class SourceUnit extends SimpleJavaFileObject {
+        final String path;
+        final String code;
+
+        SourceUnit(String path, String code) {
+            super(Paths.get(path).toAbsolutePath().toUri(), Kind.SOURCE);
+            this.path = path;
+            this.code = code;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return code;
+        }
+    }
+
+    public static void main(String[] args) throws IOException {
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        InputStream in = new BufferedInputStream(System.in);
+        PrintStream out = new PrintStream(new BufferedOutputStream(System.out), false, "UTF-8");
+        // stdout is reserved for the protocol
+        System.setOut(System.err);
+
+        String command;
+        while ((command = readLine(in)) != null) {
+            String[] parts = command.trim().split(" ");
+            try {
+                if (parts[0].equals("COMPILE")) {
+                    handleCompile(compiler, in, out, Integer.parseInt(parts[1]), Integer.parseInt(parts[2]));
+                } else if (parts[0].equals("JAR")) {
+                    handleJar(in, out);
+                } else if (parts[0].equals("EXIT")) {
+                    break;
+                } else {
+                    writeEnd(out, false, "unknown command: " + command);
+                }
+            } catch (Exception e) {
+                writeEnd(out, false, e.toString());
+            }
+            out.flush();
+        }
+        out.flush();
+    }
+
+    static void handleCompile(JavaCompiler compiler, InputStream in, PrintStream out, int optionCount, int sourceCount)
+            throws IOException {
+        List<String> options = new ArrayList<>();
+        for (int i = 0; i < optionCount; i++) {
+            options.add(readPayload(in));
+        }
+        List<JavaFileObject> units = new ArrayList<>();
+        for (int i = 0; i < sourceCount; i++) {
+            String path = readPayload(in);
+            units.add(new SourceUnit(path, readPayload(in)));
+        }
+        if (compiler == null) {
+            writeEnd(out, false, "no system java compiler available");
+            return;
+        }
+
+        DiagnosticCollector<JavaFileObject> collector = new DiagnosticCollector<>();
+        StringWriter extraOutput = new StringWriter();
+        boolean success;
+        try (StandardJavaFileManager fileManager =
+                compiler.getStandardFileManager(collector, Locale.ROOT, StandardCharsets.UTF_8)) {
+            success = compiler.getTask(extraOutput, fileManager, collector, options, null, units).call();
+        }
+        for (Diagnostic<? extends JavaFileObject> diagnostic : collector.getDiagnostics()) {
+            JavaFileObject source = diagnostic.getSource();
+            String path = "";
+            if (source instanceof SourceUnit) {
+                path = ((SourceUnit) source).path;
+            } else if (source != null) {
+                path = source.getName();
+            }
+            out.print("DIAG\t" + diagnostic.getKind() + "\t" + diagnostic.getLineNumber() + "\t"
+                    + diagnostic.getColumnNumber() + "\t" + escape(String.valueOf(diagnostic.getCode())) + "\t"
+                    + escape(path) + "\t" + escape(diagnostic.getMessage(Locale.ROOT)) + "\n");
+        }
+        writeEnd(out, success, extraOutput.toString());
+    }
+
+    static void handleJar(InputStream in, PrintStream out) throws IOException {
+        Path jarPath = Paths.get(readPayload(in));
+        Path classDir = Paths.get(readPayload(in));
+        Manifest manifest = new Manifest();
+        manifest.getMainAttributes().put(Attributes.Name.MANIFEST_VERSION, "1.0");
+        List<Path> files = new ArrayList<>();
+        try (Stream<Path> walker = Files.walk(classDir)) {
+            walker.filter(Files::isRegularFile).sorted().forEach(files::add);
+        }
+        if (jarPath.getParent() != null) {
+            Files.createDirectories(jarPath.getParent());
+        }
+        try (JarOutputStream jar = new JarOutputStream(new FileOutputStream(jarPath.toFile()), manifest)) {
+            for (Path file : files) {
+                String entryName = classDir.relativize(file).toString().replace('\\', '/');
+                jar.putNextEntry(new JarEntry(entryName));
+                jar.write(Files.readAllBytes(file));
+                jar.closeEntry();
+            }
+        }
+        writeEnd(out, true, files.size() + " files");
+    }
+
+    static void writeEnd(PrintStream out, boolean success, String info) {
+        out.print("END\t" + (success ? "1" : "0") + "\t" + escape(info) + "\n");
+    }
+
+    static String escape(String text) {
+        return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\r", "\\r").replace("\n", "\\n");
+    }
+
+    static String readLine(InputStream in) throws IOException {
+        ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) != -1 && b != '\n') {
+            buffer.write(b);
+        }
+        if (b == -1 && buffer.size() == 0) {
+            return null;
+        }
+        return buffer.toString(StandardCharsets.UTF_8);
+    }
+
+    static String readPayload(InputStream in) throws IOException {
+        String header = readLine(in);
+        if (header == null) {
+            throw new IOException("unexpected end of input");
+        }
+        byte[] data = in.readNBytes(Integer.parseInt(header.trim()));
+        return new String(data, StandardCharsets.UTF_8);
+    }
+}
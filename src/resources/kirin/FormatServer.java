@@ -0,0 +1,153 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+/**
+ * Resident Kirin formatter used by src/utils/_kirin.py, so that formatting many DSL files only launches one JVM.
+ * Usage: java -cp {helper_dir}:{kirin_cli_jar} FormatServer com.huawei.secbrella.kirin.horn.HornMain
+ * Protocol over stdin/stdout, payloads are length-prefixed UTF-8 strings ("{byte_len}\n{bytes}"):
+ * - request "FORMAT {n_files}\n" + n_files * payload(dsl_path)
+ * - request "EXIT\n"
+ * - response: "RESULT\t{0|1}\t{stdout}\t{stderr}\n" for each file in order, then "END\t{0|1}\t{info}\n"
+ *   (tab, newline and backslash in strings are escaped)
+ */
+public class FormatServer {
+
+    /** Output stream whose target can be switched, so that loggers keeping System.out are captured as well. */
+    static class SwitchableOutputStream extends OutputStream {
+        volatile OutputStream target = OutputStream.nullOutputStream();
+
+        @Override
+        public void write(int b) throws IOException {
+            target.write(b);
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            target.write(b, off, len);
+        }
+    }
+
+    /** Raised instead of exiting the JVM when the formatter calls System.exit. */
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    @SuppressWarnings("removal")
+    public static void main(String[] args) throws Exception {
+        Method formatMain = Class.forName(args[0]).getMethod("main", String[].class);
+        InputStream in = new BufferedInputStream(System.in);
+        PrintStream out = new PrintStream(new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)), false,
+                "UTF-8");
+        SwitchableOutputStream capturedOut = new SwitchableOutputStream();
+        SwitchableOutputStream capturedErr = new SwitchableOutputStream();
+        System.setOut(new PrintStream(capturedOut, true, "UTF-8"));
+        System.setErr(new PrintStream(capturedErr, true, "UTF-8"));
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkExit(int status) {
+                throw new ExitException(status);
+            }
+
+            @Override
+            public void checkPermission(Permission perm) {
+            }
+
+            @Override
+            public void checkPermission(Permission perm, Object context) {
+            }
+        });
+
+        String command;
+        while ((command = readLine(in)) != null) {
+            String[] parts = command.trim().split(" ");
+            try {
+                if (parts[0].equals("FORMAT")) {
+                    int fileCount = Integer.parseInt(parts[1]);
+                    String[] paths = new String[fileCount];
+                    for (int i = 0; i < fileCount; i++) {
+                        paths[i] = readPayload(in);
+                    }
+                    for (String path : paths) {
+                        ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+                        ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+                        capturedOut.target = stdout;
+                        capturedErr.target = stderr;
+                        boolean success = true;
+                        try {
+                            formatMain.invoke(null, (Object) new String[] {"format", path});
+                        } catch (InvocationTargetException e) {
+                            Throwable cause = e.getCause();
+                            success = cause instanceof ExitException && ((ExitException) cause).status == 0;
+                            if (!success) {
+                                stderr.write(String.valueOf(cause).getBytes(StandardCharsets.UTF_8));
+                            }
+                        } finally {
+                            System.out.flush();
+                            System.err.flush();
+                            capturedOut.target = OutputStream.nullOutputStream();
+                            capturedErr.target = OutputStream.nullOutputStream();
+                        }
+                        out.print("RESULT\t" + (success ? "1" : "0") + "\t"
+                                + escape(stdout.toString(StandardCharsets.UTF_8)) + "\t"
+                                + escape(stderr.toString(StandardCharsets.UTF_8)) + "\n");
+                    }
+                    writeEnd(out, true, fileCount + " files");
+                } else if (parts[0].equals("EXIT")) {
+                    break;
+                } else {
+                    writeEnd(out, false, "unknown command: " + command);
+                }
+            } catch (Exception e) {
+                writeEnd(out, false, e.toString());
+            }
+            out.flush();
+        }
+        out.flush();
+        Runtime.getRuntime().halt(0);
+    }
+
+    static void writeEnd(PrintStream out, boolean success, String info) {
+        out.print("END\t" + (success ? "1" : "0") + "\t" + escape(info) + "\n");
+    }
+
+    static String escape(String text) {
+        return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\r", "\\r").replace("\n", "\\n");
+    }
+
+    static String readLine(InputStream in) throws IOException {
+        ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) != -1 && b != '\n') {
+            buffer.write(b);
+        }
+        if (b == -1 && buffer.size() == 0) {
+            return null;
+        }
+        return buffer.toString(StandardCharsets.UTF_8);
+    }
+
+    static String readPayload(InputStream in) throws IOException {
+        String header = readLine(in);
+        if (header == null) {
+            throw new IOException("unexpected end of input");
+        }
+        byte[] data = in.readNBytes(Integer.parseInt(header.trim()));
+        return new String(data, StandardCharsets.UTF_8);
+    }
+}
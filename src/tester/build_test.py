@@ -3,21 +3,34 @@ If a DSL uses third-party libraries, we will generate a mock jar package for it.
 Notably, properties like function and field should also be mocked.
 """
 
-import subprocess, os, shutil, re
+import subprocess, os, shutil, re, zipfile
 import concurrent.futures
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 
 from src.prompts import PROMPTS
 from src.utils._logger import logger
-from src.utils.config import KIRIN_JAVA_HOME
+from src.utils._javac import (
+    JAVAC_RAW_DIAGNOSTICS_OPTION,
+    JavacServer,
+    format_javac_diagnostics,
+    make_javac_diagnostic,
+    parse_javac_output,
+)
+from src.utils._jvm import get_tool_flags
+from src.utils._cache import CACHE_DIR, FileCache, get_file_hash, get_text_hash
+from src.utils.config import KIRIN_JAVA_HOME, USE_JAVAC_SERVER, USE_MOCK_KB
+from src.utils.types import JavacDiagnostic
 from src.mocker.mock_lib_llm import MockLibGenLLM
-from src.mocker.mock_lib_ts import MockLibGenTS
+from src.mocker.mock_kb import MockKnowledgeBase
+from src.mocker.mock_lib_ts import JavaDependencyParser, MockLibGenTS
 from src.utils._llm import LLMWrapper
 from src.tester.gen_test import fix_syntax_error
 from src.tester.edit_test import TestEditor
 from src.tester.manage_test import extract_main_class
-from src.utils._helper import create_dir_with_path, parse_lib_code
+from src.utils._helper import create_dir_with_path, find_sibling_dependencies, parse_lib_code, scratch_dir
 
 
 class TestCompiler:
@@ -26,6 +39,11 @@ class TestCompiler:
     For third-party dependency, it will generate a mock jar package and compile the test cases.
     """
 
+    # compiled mock jars shared by all workspaces: key = hash(jdk, sorted {class_fqn: mock_code})
+    mock_jar_cache = FileCache(CACHE_DIR / "mock_jar", suffix=".jar", max_bytes=1024 * 1024 * 1024)
+    # {javac diagnostic key: count} of the test compile errors in this process
+    error_code_counter: Counter[str] = Counter()
+
     def __init__(self, dsl_id: str, test_dir: Path = None, checker_dsl: str = ""):
         self.dsl_id = dsl_id
         self.dsl_ws_dir = Path(f"kirin_ws/{dsl_id}")
@@ -61,22 +79,156 @@ class TestCompiler:
         self.need_third_party_lib: bool = self.lib_dir.is_dir()
 
         self.failed_tests: list[str] = []  # to store the failed test absolute paths
-
-    def compile_lib_code(self) -> tuple[bool, str]:
+        # {test_abspath: (hash of the test code and mock jar, error diagnostics)} of the last compilation of each test
+        self.test_compile_status: dict[str, tuple[str, list[JavacDiagnostic]]] = dict()
+        # class fqns changed in mock_tmp_dir since the last mock jar build, None if unknown (full rebuild needed)
+        self.changed_lib_fqns: Optional[set[str]] = None
+        # tree-sitter usage info of the tests and the mock code generated from it, for the mock knowledge base
+        self.lib_usage_info: dict = dict()
+        self.ts_lib_code_res: dict[str, str] = dict()
+
+    def compile_lib_code(self) -> tuple[bool, list[JavacDiagnostic]]:
         """
         Compile the mock lib code and generate a jar package.
         Read mock lib code from self.mock_tmp_dir and write the jar package to self.mock_jar_file.
-        :return: (status, error_msg)
+        :return: (status, error diagnostics)
         """
         assert self.mock_tmp_dir.is_dir(), f"--> Mock tmp dirpath for lib code {self.lib_dir} does not exists!"
         # create the lib dir if not exists
         self.lib_dir.mkdir(parents=True, exist_ok=True)
+        lib_filepaths = list(self.mock_tmp_dir.rglob("*.java"))
+        lib_filepaths_str = [str(lib_file) for lib_file in lib_filepaths]
+
+        # the classes in mock_tmp_dir are unknown until this build succeeds (e.g. a cached jar is reused)
+        changed_lib_fqns, self.changed_lib_fqns = self.changed_lib_fqns, None
+        # identical mock sets (often shared by DSLs mocking the same third-party classes) are built only once
+        mock_jar_key = self.get_mock_jar_key(lib_filepaths)
+        if self.mock_jar_cache.materialize(mock_jar_key, self.mock_jar_file):
+            logger.info(
+                f"Reuse cached mock JAR at {self.mock_jar_file} (process total: {self.mock_jar_cache.stats_str()})"
+            )
+            self._record_mock_code()
+            return True, []
+
+        # recompile only the changed classes and their dependents if the previous build is known
+        if changed_lib_fqns and self.mock_jar_file.is_file() and self._update_mock_jar(changed_lib_fqns):
+            lib_compile_res = (True, [])
+        else:
+            # the old jar may be linked to a cache entry, never write it in place
+            self.mock_jar_file.unlink(missing_ok=True)
+            lib_compile_res = self._build_mock_jar(lib_filepaths_str)
+        if lib_compile_res[0]:
+            self.changed_lib_fqns = set()
+            self.mock_jar_cache.store(mock_jar_key, self.mock_jar_file)
+            self._record_mock_code()
+        return lib_compile_res
+
+    def _update_mock_jar(self, changed_fqns: set[str]) -> bool:
+        """
+        Recompile the changed mock classes and the classes depending on them against the previous classes,
+        and update the mock jar in place.
+        :param changed_fqns: class fqns changed (or removed) since the last build
+        :return: True if updated, False if a full rebuild is needed (e.g. compile errors to report)
+        """
+        lib_code_res = self.get_local_lib_code()
+        changed_names = {class_fqn.split(".")[-1] for class_fqn in changed_fqns}
+        name_pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in changed_names) + r")\b")
+        recompile_fqns = {class_fqn for class_fqn in changed_fqns if class_fqn in lib_code_res}
+        recompile_fqns |= {class_fqn for class_fqn, lib_code in lib_code_res.items() if name_pattern.search(lib_code)}
+        logger.info(
+            f"Updating mock JAR incrementally: {len(recompile_fqns)}/{len(lib_code_res)} classes to recompile "
+            f"({len(changed_fqns)} changed)"
+        )
+
+        # drop the stale classes (incl. nested ones) and compile against the other previous classes
+        for class_fqn in recompile_fqns:
+            self._remove_lib_classes(class_fqn)
+        lib_files = [str(self.mock_tmp_dir / f"{class_fqn.replace('.', '/')}.java") for class_fqn in recompile_fqns]
+        if lib_files:
+            try:
+                subprocess.run(
+                    [self.javac_executable, *get_tool_flags("javac"), JAVAC_RAW_DIAGNOSTICS_OPTION]
+                    + ["-encoding", "utf-8", "-nowarn"]
+                    + ["-d", str(self.mock_tmp_dir), "-cp", str(self.mock_tmp_dir)]
+                    + lib_files,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    env={"LANG": "C"},
+                )
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"--> Incremental mock compilation failed, rebuilding all: \n{e.stderr}")
+                return False
+
+        # removed classes (incl. nested ones no longer declared) cannot be deleted by "jar uf", repackage then
+        tmp_jar_file = self.mock_jar_file.with_name(f".{self.mock_jar_file.name}.tmp")
+        with zipfile.ZipFile(self.mock_jar_file) as jar:
+            jar_entries = [name for name in jar.namelist() if name.endswith((".class", ".java"))]
+        if any(not (self.mock_tmp_dir / name).is_file() for name in jar_entries):
+            jar_cmd = ["cf", str(tmp_jar_file), "-C", str(self.mock_tmp_dir), "."]
+        else:
+            # update a private copy, the jar may be linked to a cache entry
+            shutil.copyfile(self.mock_jar_file, tmp_jar_file)
+            jar_cmd = ["uf", str(tmp_jar_file)]
+            for class_fqn in recompile_fqns:
+                class_path = self.mock_tmp_dir / class_fqn.replace(".", "/")
+                for class_file in [class_path.with_suffix(".java"), class_path.with_suffix(".class")] + list(
+                    class_path.parent.glob(f"{class_path.name}$*.class")
+                ):
+                    jar_cmd += ["-C", str(self.mock_tmp_dir), class_file.relative_to(self.mock_tmp_dir).as_posix()]
+        try:
+            subprocess.run(
+                [self.jar_executable, *get_tool_flags("jar")] + jar_cmd,
+                capture_output=True,
+                text=True,
+                check=True,
+                env={"LANG": "C"},
+            )
+            os.replace(tmp_jar_file, self.mock_jar_file)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"--> Failed to update mock JAR, rebuilding all: \n{e}")
+            tmp_jar_file.unlink(missing_ok=True)
+            return False
+        logger.info(f"Successfully updated mock JAR at {self.mock_jar_file}")
+        return True
+
+    def get_mock_jar_key(self, lib_filepaths: list[Path]) -> str:
+        """
+        Get the content key of the mock jar: hash of the JDK and the sorted {class_fqn: mock_code} map.
+        """
+        lib_code_map = {}
+        for lib_file in lib_filepaths:
+            class_fqn = ".".join(lib_file.relative_to(self.mock_tmp_dir).with_suffix("").parts)
+            lib_code_map[class_fqn] = lib_file.read_text(encoding="utf-8")
+        key_texts = [KIRIN_JAVA_HOME]
+        for class_fqn in sorted(lib_code_map):
+            key_texts += [class_fqn, lib_code_map[class_fqn]]
+        return get_text_hash(*key_texts)
+
+    def _build_mock_jar(self, lib_filepaths_str: list[str]) -> tuple[bool, list[JavacDiagnostic]]:
+        """
+        Compile the mock lib code and package the jar, with the javac server if enabled, otherwise with processes.
+        :param lib_filepaths_str: Paths to the mock lib source files
+        :return: (status, error diagnostics)
+        """
+        # the jar packages the whole dir, drop the classes of the previous builds (e.g. removed nested classes)
+        for class_file in self.mock_tmp_dir.rglob("*.class"):
+            class_file.unlink()
+
+        # compile and package within the javac server if enabled
+        javac_server = self._get_javac_server()
+        if javac_server:
+            lib_compile_res = self._compile_lib_with_server(javac_server, lib_filepaths_str)
+            if lib_compile_res is not None:
+                return lib_compile_res
+            logger.warning(f"--> Javac server failed to build mock JAR, falling back to javac processes...")
+
         try:
             # compile
-            lib_filepaths = list(self.mock_tmp_dir.rglob("*.java"))
-            lib_filepaths_str = [str(lib_file) for lib_file in lib_filepaths]
             javac_res = subprocess.run(
-                [self.javac_executable, "-encoding", "utf-8", "-nowarn", "-d", str(self.mock_tmp_dir)]
+                [self.javac_executable, *get_tool_flags("javac"), JAVAC_RAW_DIAGNOSTICS_OPTION]
+                + ["-encoding", "utf-8", "-nowarn"]
+                + ["-d", str(self.mock_tmp_dir)]
                 + lib_filepaths_str,
                 capture_output=True,
                 text=True,
@@ -87,7 +239,15 @@ class TestCompiler:
 
             # package
             jar_res = subprocess.run(
-                [self.jar_executable, "cvf", str(self.mock_jar_file), "-C", str(self.mock_tmp_dir), "."],
+                [
+                    self.jar_executable,
+                    *get_tool_flags("jar"),
+                    "cvf",
+                    str(self.mock_jar_file),
+                    "-C",
+                    str(self.mock_tmp_dir),
+                    ".",
+                ],
                 capture_output=True,
                 text=True,
                 check=True,
@@ -96,110 +256,314 @@ class TestCompiler:
             logger.debug(f"Jar result: \n{jar_res.stdout}")
 
             logger.info(f"Successfully build mock JAR at {self.mock_jar_file}")
-            return True, ""
+            return True, []
         except subprocess.CalledProcessError as e:
             logger.warning(f"--> Failed to build mock JAR for {self.dsl_id}: \n{e}")
             logger.warning(f"Std error: \n{e.stderr}")
-            return False, str(e.stderr)
+            return False, parse_javac_output(str(e.stderr), failed=True, source_files=lib_filepaths_str)
+
+    def _get_javac_server(self) -> Optional[JavacServer]:
+        """
+        Get the shared javac server (started lazily) if enabled in the config.
+        :return: the javac server, None to use javac processes
+        """
+        return JavacServer.get() if USE_JAVAC_SERVER else None
 
-    def _compile_single_file(self, java_file: str) -> tuple[str, bool, str]:
+    def _compile_lib_with_server(
+        self, javac_server: JavacServer, lib_files: list[str]
+    ) -> Optional[tuple[bool, list[JavacDiagnostic]]]:
+        """
+        Compile the mock lib code and package the jar within the javac server.
+        :param javac_server: The running javac server
+        :param lib_files: Paths to the mock lib source files
+        :return: (status, error diagnostics), None if the server is not usable
+        """
+        source_map = {lib_file: Path(lib_file).read_text(encoding="utf-8") for lib_file in lib_files}
+        compile_res = javac_server.compile(source_map, ["-nowarn", "-d", str(self.mock_tmp_dir)])
+        if compile_res is None:
+            return None
+        success, diagnostics = compile_res
+        if not success:
+            error_diagnostics = [d for d in diagnostics if d["kind"] == "ERROR"]
+            logger.warning(
+                f"--> Failed to build mock JAR for {self.dsl_id}: \n{format_javac_diagnostics(error_diagnostics)}"
+            )
+            return False, error_diagnostics
+        if not javac_server.jar(self.mock_jar_file, self.mock_tmp_dir):
+            return None
+        logger.info(f"Successfully build mock JAR at {self.mock_jar_file}")
+        return True, []
+
+    def _compile_files_with_server(
+        self, javac_server: JavacServer, java_files: list[str], target_dir: Path
+    ) -> Optional[dict[str, list[JavacDiagnostic]]]:
+        """
+        Compile all Java files with one request to the javac server and attribute the errors back to each file.
+        Files involved in duplicate class conflicts are recompiled with one request per file.
+        :param javac_server: The running javac server
+        :param java_files: Paths to the Java files to compile
+        :param target_dir: Directory to write the compiled class files
+        :return: {file_path: error diagnostics} for the failed files, None if the server is not usable
+        """
+        source_map = {java_file: Path(java_file).read_text(encoding="utf-8") for java_file in java_files}
+        options = self._javac_test_options(target_dir, max_errs=100000) + ["-XDshould-stop.ifError=FLOW"]
+        compile_res = javac_server.compile(source_map, options)
+        if compile_res is None:
+            return None
+        success, diagnostics = compile_res
+        if success:
+            return dict()
+
+        file_diag_map = dict()
+        for diagnostic in diagnostics:
+            if diagnostic["kind"] == "ERROR":
+                file_diag_map.setdefault(diagnostic["file"], []).append(diagnostic)
+        if not any(file_path in source_map for file_path in file_diag_map):
+            return None
+
+        error_map = dict()
+        for file_path, file_diagnostics in file_diag_map.items():
+            if file_path not in source_map:
+                continue
+            if any(d["code"] == "compiler.err.duplicate.class" for d in file_diagnostics):
+                single_compile_res = javac_server.compile({file_path: source_map[file_path]}, options)
+                if single_compile_res is None:
+                    return None
+                if single_compile_res[0]:
+                    continue
+                file_diagnostics = [d for d in single_compile_res[1] if d["kind"] == "ERROR"]
+            error_map[file_path] = file_diagnostics
+        return error_map
+
+    def _javac_test_options(self, target_dir: Path, max_errs: int = 1000) -> list[str]:
+        """
+        Construct the javac options for compiling tests.
+        :param target_dir: Directory to write the compiled class files
+        :param max_errs: Maximum number of errors reported by javac
+        :return: javac option list
+        """
+        options = ["-Xmaxerrs", str(max_errs), "-encoding", "utf-8", "-nowarn", "-d", str(target_dir)]
+        if self.mock_jar_file.is_file():
+            options += ["-cp", str(self.mock_jar_file)]
+        return options
+
+    def _javac_test_cmd(self, target_dir: Path, max_errs: int = 1000) -> list[str]:
+        """
+        Construct the javac command (without source files) for compiling tests, printing raw diagnostics.
+        :param target_dir: Directory to write the compiled class files
+        :param max_errs: Maximum number of errors reported by javac
+        :return: javac command list
+        """
+        javac_cmd = [self.javac_executable, *get_tool_flags("javac"), JAVAC_RAW_DIAGNOSTICS_OPTION]
+        return javac_cmd + self._javac_test_options(target_dir, max_errs)
+
+    def _compile_single_file(self, java_file: str, target_dir: Path) -> tuple[str, bool, list[JavacDiagnostic]]:
         """
         Compile a single Java file.
         :param java_file: Path to the Java file to compile
-        :return: (file_path, success, error_message)
-        """
-        cmd_list = [
-            self.javac_executable,
-            "-Xmaxerrs",
-            "1000",
-            "-encoding",
-            "utf-8",
-            "-nowarn",
-            "-d",
-            str(self.target_dir),
-        ]
-        if self.mock_jar_file.is_file():
-            cmd_list += ["-cp", str(self.mock_jar_file)]
+        :param target_dir: Directory to write the compiled class files
+        :return: (file_path, success, error diagnostics)
+        """
+        cmd_list = self._javac_test_cmd(target_dir)
         cmd_list.append(java_file)
         env = {"LANG": "C"}
 
         try:
             result = subprocess.run(cmd_list, capture_output=True, text=True, check=False, env=env)
             if result.returncode == 0:
-                return java_file, True, ""
+                return java_file, True, []
             else:
-                return java_file, False, result.stderr
+                diagnostics = parse_javac_output(result.stderr, failed=True, source_files=[java_file])
+                return java_file, False, [d for d in diagnostics if d["kind"] == "ERROR"]
         except Exception as e:
-            return java_file, False, str(e)
+            return java_file, False, [make_javac_diagnostic("ERROR", "", -1, -1, "", str(e))]
 
-    def compile_test_code(self, clear_targets: bool = True) -> tuple[bool, dict[str, str]]:
+    def _compile_separate_files(self, java_files: list[str], target_dir: Path) -> dict[str, list[JavacDiagnostic]]:
         """
-        Compile the test cases. Before compilation, the mock jar lib will also be genrated and installed.
-        Read test cases from test_dir (lib from lib_dir) and write the compiled class files to target_dir.
-        :param clear_targets: Whether to clear the target directory after compilation.
-        :return: (status, error_map)
+        Compile each Java file with its own javac process (in parallel).
+        :param java_files: Paths to the Java files to compile
+        :param target_dir: Directory to write the compiled class files
+        :return: {file_path: error diagnostics} for the failed files
         """
-        # Compile the test cases
-        logger.info(
-            f"Compiling tests {'with' if self.mock_jar_file.is_file() else 'without '} mock lib for {self.test_dir}..."
-        )
-        create_dir_with_path(self.target_dir, cleanup=True)
-        compile_ws_dir = Path("kirin_ws/tmp/test")
-        create_dir_with_path(compile_ws_dir, cleanup=True)
-
-        # move all test files to kirin_ws/tmp/test, get the file mapping
-        compile_test_abspath_list = []
-        compile_ori_test_map = dict()
-        for test_abspath in self.test_abspath_list:
-            test_file = Path(test_abspath)
-            assert test_file.is_file(), f"--> Test file {test_file} does not exist!"
-            # create the target directory structure
-            compile_file_dir = compile_ws_dir / test_file.stem
-            compile_file_dir.mkdir(parents=True, exist_ok=True)
-            # write the test file to the target directory
-            test_code = test_file.read_text(encoding="utf-8")
-            test_main_class = extract_main_class(test_code)
-            compile_file_path = compile_file_dir / f"{test_main_class}.java"
-            compile_file_path.write_text(test_code, encoding="utf-8")
-            # update the compile test list and mapping
-            compile_file_path_str = str(compile_file_path.absolute().as_posix())
-            compile_test_abspath_list.append(compile_file_path_str)
-            compile_ori_test_map[compile_file_path_str] = test_abspath
-
         error_map = dict()
         # Use ThreadPoolExecutor for parallel compilation
-        max_workers = min(len(compile_test_abspath_list), 8)  # Limit to 8 concurrent processes
+        max_workers = min(len(java_files), 8)  # Limit to 8 concurrent processes
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Submit all compilation tasks
             future_to_file = {
-                executor.submit(self._compile_single_file, compile_test_abspath): compile_test_abspath
-                for compile_test_abspath in compile_test_abspath_list
+                executor.submit(self._compile_single_file, java_file, target_dir): java_file for java_file in java_files
             }
 
             # Collect results
             for future in concurrent.futures.as_completed(future_to_file):
-                compile_test_abspath, success, error_msg = future.result()
+                java_file, success, diagnostics = future.result()
                 if not success:
-                    test_abspath = compile_ori_test_map[compile_test_abspath]
-                    error_map[test_abspath] = error_msg
+                    error_map[java_file] = diagnostics
+        return error_map
+
+    @staticmethod
+    def _find_sibling_dependent_files(java_files: list[str]) -> list[str]:
+        """
+        Find the Java files mentioning types declared only in other files (conservatively, by names).
+        In a batch, these types would resolve against the other files, while a test is compiled alone otherwise.
+        :param java_files: Paths to the Java files compiled together
+        :return: paths of the files that may depend on the other files
+        """
+        sibling_dep_map = find_sibling_dependencies([Path(java_file) for java_file in java_files])
+        return [java_file for java_file in java_files if sibling_dep_map[Path(java_file)]]
+
+    def _compile_batch_files(self, java_files: list[str], target_dir: Path) -> dict[str, list[JavacDiagnostic]]:
+        """
+        Compile all Java files with a single javac process and attribute the errors back to each file.
+        Files involved in duplicate class conflicts (or unattributable failures) are recompiled one by one, so are the
+        files mentioning types of the other files, keeping the results of compiling each test alone.
+        :param java_files: Paths to the Java files to compile
+        :param target_dir: Directory to write the compiled class files
+        :return: {file_path: error diagnostics} for the failed files
+        """
+        error_map = self._compile_joint_files(java_files, target_dir)
+        sibling_dependent_files = self._find_sibling_dependent_files(java_files)
+        if sibling_dependent_files:
+            logger.info(
+                f"Found {len(sibling_dependent_files)} tests mentioning types of other tests, compiling them separately..."
+            )
+            for java_file in sibling_dependent_files:
+                error_map.pop(java_file, None)
+            error_map.update(self._compile_separate_files(sibling_dependent_files, target_dir))
+        return error_map
+
+    def _compile_joint_files(self, java_files: list[str], target_dir: Path) -> dict[str, list[JavacDiagnostic]]:
+        """
+        Compile all Java files together (javac server or a single javac process), see _compile_batch_files.
+        """
+        javac_server = self._get_javac_server()
+        if javac_server:
+            error_map = self._compile_files_with_server(javac_server, java_files, target_dir)
+            if error_map is not None:
+                return error_map
+            logger.warning(f"--> Javac server failed to compile tests, falling back to javac processes...")
+
+        # keep attributing and flow-checking every class even after errors in other files
+        cmd_list = self._javac_test_cmd(target_dir, max_errs=100000) + ["-XDshould-stop.ifError=FLOW"] + java_files
+        try:
+            result = subprocess.run(cmd_list, capture_output=True, text=True, check=False, env={"LANG": "C"})
+        except Exception as e:
+            logger.warning(f"--> Batch javac failed to run ({e}), compiling tests separately...")
+            return self._compile_separate_files(java_files, target_dir)
+        if result.returncode == 0:
+            return dict()
+
+        file_diag_map = dict()
+        for diagnostic in parse_javac_output(result.stderr, failed=True, source_files=java_files):
+            if diagnostic["kind"] == "ERROR":
+                file_diag_map.setdefault(diagnostic["file"], []).append(diagnostic)
+        java_file_set = set(java_files)
+        # e.g. file-less errors, or tests with the same file name (javac prints file names only)
+        if not all(file_path in java_file_set for file_path in file_diag_map):
+            logger.warning(f"--> Cannot attribute batch javac errors to tests, compiling tests separately...")
+            return self._compile_separate_files(java_files, target_dir)
+
+        error_map = dict()
+        recompile_files = []
+        for file_path, file_diagnostics in file_diag_map.items():
+            if any(d["code"] == "compiler.err.duplicate.class" for d in file_diagnostics):
+                recompile_files.append(file_path)
+                continue
+            error_map[file_path] = file_diagnostics
+
+        if recompile_files:
+            logger.info(f"Found {len(recompile_files)} tests with duplicate classes, compiling them separately...")
+            error_map.update(self._compile_separate_files(recompile_files, target_dir))
+        return error_map
+
+    def compile_test_code(
+        self, clear_targets: bool = True, batch: bool = True, incremental: bool = False
+    ) -> tuple[bool, dict[str, list[JavacDiagnostic]]]:
+        """
+        Compile the test cases. Before compilation, the mock jar lib will also be genrated and installed.
+        Read test cases from test_dir (lib from lib_dir) and stage them in a private scratch dir for compilation.
+        :param clear_targets: Whether to clear the compiled class files, otherwise they are kept in target_dir.
+        :param batch: Whether to compile all tests with a single javac process instead of one process per test.
+        :param incremental: Whether to reuse the results of tests unchanged since their last compilation (same code
+            and mock jar), only applied if clear_targets.
+        :return: (status, {test_abspath: error diagnostics} of the failed tests)
+        """
+        # the compile result of a test only depends on its code and the mock jar
+        mock_jar_hash = get_file_hash(self.mock_jar_file) if self.mock_jar_file.is_file() else ""
+        test_code_map = {}
+        error_map = dict()
+        for test_abspath in self.test_abspath_list:
+            test_file = Path(test_abspath)
+            assert test_file.is_file(), f"--> Test file {test_file} does not exist!"
+            test_code = test_file.read_text(encoding="utf-8")
+            compile_key = get_text_hash(mock_jar_hash, test_code)
+            test_compile_status = self.test_compile_status.get(test_abspath, None)
+            if incremental and clear_targets and test_compile_status and test_compile_status[0] == compile_key:
+                if test_compile_status[1]:
+                    error_map[test_abspath] = test_compile_status[1]
+                continue
+            test_code_map[test_abspath] = (test_code, compile_key)
+
+        # Compile the test cases
+        logger.info(
+            f"Compiling {len(test_code_map)}/{len(self.test_abspath_list)} tests "
+            f"{'with' if self.mock_jar_file.is_file() else 'without '} mock lib for {self.test_dir}..."
+        )
+        with scratch_dir(f"{self.dsl_id}-test-") as compile_ws_dir:
+            # compiled classes are only kept in target_dir if required
+            if clear_targets:
+                target_dir = compile_ws_dir / "target"
+                target_dir.mkdir()
+            else:
+                target_dir = self.target_dir
+                create_dir_with_path(target_dir, cleanup=True)
+
+            # stage all test files to the scratch dir, get the file mapping
+            compile_test_abspath_list = []
+            compile_ori_test_map = dict()
+            for test_abspath, (test_code, _) in test_code_map.items():
+                test_file = Path(test_abspath)
+                # create the target directory structure
+                compile_file_dir = compile_ws_dir / "src" / test_file.stem
+                compile_file_dir.mkdir(parents=True, exist_ok=True)
+                # write the test file to the target directory
+                test_main_class = extract_main_class(test_code)
+                compile_file_path = compile_file_dir / f"{test_main_class}.java"
+                compile_file_path.write_text(test_code, encoding="utf-8")
+                # update the compile test list and mapping
+                compile_file_path_str = str(compile_file_path.absolute().as_posix())
+                compile_test_abspath_list.append(compile_file_path_str)
+                compile_ori_test_map[compile_file_path_str] = test_abspath
+
+            if not compile_test_abspath_list:
+                compile_error_map = dict()
+            elif batch:
+                compile_error_map = self._compile_batch_files(compile_test_abspath_list, target_dir)
+            else:
+                compile_error_map = self._compile_separate_files(compile_test_abspath_list, target_dir)
+            fresh_error_map = {
+                compile_ori_test_map[compile_test_abspath]: diagnostics
+                for compile_test_abspath, diagnostics in compile_error_map.items()
+            }
+
+        # record the per-file status and merge the reused results
+        for test_abspath, (_, compile_key) in test_code_map.items():
+            self.test_compile_status[test_abspath] = (compile_key, fresh_error_map.get(test_abspath, []))
+        for diagnostics in fresh_error_map.values():
+            self.error_code_counter.update(d["code"] or "unknown" for d in diagnostics)
+        error_map.update(fresh_error_map)
 
         if not error_map:
+            self.failed_tests = []
             logger.info(f"Successfully compiled all {len(self.test_abspath_list)} test cases in {self.test_dir}.")
         else:
             self.failed_tests = sorted(error_map.keys())
-            sorted_errors = [error_map[key] for key in self.failed_tests]
+            sorted_errors = [format_javac_diagnostics(error_map[key]) for key in self.failed_tests]
             error_msg = "\n".join(sorted_errors)
             logger.warning(
                 f"--> Failed to compile {len(self.failed_tests)} out of {len(self.test_abspath_list)} files:\n{error_msg}"
             )
 
-        # clean target directory if needed
-        if clear_targets:
-            shutil.rmtree(self.target_dir)
-
-        # clear the compile_ws_dir directory
-        shutil.rmtree(compile_ws_dir)
-
         status = len(error_map) == 0
         return status, error_map
 
@@ -213,20 +577,58 @@ class TestCompiler:
         if not mock_lib_code_res:
             logger.warning(f"--> Skip install since no mock lib code is generated.")
             return False
-        # create the mock tmp dir if not exists
-        create_dir_with_path(self.mock_tmp_dir, cleanup=True)
+        # diff against the installed lib code, only the changed classes are rewritten (and recompiled)
+        if self.mock_tmp_dir.is_dir():
+            installed_lib_code_res = self.get_local_lib_code()
+        else:
+            create_dir_with_path(self.mock_tmp_dir, cleanup=True)
+            installed_lib_code_res = dict()
+            self.changed_lib_fqns = None
+        changed_fqns = set()
+
+        # remove the classes not in the new lib code
+        for class_fqn in installed_lib_code_res.keys() - mock_lib_code_res.keys():
+            self._remove_lib_class(class_fqn)
+            changed_fqns.add(class_fqn)
+            logger.info(f"Removed mock lib code for {class_fqn}.")
 
         # install the mock lib code to the install_dir
         for class_fqn, lib_code in mock_lib_code_res.items():
+            if installed_lib_code_res.get(class_fqn, None) == lib_code:
+                continue
+            # the new code may no longer declare the nested classes compiled from the old one
+            self._remove_lib_classes(class_fqn)
             class_rel_path = f"{class_fqn.replace('.', '/')}.java"
             lib_file_path = self.mock_tmp_dir / class_rel_path
             # create directory structure
             lib_file_path.parent.mkdir(parents=True, exist_ok=True)
             # write the java file
             lib_file_path.write_text(lib_code, encoding="utf-8")
+            changed_fqns.add(class_fqn)
             logger.info(f"Installed mock lib code for {class_fqn} in {lib_file_path}.")
+
+        if self.changed_lib_fqns is not None:
+            self.changed_lib_fqns |= changed_fqns
+        logger.info(f"Mock lib code installed: {len(changed_fqns)}/{len(mock_lib_code_res)} classes changed.")
         return True
 
+    def _remove_lib_class(self, class_fqn: str):
+        """
+        Remove the source and compiled classes (incl. nested ones) of a mock class from self.mock_tmp_dir.
+        """
+        class_path = self.mock_tmp_dir / class_fqn.replace(".", "/")
+        class_path.with_suffix(".java").unlink(missing_ok=True)
+        self._remove_lib_classes(class_fqn)
+
+    def _remove_lib_classes(self, class_fqn: str):
+        """
+        Remove the compiled classes (incl. nested ones) of a mock class from self.mock_tmp_dir.
+        """
+        class_path = self.mock_tmp_dir / class_fqn.replace(".", "/")
+        class_path.with_suffix(".class").unlink(missing_ok=True)
+        for class_file in class_path.parent.glob(f"{class_path.name}$*.class"):
+            class_file.unlink()
+
     def gen_mock_jar_llm(self, potential_third_fqns: list[str] = [], fix_max_attempts: int = 1) -> bool:
         """
         Generate a mock jar package for the dsl_id using LLM [with fixing].
@@ -244,7 +646,7 @@ class TestCompiler:
         # install the mock lib code
         self.install_lib_code(lib_code_res)
         # compile the mock lib code
-        lib_compile_status, error_msg = self.compile_lib_code()
+        lib_compile_status, lib_diagnostics = self.compile_lib_code()
 
         # fix the mock lib code if compilation fails using LLM
         fix_attempts = 0
@@ -253,22 +655,22 @@ class TestCompiler:
             logger.warning(
                 f"--> [Detected LLM BuildMock Failure] Fixing with LLM[attemp-{fix_attempts}/{fix_max_attempts}]..."
             )
-            lib_code_res = llm_mocker.fix_mock_lib_code(lib_code_res, error_msg)
+            lib_code_res = llm_mocker.fix_mock_lib_code(lib_code_res, format_javac_diagnostics(lib_diagnostics))
             if not lib_code_res:
                 # continue to retry
                 continue
             # install & compile
             self.install_lib_code(lib_code_res)
-            lib_compile_status, error_msg = self.compile_lib_code()
+            lib_compile_status, lib_diagnostics = self.compile_lib_code()
 
         return lib_compile_status
 
     def fix_test_compile(
-        self, error_map: dict[str, str], retry_max_attempts: int = 1
+        self, error_map: dict[str, list[JavacDiagnostic]], retry_max_attempts: int = 1
     ) -> tuple[dict[str, str], dict[str, str]]:
         """
         Fix the failed test cases and mock lib code (if needed) to make them pass compilation for package.
-        :param error_map: The error message map from the compilation.
+        :param error_map: {test_abspath: error diagnostics} from the compilation.
         :param retry_max_attempts: The maximum number of times to retry if parsed nothing.
         :return: {test_file_path: fixed_test_file}, {class_fqn: mock_code"}
         """
@@ -281,7 +683,7 @@ class TestCompiler:
             test_wrapper = "alerting_test" if "PosTest" in test_file else "non_alerting_test"
             test_code = Path(test_file).read_text(encoding="utf-8")
             wrapped_java_code += f"<{test_wrapper}>\n{test_code}\n</{test_wrapper}>\n"
-            full_error_msg += error_map[test_file] + "\n"
+            full_error_msg += format_javac_diagnostics(error_map[test_file]) + "\n"
         wrapped_java_code = wrapped_java_code.rstrip()
         full_error_msg = full_error_msg.rstrip()
         lib_res_ori = dict()
@@ -370,6 +772,32 @@ class TestCompiler:
 
         return lib_code_res
 
+    def _record_mock_code(self):
+        """
+        Record the compiled mock code in the mock knowledge base.
+        Member signatures are only recorded for the classes compiled as mocked by tree-sitter, so that they compile.
+        """
+        if not USE_MOCK_KB:
+            return
+        lib_code_res = self.get_local_lib_code()
+        usage_info = {
+            class_fqn: usage
+            for class_fqn, usage in self.lib_usage_info.items()
+            if class_fqn in lib_code_res and lib_code_res[class_fqn] == self.ts_lib_code_res.get(class_fqn, None)
+        }
+        MockKnowledgeBase.record_mock_code(lib_code_res, usage_info)
+
+    def _record_covered_mocks(self):
+        """
+        Record the mocked members used by the compiled tests in the mock knowledge base.
+        Tests are parsed again (mostly cached), since they may have been fixed since the mock generation.
+        """
+        if not USE_MOCK_KB or not self.need_third_party_lib or not self.mock_tmp_dir.is_dir():
+            return
+        jd_parser = JavaDependencyParser()
+        jd_parser.parse_directory(self.test_dir)
+        MockKnowledgeBase.record_covered_members(self.get_local_lib_code(), jd_parser.usage_info)
+
     def build_tests(self, fix_max_attempts: int = 1) -> bool:
         """
         [Build Main]Build(compile) the test cases for the given DSL ID with multiple attempts.
@@ -386,6 +814,8 @@ class TestCompiler:
         # parse tests' dependency using tree-sitter
         ts_mocker = MockLibGenTS(self.test_dir)
         lib_code_res = ts_mocker.gen_mock_lib_code_ts()
+        self.lib_usage_info = ts_mocker.usage_info
+        self.ts_lib_code_res = dict(lib_code_res)
         self.need_third_party_lib = True if lib_code_res else False
         third_class_fqns_ts = set(lib_code_res.keys())
 
@@ -424,9 +854,10 @@ class TestCompiler:
         test_compile_status = False
         TestEditor.init()
         while not test_compile_status:
-            # Test compilation
-            test_compile_status, error_map = self.compile_test_code()
+            # Test compilation, only the tests edited (or affected by a new mock jar) since the last round
+            test_compile_status, error_map = self.compile_test_code(incremental=True)
             if test_compile_status:
+                self._record_covered_mocks()
                 return True
             # Fix general errors
             logger.warning(f"--> Tests fail to pass compilation. Try general fix...")
@@ -475,6 +906,7 @@ class TestCompiler:
             if self.failed_tests:
                 failed_test_file = ", ".join(self.failed_tests)
                 logger.error(f"{len(error_map.keys())} test cases still failed to compile.")
+            logger.info(f"Most common test compile errors (process total): {self.error_code_counter.most_common(5)}")
 
         return test_compile_status
 
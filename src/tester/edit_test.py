@@ -4,6 +4,10 @@ from pathlib import Path
 from tree_sitter import Language, Parser
 
 from src.utils._logger import logger
+from src.utils._javac import parse_javac_output
+from src.utils.types import JavacDiagnostic
+
+UNREPORTED_EXCEPTION_CODE = "compiler.err.unreported.exception.need.to.catch.or.throw"
 
 
 class TestEditor:
@@ -15,6 +19,11 @@ class TestEditor:
     parser = Parser(JAVA_LANGUAGE)
     # "filename:line_number"
     skip_file_lines: set[str] = set()
+    QUERY_SOURCES = {
+        "method_decl": "(method_declaration) @method_decl",
+        "method_call": "(method_invocation name: (identifier) @method_name)",
+    }
+    _compiled_queries: dict = dict()
 
     @classmethod
     def init(cls):
@@ -24,44 +33,47 @@ class TestEditor:
         cls.skip_file_lines.clear()
 
     @classmethod
-    def fix_general_error(cls, error_map: dict[str, str]) -> bool:
+    def fix_general_error(cls, error_map: dict[str, list[JavacDiagnostic]]) -> bool:
         """
         Try fixing general compilation errors in test files using tree-sitter.
-        :param error_map: A dictionary mapping file names to error messages.
+        :param error_map: A dictionary mapping file names to their javac error diagnostics.
         :return: True if any unreported exceptions were fixed, False otherwise.
         """
-        for file_name, error_msg in error_map.items():
-            if f"{file_name}:{error_msg}" in cls.skip_file_lines:
-                logger.info(f"Skipping {file_name} due to previously fixed errors.")
-                continue
-
-            do_fix_flag = False
-            unreported_exception_match = re.search(
-                r"\w+\.java:(\d+): error: unreported (exception|error) (\w+); must be caught or declared to be thrown",
-                error_msg,
-            )
-            if unreported_exception_match:
-                line_number = int(unreported_exception_match.group(1))
-                exception_name = unreported_exception_match.group(3)
+        do_fix_flag = False
+        for file_name, diagnostics in error_map.items():
+            # all unreported exceptions of a file are fixed in one pass
+            line_exceptions = {
+                d["line"]: d["exception"].split(".")[-1]
+                for d in diagnostics
+                if d["code"] == UNREPORTED_EXCEPTION_CODE and d["exception"]
+            }
+            skipped_lines = [line for line in line_exceptions if f"{file_name}:{line}" in cls.skip_file_lines]
+            for line_number in skipped_lines:
+                line_exceptions.pop(line_number)
+            if skipped_lines:
+                logger.info(f"Skipping lines {skipped_lines} of {file_name} due to previously fixed errors.")
+            if line_exceptions:
                 test_file = Path(file_name)
                 do_fix_flag = True
                 if test_file.exists():
+                    # each error line is fixed at most once, errors remaining there are left to the LLM
+                    cls.skip_file_lines.update(f"{file_name}:{line_number}" for line_number in line_exceptions)
                     try:
-                        cls.fix_unreported_exception(test_file, line_number, exception=exception_name, do_replace=True)
+                        cls.fix_unreported_exceptions(test_file, line_exceptions, do_replace=True)
                     except Exception as e:
-                        cls.skip_file_lines.add(f"{file_name}:{line_number}")
-                        logger.error(f"Failed to fix unreported exception in {test_file} at line {line_number}: {e}")
+                        logger.error(
+                            f"Failed to fix unreported exceptions in {test_file} at lines {sorted(line_exceptions)}: {e}"
+                        )
                 else:
                     logger.error(f"Test file {file_name} does not exist.")
 
             # [INFO] Do not fix for never throw exception for now, since it may cause checking logic change.
-            # never_throw_exception_match = re.search(
-            #     r"\w+\.java:(\d+): error: (exception|error) (\w+) is never thrown in body of corresponding try statement",
-            #     error_msg,
+            # never_throw_diagnostic = next(
+            #     (d for d in diagnostics if d["code"] == "compiler.err.except.never.thrown.in.try"), None
             # )
-            # if never_throw_exception_match:
-            #     line_number = int(never_throw_exception_match.group(1))
-            #     wrong_exception = never_throw_exception_match.group(3)
+            # if never_throw_diagnostic:
+            #     line_number = never_throw_diagnostic["line"]
+            #     wrong_exception = never_throw_diagnostic["exception"].split(".")[-1]
             #     test_file = Path(file_name)
             #     do_fix_flag = True
             #     if test_file.exists():
@@ -104,94 +116,97 @@ class TestEditor:
             )
 
     @classmethod
-    def fix_unreported_exception(cls, test_file: Path, error_line: int, exception="Exception", do_replace=False) -> str:
+    def _get_query(cls, query_name: str):
+        """
+        Get the tree-sitter query by name, compiled once on first use.
+        """
+        if query_name not in cls._compiled_queries:
+            cls._compiled_queries[query_name] = cls.JAVA_LANGUAGE.query(cls.QUERY_SOURCES[query_name])
+        return cls._compiled_queries[query_name]
+
+    @classmethod
+    def fix_unreported_exceptions(cls, test_file: Path, line_exceptions: dict[int, str], do_replace=False) -> str:
         """
-        Fix unreported exception in the test file by adding "throws Exception" or "throws Error" to the method containing the error line,
-        also add the default exception to enclosing method that invoking the target method.
+        Fix unreported exceptions in the test file by adding "throws Exception" or "throws Error" to the methods containing
+        the error lines, also add the default exceptions to enclosing methods that invoke the fixed methods.
+        All errors are fixed on one parse tree and the file is written once.
         :param test_file: Path to the test file.
-        :param error_line: The line containing the compilation error. (starting from 1)
-        :return: The transformed code with the exception fixed.
+        :param line_exceptions: {error_line (starting from 1): unreported exception type}
+        :return: The transformed code with the exceptions fixed.
         """
-        default_exception = "Exception" if exception.endswith("Exception") else "Error"
-        # Parse the test file
-        with open(test_file, "r", encoding="utf-8") as f:
-            code = f.read()
-        fixed_code = ""
-
-        # all methods need to be declared with throws Exception or throws Error
-        edit_method_nodes = []
-
-        # Find the method node containing the specified line number
-        tree = cls.parser.parse(bytes(code, "utf8"))
-        root_node = tree.root_node
-        method_decl_query = cls.JAVA_LANGUAGE.query(
-            """
-            (method_declaration) @method_decl
-            """
-        )
-        method_decl_captures = method_decl_query.captures(root_node)
-        method_decl_nodes = method_decl_captures.get("method_decl", [])
-        target_method_node = None
-        for node in method_decl_nodes:
-            start_line = node.start_point[0]  # start from 0
-            end_line = node.end_point[0]  # end at 0
-            if start_line <= error_line - 1 <= end_line:
-                if target_method_node is None or target_method_node.startpoint[0] >= start_line:
-                    target_method_node = node
-        assert target_method_node is not None, f"Cannot find target method containing line {error_line} in {test_file}"
-        target_method_name = target_method_node.child_by_field_name("name").text.decode("utf-8")
-        edit_method_nodes.append(target_method_node)
-
-        # find enclosing methods that may implicitly invoke the target method
-        target_method_names = {target_method_name}
-        while target_method_names:
-            match_pattern = "|".join(target_method_names)
-            target_method_names.clear()
-            method_call_query = cls.JAVA_LANGUAGE.query(
-                f"""
-                (method_invocation
-                    name: (identifier) @method_name
-                    (#match? @method_name "^({match_pattern})$")
-                ) @method_call
-                """
-            )
-            method_call_captures = method_call_query.captures(root_node)
-            if not method_call_captures:
-                break
-            for method_call_node in method_call_captures.get("method_call", []):
-                # get the enclosing method node
-                parent_node = method_call_node.parent
-                while parent_node is not None and parent_node.type != "method_declaration":
-                    parent_node = parent_node.parent
-                enclosing_method_node = parent_node
-                if enclosing_method_node:
-                    edit_method_nodes.append(enclosing_method_node)
-                    target_method_names.add(enclosing_method_node.child_by_field_name("name").text.decode("utf-8"))
-
-        # edit all methods
-        method_sigs_to_fix = set()
-        for method_node in edit_method_nodes:
-            # only edit the method signature before {
+        code_bytes = test_file.read_bytes()
+        root_node = cls.parser.parse(code_bytes).root_node
+        method_decl_nodes = cls._get_query("method_decl").captures(root_node).get("method_decl", [])
+
+        # {method start_byte: (method node, default exceptions to declare)}
+        edit_method_map: dict[int, tuple] = dict()
+        pending_methods = []
+        for error_line, exception in sorted(line_exceptions.items()):
+            default_exception = "Exception" if exception.endswith("Exception") else "Error"
+            # the innermost method containing the line (e.g. a method of an anonymous class)
+            target_method_node = None
+            for node in method_decl_nodes:
+                if node.start_point[0] <= error_line - 1 <= node.end_point[0]:
+                    if target_method_node is None or target_method_node.start_byte < node.start_byte:
+                        target_method_node = node
+            if target_method_node is None:
+                logger.warning(f"--> Cannot find target method containing line {error_line} in {test_file}")
+                continue
+            pending_methods.append((target_method_node, {default_exception}))
+        if not pending_methods:
+            raise ValueError(f"Cannot find target methods containing lines {sorted(line_exceptions)} in {test_file}")
+
+        # {method_name: [enclosing method nodes of its invocations]}
+        caller_map: dict[str, list] = dict()
+        for method_name_node in cls._get_query("method_call").captures(root_node).get("method_name", []):
+            parent_node = method_name_node.parent
+            while parent_node is not None and parent_node.type != "method_declaration":
+                parent_node = parent_node.parent
+            if parent_node is not None:
+                caller_map.setdefault(method_name_node.text.decode("utf-8"), []).append(parent_node)
+
+        # propagate the exceptions to the enclosing methods that may implicitly invoke the fixed methods
+        while pending_methods:
+            method_node, exceptions = pending_methods.pop()
+            _, declared_exceptions = edit_method_map.setdefault(method_node.start_byte, (method_node, set()))
+            new_exceptions = exceptions - declared_exceptions
+            if not new_exceptions:
+                continue
+            declared_exceptions |= new_exceptions
+            method_name = method_node.child_by_field_name("name").text.decode("utf-8")
+            for caller_node in caller_map.get(method_name, []):
+                pending_methods.append((caller_node, new_exceptions))
+
+        # edit the method signatures (before the body), from the end so that byte offsets stay valid
+        fixed_code_bytes = code_bytes
+        for method_start in sorted(edit_method_map, reverse=True):
+            method_node, exceptions = edit_method_map[method_start]
             method_body_node = method_node.child_by_field_name("body")
-            body_start = method_body_node.start_byte - method_node.start_byte
-            method_sig = method_node.text[:body_start].decode("utf-8").strip()
-            method_sigs_to_fix.add(method_sig)
-        fixed_code = code
-        for method_sig in method_sigs_to_fix:
-            fixed_method_sig = method_sig
-            if "throws" in method_sig:
-                # replace existing throws clause
-                fixed_method_sig = re.sub(r"throws.*$", f"throws {default_exception}", method_sig)
-            else:
-                # add throws clause befor the first {
-                fixed_method_sig += f" throws {default_exception}"
-            # replace the method code in the original code
-            fixed_code = fixed_code.replace(method_sig, fixed_method_sig)
+            if method_body_node is None:
+                continue
+            method_sig = code_bytes[method_start : method_body_node.start_byte].decode("utf-8")
+            stripped_sig = method_sig.rstrip()
+            throws_match = re.search(r"\bthrows\b(.*)$", stripped_sig, flags=re.S)
+            if throws_match:
+                # keep the declared kinds (as the default exception) which are replaced by the new clause
+                declared_types = [t.strip() for t in throws_match.group(1).split(",")]
+                exceptions = exceptions | {
+                    t for t in ("Exception", "Error") if any(d.endswith(t) for d in declared_types)
+                }
+                stripped_sig = stripped_sig[: throws_match.start()].rstrip()
+            throws_clause = ", ".join(sorted(exceptions, key=lambda e: e != "Exception"))
+            fixed_sig = f"{stripped_sig} throws {throws_clause}" + method_sig[len(method_sig.rstrip()) :]
+            fixed_code_bytes = (
+                fixed_code_bytes[:method_start]
+                + fixed_sig.encode("utf-8")
+                + fixed_code_bytes[method_body_node.start_byte :]
+            )
+        fixed_code = fixed_code_bytes.decode("utf-8")
 
         if do_replace:
             test_file.write_text(fixed_code, encoding="utf-8")
             logger.info(
-                f"Fixed unreported exception in {test_file} at line {error_line} for {len(edit_method_nodes)} methods."
+                f"Fixed {len(line_exceptions)} unreported exceptions in {test_file} for {len(edit_method_map)} methods."
             )
 
         return fixed_code
@@ -200,9 +215,10 @@ class TestEditor:
 if __name__ == "__main__":
     # Example usage
     error_map = {
-        "kirin_ws/test_tmp/test/TmpTest.java": """kirin_ws\\test_tmp\\test\\TmpTest.java:6: error: unreported exception ParserConfigurationException; must be caught or declared to be thrown
-        factory.setFeature("some.other.feature", true);
-                          ^
-1 error"""
+        "kirin_ws/test_tmp/test/TmpTest.java": parse_javac_output(
+            """TmpTest.java:6:27: compiler.err.unreported.exception.need.to.catch.or.throw: ParserConfigurationException
+1 error""",
+            source_files=["kirin_ws/test_tmp/test/TmpTest.java"],
+        )
     }
     TestEditor.fix_general_error(error_map)
@@ -1,4 +1,4 @@
-import re, json
+import re, json, asyncio
 from pathlib import Path
 
 from src.prompts import PROMPTS, SYS_PROMPTS
@@ -186,6 +186,41 @@ def gen_checker_tests(
         alerting_test_list: A list of alerting test cases.
         non_alerting_test_list: A list of non-alerting test cases.
     """
+    return asyncio.run(agen_checker_tests(checker_dsl, gen_type, add_dsl_references, retry_max_attempts))
+
+
+def gen_checker_tests_many(
+    checker_dsl: str,
+    gen_types: list[str],
+    add_dsl_references: bool = True,
+    retry_max_attempts: int = 1,
+) -> list[tuple[list[str], list[str]]]:
+    """
+    Generate test cases of several types for the given Checker DSL concurrently (LLM queries within the rate limits).
+    :return: [(alerting_test_list, non_alerting_test_list), ...] in the order of gen_types
+    """
+
+    async def gen_all():
+        return await asyncio.gather(
+            *[
+                agen_checker_tests(checker_dsl, gen_type, add_dsl_references, retry_max_attempts)
+                for gen_type in gen_types
+            ]
+        )
+
+    return list(asyncio.run(gen_all()))
+
+
+async def agen_checker_tests(
+    checker_dsl: str,
+    gen_type: str = "all",
+    add_dsl_references: bool = True,
+    retry_max_attempts: int = 1,
+) -> tuple[list[str], list[str]]:
+    """
+    Generate test cases for the given Checker DSL asynchronously, see gen_checker_tests.
+    The syntax fixing of the generated tests runs in a worker thread, so that concurrent generations overlap.
+    """
     assert gen_type in [
         "all",
         "alerting",
@@ -212,10 +247,10 @@ def gen_checker_tests(
             # 0 is the first attempt, others are retries
             logger.warning(f"--> [Detected LLM GenTest Failure] Retrying (attempt {attempt}/{retry_max_attempts})...")
         # query the LLM
-        llm_response = LLMWrapper.query_llm(user_prompt, system_prompt=sys_prompt, query_type=query_type)
+        llm_response = await LLMWrapper.aquery_llm(user_prompt, system_prompt=sys_prompt, query_type=query_type)
         logger.debug(f"LLM TestGenerator result: \n{llm_response}")
         # parse the response
-        alerting_test_list, non_alerting_test_list = extract_checker_tests(llm_response)
+        alerting_test_list, non_alerting_test_list = await asyncio.to_thread(extract_checker_tests, llm_response)
         if gen_type in ["alerting", "all"] and len(alerting_test_list) == 0:
             logger.error(
                 f"--> [Detected LLM GenTest Failure] No Alerting test cases generated! Please check the LLM output."
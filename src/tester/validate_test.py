@@ -1,11 +1,20 @@
-import os
+import os, re, json, shutil, zipfile
 import xml.etree.ElementTree as ET
 from pathlib import Path
+from typing import Iterator, Optional
 
 from src.utils._kirin import KirinRunner
 from src.utils._logger import logger
+from src.utils._helper import find_sibling_dependencies, scratch_dir
+from src.utils._cache import CACHE_DIR, SqliteCache, get_file_hash, get_text_hash
 from src.utils.types import DslValResDict
 
+# verdict cache: key = hash(kirin jar + lib jars, checker file, test file (+ its sibling dependencies) name + content),
+# value = json report lines
+verdict_cache = SqliteCache(CACHE_DIR / "kirin_verdict.db", max_bytes=128 * 1024 * 1024)
+
+JAVA_PACKAGE_PATTERN = re.compile(rb"^\s*package\s+([\w.]+)\s*;", re.MULTILINE)
+
 
 def validate_tests(dsl_id, val_type: str = "all") -> DslValResDict:
     """
@@ -28,13 +37,314 @@ def validate_tests(dsl_id, val_type: str = "all") -> DslValResDict:
     logger.info(
         f"==> Validating checker tests in {cur_ws_dir} in {val_type} mode {'with' if lib_dir.is_dir() else 'without'} lib..."
     )
-    # execute kirin dsl (report dir will be automatically created in the test dir)
-    if lib_dir.exists():
-        KirinRunner.execute_kirin_dsl(dsl_dir, test_dir, report_dir, lib_dir)
-    else:
-        KirinRunner.execute_kirin_dsl(dsl_dir, test_dir, report_dir)
+    checker_files = sorted(dsl_dir.rglob("*.kirin"))
+    test_files = sorted(test_dir.rglob("*.java"))
+    if not checker_files or not test_files:
+        logger.error(f"--> No dsls or test cases are found in {cur_ws_dir}!")
+        return dict()
+    env_hash = get_verdict_env_hash(lib_dir)
+    test_dep_map = get_test_dependencies(test_files)
+
+    # look up the verdicts of all (checker, test) pairs, only the missed checkers and tests are scanned by kirin
+    checker_reports: dict[str, dict[str, list[int]]] = {checker_file.stem: dict() for checker_file in checker_files}
+    scan_files = set()
+    verdict_keys: dict[tuple[Path, Path], str] = {}
+    missed_checkers, missed_tests = [], []
+    for checker_file in checker_files:
+        checker_hash = get_file_hash(checker_file)
+        for test_file in test_files:
+            verdict_key = get_verdict_key(env_hash, checker_hash, test_file, test_dep_map[test_file])
+            verdict = verdict_cache.get(verdict_key)
+            if verdict is None:
+                verdict_keys[(checker_file, test_file)] = verdict_key
+                if checker_file not in missed_checkers:
+                    missed_checkers.append(checker_file)
+                if test_file not in missed_tests:
+                    missed_tests.append(test_file)
+                continue
+            scan_files.add(test_file.name)
+            report_lines = json.loads(verdict)
+            if report_lines:
+                checker_reports[checker_file.stem][test_file.name] = report_lines
+    logger.info(
+        f"Verdict cache: {len(checker_files) * len(test_files) - len(verdict_keys)}/"
+        f"{len(checker_files) * len(test_files)} hits, scanning {len(missed_checkers)} checkers x {len(missed_tests)} tests"
+    )
+
+    if missed_checkers:
+        # the missed tests are scanned with the tests declaring the types they mention
+        scan_tests = sorted(set(missed_tests).union(*(test_dep_map[test_file] for test_file in missed_tests)))
+        fresh_res = scan_checker_tests(
+            dsl_id, dsl_dir, test_dir, missed_checkers, scan_tests, report_dir, lib_dir if lib_dir.exists() else None
+        )
+        if fresh_res is None:
+            return dict()
+        fresh_reports, fresh_scan_files = fresh_res
+        # checker names not matching the checker files cannot be attributed, do not cache this run
+        unknown_checkers = [checker_name for checker_name in fresh_reports if checker_name not in checker_reports]
+        if unknown_checkers:
+            logger.warning(f"--> Unknown checkers {unknown_checkers} in the report, skip caching verdicts.")
+        for (checker_file, test_file), verdict_key in verdict_keys.items():
+            if test_file.name not in fresh_scan_files:
+                continue
+            report_lines = fresh_reports.get(checker_file.stem, dict()).get(test_file.name, [])
+            if report_lines:
+                checker_reports[checker_file.stem][test_file.name] = report_lines
+            if not unknown_checkers:
+                verdict_cache.set(verdict_key, json.dumps(report_lines), tag=env_hash)
+        for checker_name in unknown_checkers:
+            checker_reports[checker_name] = fresh_reports[checker_name]
+        scan_files |= fresh_scan_files
+
+    return build_val_result(checker_reports, scan_files)
+
+
+def get_verdict_env_hash(lib_dir: Path) -> str:
+    """
+    Get the hash of everything besides the checker and the test that affects a verdict: the kirin jar and the lib jars.
+    """
+    env_texts = [get_file_hash(Path(KirinRunner.kirin_cli_path))]
+    if lib_dir.is_dir():
+        for lib_file in sorted(lib_dir.rglob("*")):
+            if lib_file.is_file():
+                env_texts += [lib_file.relative_to(lib_dir).as_posix(), get_file_hash(lib_file)]
+    return get_text_hash(*env_texts)
+
+
+def get_verdict_key(env_hash: str, checker_hash: str, test_file: Path, dep_files: list[Path] = ()) -> str:
+    """
+    Get the verdict cache key of a (checker, test) pair.
+    :param dep_files: The other tests the test depends on, see get_test_dependencies.
+    """
+    dep_texts = [text for dep_file in dep_files for text in (dep_file.name, get_file_hash(dep_file))]
+    return get_text_hash(env_hash, checker_hash, test_file.name, get_file_hash(test_file), *dep_texts)
+
+
+def get_test_dependencies(test_files: list[Path]) -> dict[Path, list[Path]]:
+    """
+    Get the other tests each test depends on (transitively), which must be scanned along with it.
+    :return: {test_file: sorted paths of its dependencies}
+    """
+    sibling_dep_map = find_sibling_dependencies(test_files)
+    test_dep_map = dict()
+    for test_file in test_files:
+        dep_files, pending_files = set(), [test_file]
+        while pending_files:
+            for dep_file in sibling_dep_map[pending_files.pop()]:
+                if dep_file != test_file and dep_file not in dep_files:
+                    dep_files.add(dep_file)
+                    pending_files.append(dep_file)
+        test_dep_map[test_file] = sorted(dep_files)
+    return test_dep_map
+
+
+def has_cached_verdicts(dsl_id, val_type: str = "all") -> bool:
+    """
+    Check whether the verdicts of all (checker, test) pairs of a DSL are cached, i.e. validate_tests runs no kirin scan.
+    """
+    cur_ws_dir = Path(f"kirin_ws/{dsl_id}") if val_type == "all" else Path(f"kirin_ws/{dsl_id}/tmp")
+    checker_files = sorted((cur_ws_dir / "dsl").rglob("*.kirin"))
+    test_files = sorted((cur_ws_dir / "test").rglob("*.java"))
+    if not checker_files or not test_files:
+        return False
+    env_hash = get_verdict_env_hash(Path(f"kirin_ws/{dsl_id}") / "lib")
+    test_dep_map = get_test_dependencies(test_files)
+    for checker_file in checker_files:
+        checker_hash = get_file_hash(checker_file)
+        for test_file in test_files:
+            if verdict_cache.get(get_verdict_key(env_hash, checker_hash, test_file, test_dep_map[test_file])) is None:
+                return False
+    return True
+
+
+def scan_checker_tests(
+    dsl_id: str,
+    dsl_dir: Path,
+    test_dir: Path,
+    checker_files: list[Path],
+    test_files: list[Path],
+    report_dir: Path,
+    lib_dir: Optional[Path] = None,
+) -> Optional[tuple[dict[str, dict[str, list[int]]], set[str]]]:
+    """
+    Run kirin on a subset of the checkers and tests, staged in a scratch workspace.
+    :return: (checker_reports, scan_files) as parse_xml_report, None if kirin produced no report
+    """
+    with scratch_dir("kirin-val-") as tmp_dir:
+        for src_dir, files, dst_dir in [
+            (dsl_dir, checker_files, tmp_dir / "dsl"),
+            (test_dir, test_files, tmp_dir / "test"),
+        ]:
+            for file_path in files:
+                dst_path = dst_dir / file_path.relative_to(src_dir)
+                dst_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(file_path, dst_path)
+        # execute kirin dsl (report dir will be automatically created in the test dir)
+        KirinRunner.execute_kirin_dsl_sharded(tmp_dir / "dsl", tmp_dir / "test", report_dir, lib_dir)
+
+    if not report_dir.is_dir() or not KirinRunner.get_report_files(report_dir):
+        logger.error(f"-> Report file is not generated in {report_dir}!")
+        return None
+    return parse_xml_report(dsl_id, report_dir)
+
+
+def validate_tests_batch(
+    dsl_id_list: list[str], val_type: str = "all", batch_size: int = 16
+) -> dict[str, dict[str, DslValResDict]]:
+    """
+    Validate many DSL workspaces with one kirin run per batch instead of one per DSL.
+    Checkers and tests of each DSL are namespaced in the batch workspace and the report is split back per DSL.
+    DSLs whose mock libs or packaged tests define the same classes are put in different batches, since a batch shares
+    one source path and classpath.
+    DSLs whose verdicts are all cached, or that cannot be attributed in the batch report, are validated alone with
+    validate_tests.
+    :param dsl_id_list: DSL IDs to validate
+    :param val_type: Specify the DSL and test dirs to validate ("all", "tmp").
+    :param batch_size: max number of DSLs in a kirin run (a batch scans all its checkers on all its tests)
+    :return: {dsl_id: validation result as validate_tests}
+    """
+    val_res_map = {}
+    batch_list: list[list[str]] = []
+    batch_classes: list[set[str]] = []
+    for dsl_id in dsl_id_list:
+        if has_cached_verdicts(dsl_id, val_type):
+            val_res_map[dsl_id] = validate_tests(dsl_id, val_type)
+            continue
+        cur_ws_dir = Path(f"kirin_ws/{dsl_id}") if val_type == "all" else Path(f"kirin_ws/{dsl_id}/tmp")
+        lib_classes = get_lib_classes(Path(f"kirin_ws/{dsl_id}") / "lib") | get_test_classes(cur_ws_dir / "test")
+        for batch, classes in zip(batch_list, batch_classes):
+            if len(batch) < batch_size and not (classes & lib_classes):
+                batch.append(dsl_id)
+                classes |= lib_classes
+                break
+        else:
+            batch_list.append([dsl_id])
+            batch_classes.append(set(lib_classes))
+
+    for batch in batch_list:
+        batch_res = scan_dsl_batch(batch, val_type) if len(batch) > 1 else {}
+        for dsl_id in batch:
+            val_res_map[dsl_id] = batch_res[dsl_id] if dsl_id in batch_res else validate_tests(dsl_id, val_type)
+    return val_res_map
+
+
+def get_lib_classes(lib_dir: Path) -> set[str]:
+    """
+    Get the class entries of all jars in the lib dir.
+    """
+    lib_classes = set()
+    if lib_dir.is_dir():
+        for jar_file in lib_dir.rglob("*.jar"):
+            with zipfile.ZipFile(jar_file) as jar:
+                lib_classes.update(name for name in jar.namelist() if name.endswith(".class"))
+    return lib_classes
+
+
+def get_test_classes(test_dir: Path) -> set[str]:
+    """
+    Get the class entries (as in jars) of the tests declaring a package.
+    Tests in the default package are moved into the package of their namespace in a batch, so they never conflict.
+    """
+    test_classes = set()
+    if test_dir.is_dir():
+        for test_file in test_dir.rglob("*.java"):
+            package_match = JAVA_PACKAGE_PATTERN.search(test_file.read_bytes())
+            if package_match:
+                package_path = package_match.group(1).decode("utf-8").replace(".", "/")
+                test_classes.add(f"{package_path}/{test_file.stem}.class")
+    return test_classes
+
+
+def stage_namespaced_test(test_file: Path, dst_path: Path, ns: str):
+    """
+    Copy a test into a batch workspace, moving it from the default package (if so) into the package of its namespace.
+    The package declaration is put in front of the first line, so that the report lines are kept.
+    """
+    test_bytes = test_file.read_bytes()
+    if not JAVA_PACKAGE_PATTERN.search(test_bytes):
+        test_bytes = f"package {ns}; ".encode("utf-8") + test_bytes
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    dst_path.write_bytes(test_bytes)
+
+
+def scan_dsl_batch(dsl_id_list: list[str], val_type: str = "all") -> dict[str, dict[str, DslValResDict]]:
+    """
+    Run kirin once on the namespaced checkers, tests and libs of the DSLs and split the report per DSL.
+    Checker files are renamed to "{ns}__{name}.kirin", tests and libs are staged in "{ns}/" sub dirs.
+    Tests in the default package are moved into the "{ns}" package, since all DSLs name their tests alike.
+    :return: {dsl_id: validation result}, DSLs whose results are ambiguous in the report are left out
+    """
+    ns_map = {f"d{i}": dsl_id for i, dsl_id in enumerate(dsl_id_list)}
+    ns_checkers: dict[str, list[str]] = {ns: [] for ns in ns_map}
+    ns_scan_files: dict[str, set[str]] = {ns: set() for ns in ns_map}
+    ns_reports: dict[str, dict[str, dict[str, list[int]]]] = {ns: dict() for ns in ns_map}
+    ambiguous_ns = set()
 
-    return parse_xml_results(dsl_id, val_type)
+    logger.info(f"==> Validating checker tests of {len(dsl_id_list)} DSLs in one batch in {val_type} mode...")
+    with scratch_dir("batch-report-") as report_dir, scratch_dir("kirin-batch-") as tmp_dir:
+        batch_dsl_dir, batch_test_dir, batch_lib_dir = tmp_dir / "dsl", tmp_dir / "test", tmp_dir / "lib"
+        for ns, dsl_id in ns_map.items():
+            cur_ws_dir = Path(f"kirin_ws/{dsl_id}") if val_type == "all" else Path(f"kirin_ws/{dsl_id}/tmp")
+            for checker_file in (cur_ws_dir / "dsl").rglob("*.kirin"):
+                ns_checkers[ns].append(checker_file.stem)
+                rel_path = checker_file.relative_to(cur_ws_dir / "dsl")
+                dst_path = batch_dsl_dir / ns / rel_path.parent / f"{ns}__{checker_file.name}"
+                dst_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(checker_file, dst_path)
+            for test_file in (cur_ws_dir / "test").rglob("*.java"):
+                dst_path = batch_test_dir / ns / test_file.relative_to(cur_ws_dir / "test")
+                stage_namespaced_test(test_file, dst_path, ns)
+            lib_dir = Path(f"kirin_ws/{dsl_id}") / "lib"
+            if lib_dir.is_dir():
+                shutil.copytree(lib_dir, batch_lib_dir / ns)
+
+        if not batch_test_dir.is_dir() or not batch_dsl_dir.is_dir():
+            logger.error(f"--> No dsls or test cases are found in the batch {dsl_id_list}!")
+            return dict()
+        KirinRunner.execute_kirin_dsl(
+            batch_dsl_dir, batch_test_dir, report_dir, batch_lib_dir if batch_lib_dir.is_dir() else None
+        )
+        if not KirinRunner.get_report_files(report_dir):
+            logger.error(f"-> Report file is not generated for the batch {dsl_id_list}!")
+            return dict()
+
+        for checker_name, file_path, report_line in iter_xml_report(report_dir):
+            try:
+                ns = Path(file_path).absolute().relative_to(batch_test_dir.absolute()).parts[0]
+            except (ValueError, IndexError):
+                # not a test of the batch (e.g. a lib file), same as a report on a non-test file
+                continue
+            if checker_name is None:
+                ns_scan_files[ns].add(os.path.basename(file_path))
+                continue
+            checker_ns, _, name = checker_name.partition("__")
+            if name and checker_ns in ns_map:
+                if checker_ns != ns:
+                    # checker of another DSL on this test, not a pair to validate
+                    continue
+                checker_name = name
+            elif checker_name in ns_map.values():
+                if checker_name != ns_map[ns]:
+                    continue
+                checker_name = "DSL_ORI"
+            else:
+                # the report name is not bound to a DSL (e.g. SecH_default_rule_name)
+                ambiguous_ns.add(ns)
+                continue
+            file_reports = ns_reports[ns].setdefault(checker_name, dict())
+            file_reports.setdefault(os.path.basename(file_path), []).append(report_line)
+
+    val_res_map = {}
+    for ns, dsl_id in ns_map.items():
+        if ns in ambiguous_ns:
+            logger.warning(f"--> Batch report of {dsl_id} cannot be attributed, validate it alone.")
+            continue
+        logger.info(f"==> Batch validation of {dsl_id}")
+        checker_reports = ns_reports[ns]
+        for checker_name in ns_checkers[ns]:
+            checker_reports.setdefault(checker_name, dict())
+        val_res_map[dsl_id] = build_val_result(checker_reports, ns_scan_files[ns])
+    return val_res_map
 
 
 def sorted_test_files(file_name_list: list[str]) -> list[str]:
@@ -62,45 +372,73 @@ def parse_xml_results(dsl_id, val_type: str = "all") -> dict[str, DslValResDict]
         logger.error(f"-> Report directory {report_dir} does not exist!")
         return dict()
 
-    assert len(list(report_dir.glob("*.xml"))) == 1, f"More than one XML file found in {report_dir}"
-    xml_res_file = report_dir / "error_report_1.xml"
-    tree = ET.parse(xml_res_file)
-    root = tree.getroot()
+    checker_reports, scan_files = parse_xml_report(dsl_id, report_dir)
+    # checkers not reported in the XML file
+    checker_dir = Path(f"kirin_ws/{dsl_id}/dsl") if val_type == "all" else Path(f"kirin_ws/{dsl_id}/tmp/dsl")
+    # collect all .kirin file in checker_dir and its sub_dir recursively into the checker_list
+    for checker_file in checker_dir.glob("**/*.kirin"):
+        checker_reports.setdefault(checker_file.stem, dict())
+
+    return build_val_result(checker_reports, scan_files)
 
-    # get all the scanned files
-    scan_files = set()
-    for scan_file in root.findall(".//scanFiles/scanFile"):
-        file_name = os.path.basename(scan_file.text)
-        scan_files.add(file_name)
 
+def iter_xml_report(report_dir: Path) -> Iterator[tuple[Optional[str], str, int]]:
+    """
+    Stream the kirin XML report(s) in report_dir with bounded memory (parsed elements are dropped once read).
+    The reports of a sharded run are streamed one after another, files scanned by several shards are yielded once.
+    :return: generator of (checker_name, file_path, report_line) for each error,
+        and (None, file_path, -1) for each scanned file
+    """
+    scanned_files = set()
+    for xml_res_file in KirinRunner.get_report_files(report_dir):
+        elem_stack = []
+        for event, elem in ET.iterparse(xml_res_file, events=("start", "end")):
+            if event == "start":
+                elem_stack.append(elem)
+                continue
+            elem_stack.pop()
+            parent = elem_stack[-1] if elem_stack else None
+            if parent is None:
+                continue
+            if elem.tag == "scanFile" and parent.tag == "scanFiles":
+                if elem.text not in scanned_files:
+                    scanned_files.add(elem.text)
+                    yield None, elem.text, -1
+            elif elem.tag == "error" and parent.tag == "errors":
+                defect_info = elem.find("defectInfo")
+                checker_name = defect_info.find("checkerName").text
+                file_path = defect_info.find("fileName").text
+                report_line = int(defect_info.find("reportLine").text)
+                yield checker_name, file_path, report_line
+            else:
+                continue
+            # the record is consumed, detach it so that memory stays flat
+            parent.remove(elem)
+
+
+def parse_xml_report(dsl_id, report_dir: Path) -> tuple[dict[str, dict[str, list[int]]], set[str]]:
+    """
+    Parse the kirin XML report in report_dir.
+    :return: ({checker_name: {file_name: [report_line, ...]}}, names of all the scanned files)
+    """
+    scan_files = set()
     result = {}
-    for error in root.findall(".//errors/error"):
-        defect_info = error.find("defectInfo")
-        checker_name = defect_info.find("checkerName").text
-        file_path = defect_info.find("fileName").text
+    for checker_name, file_path, report_line in iter_xml_report(report_dir):
         file_name = os.path.basename(file_path)
-        report_line = int(defect_info.find("reportLine").text)
+        # get all the scanned files
+        if checker_name is None:
+            scan_files.add(file_name)
+            continue
 
         # new checker name
         if checker_name not in result:
-            result[checker_name] = {"report": dict(), "pass": []}
+            result[checker_name] = dict()
 
         # add info: {file_name: [report_line, ...]}
-        if file_name not in result[checker_name]["report"]:
-            result[checker_name]["report"][file_name] = [report_line]
+        if file_name not in result[checker_name]:
+            result[checker_name][file_name] = [report_line]
         else:
-            result[checker_name]["report"][file_name].append(report_line)
-
-    # postprocess the result
-    for checker_name in result:
-        # sort the key of report dict
-        report_dict_ori = result[checker_name]["report"]
-        result[checker_name]["report"] = {
-            k: report_dict_ori[k] for k in sorted_test_files(list(report_dict_ori.keys()))
-        }
-        # get sorted passed files
-        pass_files = [f for f in scan_files if f not in result[checker_name]["report"]]
-        result[checker_name]["pass"] = sorted_test_files(pass_files)
+            result[checker_name][file_name].append(report_line)
 
     # handle unreported DSL_ORI checker
     if "DSL_ORI" not in result:
@@ -112,13 +450,27 @@ def parse_xml_results(dsl_id, val_type: str = "all") -> dict[str, DslValResDict]
             result["DSL_ORI"] = result["SecH_default_rule_name"]
             del result["SecH_default_rule_name"]
 
-    # checkers not reported in the XML file
-    checker_dir = Path(f"kirin_ws/{dsl_id}/dsl") if val_type == "all" else Path(f"kirin_ws/{dsl_id}/tmp/dsl")
-    # collect all .kirin file in checker_dir and its sub_dir recursively into the checker_list
-    for checker_file in checker_dir.glob("**/*.kirin"):
-        checker_name = checker_file.stem
-        if checker_name not in result:
-            result[checker_name] = {"report": dict(), "pass": sorted_test_files(list(scan_files))}
+    return result, scan_files
+
+
+def build_val_result(
+    checker_reports: dict[str, dict[str, list[int]]], scan_files: set[str]
+) -> dict[str, DslValResDict]:
+    """
+    Build the sorted validation result of each checker from its reported files and log it.
+    :param checker_reports: {checker_name: {file_name: [report_line, ...]}}, including unreported checkers
+    :param scan_files: names of all the scanned files
+    """
+    result = {}
+    for checker_name, report_dict_ori in checker_reports.items():
+        result[checker_name] = {"report": dict(), "pass": []}
+        # sort the key of report dict
+        result[checker_name]["report"] = {
+            k: report_dict_ori[k] for k in sorted_test_files(list(report_dict_ori.keys()))
+        }
+        # get sorted passed files
+        pass_files = [f for f in scan_files if f not in result[checker_name]["report"]]
+        result[checker_name]["pass"] = sorted_test_files(pass_files)
 
     # log output
     sorted_keys = sorted(list(result.keys()), key=lambda x: (len(x), x))
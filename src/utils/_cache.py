@@ -0,0 +1,295 @@
+"""
+This module provides small on-disk caches shared by threads and processes: a sqlite key-value cache with LRU eviction
+and a content-addressed file cache materialized with hard links.
+"""
+
+import hashlib, os, shutil, sqlite3, threading, time
+from pathlib import Path
+from typing import Callable, Optional
+
+from ._logger import logger
+
+CACHE_DIR = Path("kirin_ws/cache")
+
+_file_hash_memo: dict[tuple[str, int, int], str] = {}
+
+
+def get_text_hash(*texts: str) -> str:
+    """
+    get the sha256 hex digest of the given texts (order sensitive)
+    """
+    hasher = hashlib.sha256()
+    for text in texts:
+        data = text.encode("utf-8")
+        hasher.update(f"{len(data)}:".encode("ascii"))
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def get_file_hash(file_path: Path) -> str:
+    """
+    get the sha256 hex digest of a file, memoized by (path, mtime, size) within the process
+    """
+    file_stat = os.stat(file_path)
+    memo_key = (str(Path(file_path).absolute()), file_stat.st_mtime_ns, file_stat.st_size)
+    if memo_key not in _file_hash_memo:
+        hasher = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+        _file_hash_memo[memo_key] = hasher.hexdigest()
+    return _file_hash_memo[memo_key]
+
+
+class SqliteCache:
+    """
+    SqliteCache stores text values by key in a sqlite file.
+    Each entry has a tag (e.g. the version of the tool producing it), entries of other tags can be invalidated at once.
+    The total size of values is capped by evicting the least recently used entries.
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = -1
+        self._writes_since_evict = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """
+        get the connection of the current process (connections must not be shared with forked workers)
+        """
+        if self._conn is None or self._conn_pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT, tag TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[str]:
+        """
+        Get the cached value and refresh its LRU position.
+        :param key: cache key
+        :param max_age: ignore entries created more than max_age seconds ago
+        :return: the cached value, None if missed
+        """
+        with self._lock:
+            conn = self._get_conn()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (max_age is not None and time.time() - row[1] > max_age):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str, tag: str = ""):
+        """
+        Store the value for the key and evict old entries if the cache is too large.
+        """
+        with self._lock:
+            conn = self._get_conn()
+            self._put(conn, key, value, tag)
+            conn.commit()
+            self._after_write(conn)
+
+    def update(self, key: str, update_func: Callable[[Optional[str]], Optional[str]], tag: str = "") -> Optional[str]:
+        """
+        Read-modify-write the value of the key in one immediate transaction, so that concurrent updates of processes
+        are serialized instead of overwriting each other.
+        :param update_func: map the current value (None if missed) to the new value, None to keep the entry unchanged
+        :return: the new value, None if not updated
+        """
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                value = update_func(row[0] if row is not None else None)
+                if value is not None:
+                    self._put(conn, key, value, tag)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if value is not None:
+                self._after_write(conn)
+            return value
+
+    def _put(self, conn: sqlite3.Connection, key: str, value: str, tag: str):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, tag, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, value, tag, len(value.encode("utf-8")), now, now),
+        )
+
+    def _after_write(self, conn: sqlite3.Connection):
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= 100:
+            self._evict(conn)
+
+    def delete(self, key: str):
+        """
+        Delete the entry of the key.
+        """
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+
+    def invalidate_other_tags(self, tag: str) -> int:
+        """
+        Delete all entries whose tag differs from the given one.
+        :return: number of deleted entries
+        """
+        with self._lock:
+            conn = self._get_conn()
+            deleted_count = conn.execute("DELETE FROM entries WHERE tag != ?", (tag,)).rowcount
+            conn.commit()
+        if deleted_count:
+            logger.info(f"Invalidated {deleted_count} stale entries in {self.db_path}.")
+        return deleted_count
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the total size fits max_bytes.
+        """
+        with self._lock:
+            self._evict(self._get_conn())
+
+    def _evict(self, conn: sqlite3.Connection):
+        self._writes_since_evict = 0
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        freed_bytes = 0
+        evict_keys = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            if total_bytes - freed_bytes <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            freed_bytes += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", evict_keys)
+        conn.commit()
+        logger.info(f"Evicted {len(evict_keys)} entries ({freed_bytes} bytes) from {self.db_path}.")
+
+    def stats_str(self) -> str:
+        """
+        Get the hit/miss counts of the current process.
+        """
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_ratio:.0%} hit ratio)"
+
+
+class FileCache:
+    """
+    FileCache stores files by content key in a directory shared by processes ({root}/{key[:2]}/{key}{suffix}).
+    Entries are materialized with hard links (copies across devices), their mtime is the LRU position.
+    The total size of entries is capped by evicting the least recently used ones.
+    Materialized files share the inode with the entry: replace them instead of writing them in place.
+    """
+
+    def __init__(self, root: Path, suffix: str = "", max_bytes: int = 1024 * 1024 * 1024):
+        self.root = root
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._stores_since_evict = 0
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{self.suffix}"
+
+    def materialize(self, key: str, dst_path: Path) -> bool:
+        """
+        Materialize the cached file at dst_path (replacing it) and refresh its LRU position.
+        :return: True if hit
+        """
+        entry_path = self._entry_path(key)
+        tmp_path = dst_path.with_name(f".{dst_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(entry_path, tmp_path)
+            except OSError:
+                if not entry_path.is_file():
+                    raise
+                shutil.copyfile(entry_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+            os.utime(entry_path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, src_path: Path):
+        """
+        Store the file as the entry of the key and evict old entries if the cache is too large.
+        """
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_name(f".{entry_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(src_path, tmp_path)
+            except OSError:
+                shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.warning(f"--> Failed to store {src_path} in {self.root}: {e}")
+            return
+        with self._lock:
+            self._stores_since_evict += 1
+            if self._stores_since_evict < 20:
+                return
+            self._stores_since_evict = 0
+        self.evict()
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the total size fits max_bytes.
+        """
+        entries = []
+        for entry_path in self.root.glob(f"*/*{self.suffix}"):
+            try:
+                entry_stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return
+        freed_bytes, evict_count = 0, 0
+        for _, size, entry_path in sorted(entries, key=lambda entry: entry[0]):
+            if total_bytes - freed_bytes <= self.max_bytes:
+                break
+            # materialized links keep their data, only the cache entry is dropped
+            entry_path.unlink(missing_ok=True)
+            freed_bytes += size
+            evict_count += 1
+        logger.info(f"Evicted {evict_count} entries ({freed_bytes} bytes) from {self.root}.")
+
+    def stats_str(self) -> str:
+        """
+        Get the hit/miss counts of the current process.
+        """
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_ratio:.0%} hit ratio)"
@@ -2,9 +2,12 @@
 helper functions
 """
 
-import shutil, re, json
+import shutil, re, json, tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from .types import DslPrepResDict, TestInfoDict, TestIdxDict
+from typing import Iterator
+from .types import DslPrepResDict, JavacDiagnostic, TestInfoDict, TestIdxDict
+from .config import SCRATCH_ROOT
 from ._logger import logger
 
 import tree_sitter_java as tsjava
@@ -12,6 +15,8 @@ from tree_sitter import Language, Parser
 
 # list of builtin package prefixes
 JAVA_BUILTIN_PKG_PREFIXES = []
+JAVA_TYPE_DECL_PATTERN = re.compile(r"\b(?:class|interface|enum|record)\s+([A-Za-z_$][\w$]*)")
+JAVA_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
 
 
 def create_dir_with_path(dir_path: Path, cleanup=True):
@@ -31,6 +36,22 @@ def create_dir_with_path(dir_path: Path, cleanup=True):
     dir_path.mkdir(parents=True, exist_ok=True)
 
 
+@contextmanager
+def scratch_dir(prefix: str = "scratch-") -> Iterator[Path]:
+    """
+    create a uniquely named scratch directory and remove it on exit, so that concurrent callers never share files
+    :param prefix: prefix of the scratch directory name
+    :return: path to the scratch directory (under SCRATCH_ROOT if configured, otherwise kirin_ws/tmp)
+    """
+    scratch_root = Path(SCRATCH_ROOT) if SCRATCH_ROOT else Path("kirin_ws/tmp")
+    scratch_root.mkdir(parents=True, exist_ok=True)
+    dir_path = Path(tempfile.mkdtemp(prefix=prefix, dir=scratch_root))
+    try:
+        yield dir_path
+    finally:
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+
 def del_kirin_logs(dir_path: Path):
     """
     delete kirin logs
@@ -79,16 +100,14 @@ def is_standard_class(class_fqn: str) -> bool:
     return pkg_name.lower() and cls_name[0].isupper()
 
 
-def extract_missing_pkgs(compile_error_msg: str) -> list[str]:
+def extract_missing_pkgs(diagnostics: list[JavacDiagnostic]) -> list[str]:
     """
-    Extract the missing packages from the compile error message.
-    :param compile_error_msg: The compile error message.
+    Extract the missing packages from the compile diagnostics.
+    :param diagnostics: The javac diagnostics.
     :return: A list of missing packages.
     """
-    unrecog_pkg_pattern = re.compile(r"error: package ([\w\.]+) does not exist")
-    missing_pkgs = unrecog_pkg_pattern.findall(compile_error_msg)
-
-    return list(set(missing_pkgs))
+    missing_pkgs = {d["symbol"] for d in diagnostics if d["code"] == "compiler.err.doesnt.exist" and d["symbol"]}
+    return list(missing_pkgs)
 
 
 def get_pkgs_from_fqns(class_fqns: list[str]) -> list[str]:
@@ -158,6 +177,30 @@ def validate_syntax(java_code_list: list[str]) -> list[bool]:
     return result
 
 
+def find_sibling_dependencies(java_files: list[Path]) -> dict[Path, set[Path]]:
+    """
+    Find the other files declaring the types mentioned by each Java file (conservatively, by names).
+    Compiled or scanned together, these types resolve against the other files, while a file is handled alone otherwise.
+    :param java_files: Paths to the Java files handled together
+    :return: {java_file: paths of the other files it may depend on}
+    """
+    file_decl_map = dict()
+    file_ident_map = dict()
+    for java_file in java_files:
+        java_code = Path(java_file).read_text(encoding="utf-8")
+        file_decl_map[java_file] = set(JAVA_TYPE_DECL_PATTERN.findall(java_code))
+        file_ident_map[java_file] = set(JAVA_IDENTIFIER_PATTERN.findall(java_code))
+    return {
+        java_file: {
+            other_file
+            for other_file in java_files
+            if other_file != java_file
+            and file_ident_map[java_file] & (file_decl_map[other_file] - file_decl_map[java_file])
+        }
+        for java_file in java_files
+    }
+
+
 def collect_failed_dsl_paths(dsl_id, val_res: dict) -> list[Path]:
     """
     Identify the sub DSLs that failed to generate tests and collect their paths.
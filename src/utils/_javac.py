@@ -0,0 +1,241 @@
+"""
+This module provides a long-lived javac server (javax.tools.JavaCompiler) to avoid launching JVMs for every compilation.
+The Java side is src/resources/javac/CompileServer.java, which is compiled once and then talked to over stdin/stdout.
+"""
+
+import re
+from pathlib import Path
+from typing import Optional
+
+from .types import JavacDiagnostic
+from ._jvm import JvmServer, encode_payload
+
+# javac CLI option printing diagnostics as "{file}:{line}:{column}: {key}: {args}" ("- {key}: {args}" if file-less)
+JAVAC_RAW_DIAGNOSTICS_OPTION = "-XDrawDiagnostics"
+JAVAC_RAW_DIAG_PATTERN = re.compile(r"^(?:(.+?\.java):(\d+):(\d+):|-) (compiler\.(err|warn|note)\.[\w.]+)(?:: (.*))?$")
+JAVAC_RAW_KIND_MAP = {"err": "ERROR", "warn": "WARNING", "note": "NOTE"}
+JAVAC_SUMMARY_PATTERN = re.compile(r"^\d+ (errors?|warnings?)$")
+JAVAC_SYMBOL_DETAIL_PATTERN = re.compile(r"^\s*symbol:\s+(?:\w+ )?(.+?)\s*$", re.M)
+# (message pattern, javac diagnostic key, field of the captured name) of the errors handled by the build path
+JAVAC_MESSAGE_PATTERNS = [
+    (
+        re.compile(r"^unreported (?:exception|error) ([\w.$]+); must be caught or declared to be thrown"),
+        "compiler.err.unreported.exception.need.to.catch.or.throw",
+        "exception",
+    ),
+    (
+        re.compile(r"^(?:exception|error) ([\w.$]+) is never thrown in body of corresponding try statement"),
+        "compiler.err.except.never.thrown.in.try",
+        "exception",
+    ),
+    (re.compile(r"^package ([\w.]+) does not exist"), "compiler.err.doesnt.exist", "symbol"),
+    (re.compile(r"^duplicate class: ([\w.$]+)"), "compiler.err.duplicate.class", "symbol"),
+    (re.compile(r"^cannot find symbol"), "compiler.err.cant.resolve", "symbol"),
+]
+# (javac diagnostic key prefix, field, index of the raw argument) of the errors handled by the build path
+JAVAC_RAW_ARG_FIELDS = [
+    ("compiler.err.unreported.exception.need.to.catch.or.throw", "exception", 0),
+    ("compiler.err.except.never.thrown.in.try", "exception", 0),
+    ("compiler.err.doesnt.exist", "symbol", 0),
+    ("compiler.err.duplicate.class", "symbol", 0),
+    ("compiler.err.cant.resolve", "symbol", 1),  # kindname, name, type args, arg types (, location)
+]
+
+
+def annotate_javac_diagnostic(diagnostic: JavacDiagnostic) -> JavacDiagnostic:
+    """
+    Fill the symbol and exception type of a diagnostic from its message, and the diagnostic key if unknown.
+    :param diagnostic: The diagnostic to annotate in place.
+    :return: the same diagnostic
+    """
+    for msg_pattern, code, field in JAVAC_MESSAGE_PATTERNS:
+        msg_match = msg_pattern.match(diagnostic["message"])
+        if not msg_match:
+            continue
+        if not diagnostic["code"]:
+            location_suffix = (
+                ".location" if code == "compiler.err.cant.resolve" and "location:" in diagnostic["message"] else ""
+            )
+            diagnostic["code"] = code + location_suffix
+        if msg_pattern.groups:
+            diagnostic[field] = msg_match.group(1)
+        else:
+            symbol_match = JAVAC_SYMBOL_DETAIL_PATTERN.search(diagnostic["message"])
+            diagnostic[field] = symbol_match.group(1) if symbol_match else ""
+        break
+    return diagnostic
+
+
+def make_javac_diagnostic(
+    kind: str, file: str, line: int, column: int, code: str, message: str, text: str = "", source_code: str = ""
+) -> JavacDiagnostic:
+    """
+    Create an annotated diagnostic, the text is rendered in the default javac format if not given.
+    :param source_code: The source code of the diagnostic file, used to render the text.
+    """
+    diagnostic = JavacDiagnostic(
+        kind=kind, file=file, line=line, column=column, code=code, message=message, symbol="", exception="", text=text
+    )
+    annotate_javac_diagnostic(diagnostic)
+    if not text:
+        diagnostic["text"] = render_javac_diagnostic(diagnostic, source_code)
+    return diagnostic
+
+
+def render_javac_diagnostic(diagnostic: JavacDiagnostic, source_code: str = "") -> str:
+    """
+    Render a diagnostic in the default javac text format.
+    :param diagnostic: The diagnostic to render.
+    :param source_code: The source code of the diagnostic file, used to show the error line and caret.
+    :return: javac-like diagnostic text
+    """
+    kind = "warning" if diagnostic["kind"] in ("WARNING", "MANDATORY_WARNING") else "error"
+    msg_lines = diagnostic["message"].split("\n")
+    if diagnostic["file"]:
+        diag_text = f"{diagnostic['file']}:{diagnostic['line']}: {kind}: {msg_lines[0]}\n"
+    else:
+        diag_text = f"{kind}: {msg_lines[0]}\n"
+    source_lines = source_code.splitlines()
+    if 0 < diagnostic["line"] <= len(source_lines):
+        diag_text += f"{source_lines[diagnostic['line'] - 1]}\n"
+        if diagnostic["column"] > 0:
+            diag_text += f"{' ' * (diagnostic['column'] - 1)}^\n"
+    for msg_line in msg_lines[1:]:
+        diag_text += f"{msg_line}\n"
+    return diag_text
+
+
+def split_raw_javac_args(raw_args: str) -> list[str]:
+    """
+    Split the arguments of a raw javac diagnostic, e.g. "kindname.class, Foo, , , (compiler.misc.location: ...)".
+    :return: the top-level arguments, nested ones (in brackets) are kept as is
+    """
+    args, depth, cur_arg = [], 0, ""
+    for char in raw_args:
+        if char == "," and depth == 0:
+            args.append(cur_arg.strip())
+            cur_arg = ""
+            continue
+        depth += 1 if char in "({[" else -1 if char in ")}]" else 0
+        cur_arg += char
+    args.append(cur_arg.strip())
+    return args
+
+
+def parse_javac_output(
+    javac_output: str, failed: bool = False, source_files: Optional[list[str]] = None
+) -> list[JavacDiagnostic]:
+    """
+    Parse the javac output (raw diagnostic format, see JAVAC_RAW_DIAGNOSTICS_OPTION) into diagnostics.
+    The text of each diagnostic is rendered in the default javac format, to be shown to LLMs and logs.
+    :param javac_output: The stderr of javac.
+    :param failed: Whether javac failed, a file-less error with the whole output is added if no error is parsed.
+    :param source_files: The compiled files, to resolve the file names printed by javac to their paths.
+    :return: diagnostics in output order, file paths are absolute (posix) if resolved
+    """
+    file_path_map = dict()  # file name -> absolute path, None if the name is ambiguous
+    for source_file in source_files or []:
+        file_name = Path(source_file).name
+        file_path_map[file_name] = None if file_name in file_path_map else Path(source_file).absolute().as_posix()
+    diagnostics = []
+    cur_match, detail_lines = None, []
+
+    def _close_block():
+        file_name, line_no, column, code, kind, raw_args = cur_match.groups()
+        file_path = file_name or ""
+        if "/" in file_path:
+            file_path = Path(file_path).absolute().as_posix()
+        elif file_path_map.get(file_path):
+            file_path = file_path_map[file_path]
+        source_path = Path(file_path)
+        source_code = source_path.read_text(encoding="utf-8") if file_path and source_path.is_file() else ""
+        diagnostic = make_javac_diagnostic(
+            kind=JAVAC_RAW_KIND_MAP[kind],
+            file=file_path,
+            line=int(line_no) if line_no else -1,
+            column=int(column) if column else -1,
+            code=code,
+            message="\n".join([f"{code}: {raw_args}" if raw_args else code] + detail_lines),
+            source_code=source_code,
+        )
+        args = split_raw_javac_args(raw_args or "")
+        for code_prefix, field, arg_idx in JAVAC_RAW_ARG_FIELDS:
+            if code.startswith(code_prefix) and arg_idx < len(args):
+                diagnostic[field] = args[arg_idx]
+                break
+        diagnostics.append(diagnostic)
+
+    for line in javac_output.splitlines():
+        raw_match = JAVAC_RAW_DIAG_PATTERN.match(line)
+        if raw_match or JAVAC_SUMMARY_PATTERN.match(line.rstrip()):
+            if cur_match:
+                _close_block()
+            cur_match, detail_lines = raw_match, []
+        elif cur_match:
+            detail_lines.append(line.rstrip())
+    if cur_match:
+        _close_block()
+
+    if failed and not any(d["kind"] == "ERROR" for d in diagnostics):
+        diagnostics.append(make_javac_diagnostic("ERROR", "", -1, -1, "", javac_output.strip() or "javac failed"))
+    return diagnostics
+
+
+def format_javac_diagnostics(diagnostics: list[JavacDiagnostic]) -> str:
+    """
+    Join the text of error diagnostics with the javac summary line, as the error message shown to LLMs and logs.
+    :param diagnostics: The diagnostics to render, only errors are kept.
+    :return: javac-like error message
+    """
+    error_texts = [diagnostic["text"] for diagnostic in diagnostics if diagnostic["kind"] == "ERROR"]
+    if not error_texts:
+        return ""
+    error_count = len(error_texts)
+    return "".join(error_texts) + f"{error_count} error{'s' if error_count > 1 else ''}\n"
+
+
+class JavacServer(JvmServer):
+    """
+    JavacServer is a lazily started, process-wide javac JVM that compiles in-memory sources and packages jars.
+    Use JavacServer.get() to fetch the shared server, which returns None if the server is not available.
+    """
+
+    source_path = Path("src/resources/javac/CompileServer.java")
+    main_class = "CompileServer"
+
+    def compile(self, source_map: dict[str, str], options: list[str]) -> Optional[tuple[bool, list[JavacDiagnostic]]]:
+        """
+        Compile in-memory sources.
+        :param source_map: {file_path: source_code}, the file name must match the public class as in javac
+        :param options: javac options, e.g. ["-d", target_dir, "-cp", jar]
+        :return: (success, diagnostics), None if the server is not usable
+        """
+        request = f"COMPILE {len(options)} {len(source_map)}\n".encode("ascii")
+        request += b"".join(encode_payload(option) for option in options)
+        for file_path, source_code in source_map.items():
+            request += encode_payload(file_path) + encode_payload(source_code)
+        response = self.request(request)
+        if response is None:
+            return None
+        success, info, records = response
+        diagnostics = []
+        for record in records:
+            kind, line_no, column, code, file_path, message = record[1:7]
+            diagnostics.append(
+                make_javac_diagnostic(
+                    kind, file_path, int(line_no), int(column), code, message, source_code=source_map.get(file_path, "")
+                )
+            )
+        if not success and not any(d["kind"] == "ERROR" for d in diagnostics):
+            # not a compilation error (e.g. invalid option), report as a file-less error
+            diagnostics.append(make_javac_diagnostic("ERROR", "", -1, -1, "", info))
+        return success, diagnostics
+
+    def jar(self, jar_path: Path, class_dir: Path) -> bool:
+        """
+        Package all files in class_dir into jar_path (same as "jar cf jar_path -C class_dir .").
+        :return: True if the jar is created
+        """
+        request = b"JAR\n" + encode_payload(str(jar_path.absolute())) + encode_payload(str(class_dir.absolute()))
+        response = self.request(request)
+        return response is not None and response[0]
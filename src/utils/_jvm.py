@@ -0,0 +1,231 @@
+"""
+This module provides the base of long-lived JVM helper processes (see src/resources/*/*Server.java).
+A helper is a small Java program compiled once and talked to over stdin/stdout with a line-based protocol:
+- requests are a command line followed by length-prefixed UTF-8 payloads ("{byte_len}\n{bytes}")
+- responses are tab-separated record lines (string fields escaped), ending with "END\t{0|1}\t{info}"
+"""
+
+import atexit, hashlib, os, re, shutil, subprocess, tempfile, threading, time
+from pathlib import Path
+from typing import Optional
+
+from .config import KIRIN_JAVA_HOME, JVM_PROFILE, JVM_USE_CDS
+from ._cache import CACHE_DIR, get_file_hash, get_text_hash
+from ._logger import logger
+
+HELPER_CLASS_ROOT = Path("kirin_ws/tmp/jvm-helper")
+
+# startup flags of short-lived JVM launches (kirin cli, javac, jar), selected by JVM_PROFILE in the config
+JVM_PROFILES = {
+    "default": [],
+    # C1 only and serial GC: faster startup for short runs, slower for long kirin analyses
+    "fast-startup": ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC", "-Xshare:auto"],
+}
+
+# dynamic AppCDS archives (JDK 13+), one per application and classpath
+CDS_ARCHIVE_ROOT = CACHE_DIR / "cds"
+CDS_DUMP_TIMEOUT = 600  # seconds before a dump lock of a crashed launch is taken over
+
+UNESCAPE_MAP = {"\\": "\\", "t": "\t", "r": "\r", "n": "\n"}
+
+
+def encode_payload(text: str) -> bytes:
+    """
+    encode a string as a length-prefixed payload of the helper protocol
+    """
+    data = text.encode("utf-8")
+    return f"{len(data)}\n".encode("ascii") + data
+
+
+def unescape_field(text: str) -> str:
+    """
+    unescape a string field of the helper protocol
+    """
+    return re.sub(r"\\(.)", lambda m: UNESCAPE_MAP.get(m.group(1), m.group(1)), text)
+
+
+def get_jvm_flags(app_name: str, classpath: list[Path] = [], java_home: str = KIRIN_JAVA_HOME) -> list[str]:
+    """
+    Get the JVM flags of a short-lived launch: the JVM_PROFILE flags and the AppCDS flags if JVM_USE_CDS is set.
+    The first launch of an application dumps its archive at exit, the later ones map it.
+    :param app_name: name of the launched application, e.g. "kirin" or "javac"
+    :param classpath: jars on the JVM classpath, the archive is rebuilt once they change
+    :return: flags to put before the main class (use get_tool_flags for jdk tools such as javac)
+    """
+    jvm_flags = list(JVM_PROFILES[JVM_PROFILE]) if isinstance(JVM_PROFILE, str) else list(JVM_PROFILE)
+    if not JVM_USE_CDS:
+        return jvm_flags
+
+    try:
+        archive_hash = get_text_hash(java_home, *jvm_flags, *[get_file_hash(jar_path) for jar_path in classpath])[:16]
+    except OSError:
+        return jvm_flags
+    archive_path = (CDS_ARCHIVE_ROOT / f"{app_name}-{archive_hash}.jsa").absolute()
+    # cds warnings go to stdout, which is parsed for some launches (e.g. the kirin formatter)
+    cds_flags = ["-Xlog:disable"]
+    if archive_path.is_file():
+        return jvm_flags + cds_flags + [f"-XX:SharedArchiveFile={archive_path}"]
+
+    # only one launch dumps the archive, the others run without it meanwhile
+    lock_path = archive_path.with_suffix(".lock")
+    CDS_ARCHIVE_ROOT.mkdir(parents=True, exist_ok=True)
+    try:
+        if lock_path.is_file() and time.time() - lock_path.stat().st_mtime > CDS_DUMP_TIMEOUT:
+            lock_path.unlink()
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError:
+        return jvm_flags
+    logger.info(f"Dumping AppCDS archive {archive_path.name} for {app_name}")
+    return jvm_flags + cds_flags + [f"-XX:ArchiveClassesAtExit={archive_path}"]
+
+
+def get_tool_flags(app_name: str, java_home: str = KIRIN_JAVA_HOME) -> list[str]:
+    """
+    Get the JVM flags of a jdk tool launcher (javac, jar), passed through with "-J".
+    """
+    return [f"-J{flag}" for flag in get_jvm_flags(app_name, java_home=java_home)]
+
+
+class JvmServer:
+    """
+    JvmServer is the base class of JVM helper processes. Subclasses set source_path/main_class and the launch command.
+    Use {Subclass}.get() to fetch the process-wide shared (lazily started) server, or instantiate it for one-shot use.
+    """
+
+    source_path: Path = None  # the Java source of the helper
+    main_class: str = ""
+
+    _instances: dict[type, "JvmServer"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cwd: Optional[Path] = None, java_home: str = KIRIN_JAVA_HOME):
+        self.java_executable = os.path.join(java_home, "bin", "java")
+        self.javac_executable = os.path.join(java_home, "bin", "javac")
+        if os.name == "nt":
+            self.java_executable += ".exe"
+            self.javac_executable += ".exe"
+
+        self.cwd = cwd
+        self.owner_pid = os.getpid()
+        self.process: Optional[subprocess.Popen] = None
+        self.available = True  # set to False once the server fails to start
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> Optional["JvmServer"]:
+        """
+        Get the shared server of the current process, starting it if needed.
+        :return: the running server, None if it cannot be started
+        """
+        with JvmServer._instances_lock:
+            server = JvmServer._instances.get(cls, None)
+            # forked workers must not share the pipes of the parent's server
+            if server is None or server.owner_pid != os.getpid():
+                server = cls()
+                JvmServer._instances[cls] = server
+                atexit.register(server.close)
+        return server if server.ensure_started() else None
+
+    def launch_command(self, class_dir: Path) -> list[str]:
+        """
+        The command to launch the helper, with class_dir holding the compiled helper classes.
+        """
+        return [self.java_executable, "-Dfile.encoding=UTF-8", "-cp", str(class_dir.absolute()), self.main_class]
+
+    def _build_helper_classes(self) -> Path:
+        """
+        Compile the helper source once into kirin_ws/tmp/jvm-helper/{main_class}-{source_hash}.
+        :return: the class directory of the helper
+        """
+        source_code = self.source_path.read_bytes()
+        class_dir = HELPER_CLASS_ROOT / f"{self.main_class}-{hashlib.sha256(source_code).hexdigest()[:16]}"
+        if (class_dir / f"{self.main_class}.class").is_file():
+            return class_dir
+
+        # compile into a private dir first, concurrent builders may race for the final dir
+        HELPER_CLASS_ROOT.mkdir(parents=True, exist_ok=True)
+        build_dir = Path(tempfile.mkdtemp(prefix="build-", dir=HELPER_CLASS_ROOT))
+        subprocess.run(
+            [self.javac_executable, "-encoding", "utf-8", "-nowarn", "-d", str(build_dir), str(self.source_path)],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={"LANG": "C"},
+        )
+        try:
+            build_dir.rename(class_dir)
+        except OSError:
+            # already built by another process
+            shutil.rmtree(build_dir, ignore_errors=True)
+        return class_dir
+
+    def ensure_started(self) -> bool:
+        """
+        Start the server process if it is not running.
+        :return: True if the server is running
+        """
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                return True
+            if not self.available:
+                return False
+            try:
+                class_dir = self._build_helper_classes()
+                if self.cwd is not None:
+                    self.cwd.mkdir(parents=True, exist_ok=True)
+                self.process = subprocess.Popen(
+                    self.launch_command(class_dir),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    cwd=self.cwd,
+                    env={"LANG": "C"},
+                )
+                logger.info(f"Started {self.main_class} (pid {self.process.pid}).")
+                return True
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"--> Failed to start {self.main_class}: {e}")
+                self.available = False
+                self.process = None
+                return False
+
+    def request(self, request: bytes) -> Optional[tuple[bool, str, list[list[str]]]]:
+        """
+        Send a request and read the response.
+        :return: (success, info, records), each record is the list of unescaped fields; None if the server died
+        """
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                return None
+            records = []
+            try:
+                self.process.stdin.write(request)
+                self.process.stdin.flush()
+                while True:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        raise EOFError(f"{self.main_class} closed the connection")
+                    fields = [unescape_field(field) for field in line.decode("utf-8").rstrip("\n").split("\t")]
+                    if fields[0] == "END":
+                        return fields[1] == "1", fields[2], records
+                    records.append(fields)
+            except (OSError, EOFError, IndexError) as e:
+                logger.warning(f"--> {self.main_class} failed: {e}")
+                self.process.kill()
+                self.process = None
+                return None
+
+    def close(self):
+        """
+        Shut down the server process.
+        """
+        with self.lock:
+            if self.process is None or self.owner_pid != os.getpid():
+                return
+            try:
+                self.process.stdin.write(b"EXIT\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+            self.process = None
@@ -2,16 +2,70 @@
 This module provides functions to run dsl_kirin analysis using the command line interface (CLI) of the dsl_kirin jar file.
 """
 
-import os, subprocess
+import os, shutil, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 from typing import Optional, List
 
 from .types import DslInfoDict, TestInfoDict
-from .config import KIRIN_JAVA_HOME, KIRIN_CLI_PATH
-from ._helper import create_dir_with_path, del_kirin_logs
+from .config import KIRIN_JAVA_HOME, KIRIN_CLI_PATH, USE_KIRIN_FORMAT_SERVER, KIRIN_SCAN_SHARDS, KIRIN_SHARD_MEMORY_MB
+from ._helper import create_dir_with_path, del_kirin_logs, scratch_dir
+from ._jvm import JvmServer, encode_payload, get_jvm_flags
+from ._cache import CACHE_DIR, SqliteCache, get_file_hash, get_text_hash
 from ._logger import logger
 
 
+class KirinFormatServer(JvmServer):
+    """
+    KirinFormatServer keeps one JVM with the Kirin CLI loaded and formats DSL files by invoking HornMain in-process.
+    """
+
+    source_path = Path("src/resources/kirin/FormatServer.java")
+    main_class = "FormatServer"
+
+    def __init__(self, cwd: Optional[Path] = None):
+        # by default, kirin runs in a scratch dir of the server (removed on close), so that servers never share logs
+        self._scratch_stack = ExitStack()
+        if cwd is None:
+            cwd = self._scratch_stack.enter_context(scratch_dir("kirin-format-server-"))
+        super().__init__(cwd=cwd)
+
+    def launch_command(self, class_dir: Path) -> list[str]:
+        return [
+            self.java_executable,
+            "-Dfile.encoding=UTF-8",
+            "-Djava.security.manager=allow",
+            "--add-opens=java.base/java.lang.reflect=ALL-UNNAMED",
+            "--enable-preview",
+            "-cp",
+            os.pathsep.join([str(class_dir.absolute()), str(Path(KIRIN_CLI_PATH).absolute())]),
+            self.main_class,
+            "com.huawei.secbrella.kirin.horn.HornMain",
+        ]
+
+    def format_files(self, input_paths: list[Path]) -> Optional[list[tuple[bool, str, str]]]:
+        """
+        Format dsl files within the server.
+        :param input_paths: paths to the dsl files
+        :return: [(success, stdout, stderr), ...] in the order of input_paths, None if the server is not usable
+        """
+        request = f"FORMAT {len(input_paths)}\n".encode("ascii")
+        request += b"".join(encode_payload(str(input_path.absolute())) for input_path in input_paths)
+        response = self.request(request)
+        if response is None or not response[0] or len(response[2]) != len(input_paths):
+            return None
+        return [(record[1] == "1", record[2], record[3]) for record in response[2]]
+
+    def close(self):
+        super().close()
+        # forked workers must not clean up the parent's server
+        if self.owner_pid != os.getpid():
+            return
+        del_kirin_logs(self.cwd)
+        self._scratch_stack.close()
+
+
 class KirinRunner:
     """
     KirinRunner is a class that provides methods to run dsl_kirin analysis using the command line interface (CLI).
@@ -23,6 +77,13 @@ class KirinRunner:
 
     kirin_cli_path = KIRIN_CLI_PATH
 
+    # formatted dsl cache: key = hash(kirin cli jar checksum, dsl text), tagged with the jar checksum
+    format_cache = SqliteCache(CACHE_DIR / "kirin_format.db", max_bytes=64 * 1024 * 1024)
+    format_cache_tag = ""
+
+    # processes running kirin scans concurrently (e.g. DSL workers), sharing the cores and memory for the shards
+    scan_process_count = 1
+
     @classmethod
     def check_config(cls):
         """
@@ -69,6 +130,7 @@ class KirinRunner:
 
         command = [
             cls.java_executable,
+            *get_jvm_flags("kirin", [Path(cls.kirin_cli_path)]),
             "-Dfile.encoding=UTF-8",
             "--add-opens=java.base/java.lang.reflect=ALL-UNNAMED",
             "--enable-preview",
@@ -104,6 +166,95 @@ class KirinRunner:
             # delete the kirin logs
             del_kirin_logs(dsl_dir)
 
+    @classmethod
+    def share_scan_resources(cls, process_count: int):
+        """
+        Share the cores and memory for kirin scans among process_count processes (used as a process pool initializer).
+        """
+        cls.scan_process_count = max(process_count, 1)
+
+    @classmethod
+    def get_scan_shard_count(cls, checker_count: int) -> int:
+        """
+        Get the number of concurrent kirin scans: KIRIN_SCAN_SHARDS if set, otherwise bounded by the share of cores and
+        free memory of this process (see share_scan_resources).
+        """
+        if KIRIN_SCAN_SHARDS > 0:
+            return max(1, min(KIRIN_SCAN_SHARDS, checker_count))
+        shard_count = (os.cpu_count() or 1) // cls.scan_process_count
+        try:
+            with open("/proc/meminfo", "r", encoding="utf-8") as f:
+                mem_info = dict(line.split(":", 1) for line in f if ":" in line)
+            available_mb = int(mem_info["MemAvailable"].split()[0]) // 1024 // cls.scan_process_count
+            shard_count = min(shard_count, available_mb // KIRIN_SHARD_MEMORY_MB)
+        except (OSError, KeyError, ValueError):
+            # memory unknown (e.g. not linux), only bounded by cores
+            pass
+        return max(1, min(shard_count, checker_count))
+
+    @classmethod
+    def execute_kirin_dsl_sharded(
+        cls,
+        dsl_dir: Path,
+        test_dir: Path,
+        report_dir: Path,
+        third_resources_dir: Optional[Path] = None,
+        shard_count: Optional[int] = None,
+    ):
+        """
+        Execute dsl_kirin analysis with the checkers partitioned into shards scanned by concurrent kirin processes.
+        The shard reports are kept as report_dir/shard-{i}/error_report_1.xml (see get_report_files), all or none.
+        Tests are not partitioned, so that analyses across test files are kept.
+        :param shard_count: number of shards, decided by get_scan_shard_count if None
+        """
+        checker_files = sorted(dsl_dir.rglob("*.kirin"), key=lambda p: p.stat().st_size, reverse=True)
+        shard_count = shard_count or cls.get_scan_shard_count(len(checker_files))
+        shard_count = min(shard_count, len(checker_files))
+        if shard_count <= 1:
+            return cls.execute_kirin_dsl(dsl_dir, test_dir, report_dir, third_resources_dir)
+
+        logger.info(f"Executing dsl_kirin analysis with {len(checker_files)} checkers in {shard_count} shards")
+        create_dir_with_path(report_dir, cleanup=True)
+        with scratch_dir("kirin-shard-") as tmp_dir:
+            # deal the checkers (largest first) round-robin, keeping their relative paths
+            shard_dirs = [(tmp_dir / f"shard-{i}", report_dir / f"shard-{i}") for i in range(shard_count)]
+            for i, checker_file in enumerate(checker_files):
+                dst_path = shard_dirs[i % shard_count][0] / checker_file.relative_to(dsl_dir)
+                dst_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(checker_file, dst_path)
+
+            with ThreadPoolExecutor(max_workers=shard_count) as executor:
+                list(
+                    executor.map(
+                        lambda shard_dir: cls.execute_kirin_dsl(
+                            shard_dir[0], test_dir, shard_dir[1], third_resources_dir
+                        ),
+                        shard_dirs,
+                    )
+                )
+
+        shard_reports = [shard_report_dir / "error_report_1.xml" for _, shard_report_dir in shard_dirs]
+        if all(shard_report.is_file() for shard_report in shard_reports):
+            logger.info(f"Kirin executor reports of {shard_count} shards have been saved to {report_dir}")
+        else:
+            # a partial report would pass all tests for the checkers of the failed shards
+            logger.error(f"--> Kirin executor failed in some shards, no report is generated")
+            for _, shard_report_dir in shard_dirs:
+                shutil.rmtree(shard_report_dir, ignore_errors=True)
+
+    @classmethod
+    def get_report_files(cls, report_dir: Path) -> list[Path]:
+        """
+        Get the kirin XML reports in report_dir: the report of a single run or the reports of all shards.
+        Shard reports are read one by one instead of merged, so that reading them keeps a flat memory.
+        :return: report files, [] if no report is generated
+        """
+        xml_res_file = report_dir / "error_report_1.xml"
+        if xml_res_file.is_file():
+            assert len(list(report_dir.glob("*.xml"))) == 1, f"More than one XML file found in {report_dir}"
+            return [xml_res_file]
+        return sorted(report_dir.glob("shard-*/error_report_1.xml"))
+
     @classmethod
     def format_dsl_file(cls, input_path: Path, do_replace=True) -> str:
         """
@@ -119,6 +270,7 @@ class KirinRunner:
             return ""
         command = [
             cls.java_executable,
+            *get_jvm_flags("kirin-format", [Path(cls.kirin_cli_path)]),
             "-Dfile.encoding=UTF-8",
             "--add-opens=java.base/java.lang.reflect=ALL-UNNAMED",
             "--enable-preview",
@@ -131,21 +283,8 @@ class KirinRunner:
         try:
             logger.debug(f"Kirin formatter command: \n{' '.join(command)}")
             result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=input_path.parent)
-            logger.debug(f"Kirin formatter output: {result.stdout}")
             # With check=True, we'll only reach here if returncode is 0
-            if "| ERROR |" in result.stdout or not result.stdout:
-                logger.error(f"--> Kirin formatter error for {input_path}: \n{input_path.read_text(encoding='utf-8')}")
-                logger.error(f"--> Kirin formatter stdout: \n{result.stdout}")
-                logger.error(f"--> Kirin formatter stderr: \n{result.stderr}")
-                return ""
-            else:
-                formatted_dsl_text = result.stdout.replace("\r\n", "\n").strip()
-                if do_replace:
-                    input_path.write_text(formatted_dsl_text, encoding="utf-8")
-                    logger.info(f"{input_path} has been formatted")
-                else:
-                    logger.info(f"-- Dsl formatting done.")
-            return formatted_dsl_text
+            return cls._parse_formatter_output(input_path, result.stdout, result.stderr, do_replace=do_replace)
 
         except subprocess.CalledProcessError as e:
             logger.error(f"--> Kirin formatter error for {input_path}: \n{input_path.read_text(encoding='utf-8')}")
@@ -158,20 +297,117 @@ class KirinRunner:
             del_kirin_logs(input_path.parent)
 
     @classmethod
-    def format_dsl_text(cls, dsl_text: str) -> str:
+    def _parse_formatter_output(cls, input_path: Path, stdout: str, stderr: str, do_replace=False) -> str:
+        """
+        Check the formatter output of a dsl file and get the formatted dsl.
+        :param input_path: path to the dsl file
+        :param stdout: stdout of the formatter
+        :param stderr: stderr of the formatter
+        :param do_replace: if True, replace the original file with the formatted one
+        :return: formatted dsl string, "" if formatting failed
+        """
+        logger.debug(f"Kirin formatter output: {stdout}")
+        if "| ERROR |" in stdout or not stdout:
+            logger.error(f"--> Kirin formatter error for {input_path}: \n{input_path.read_text(encoding='utf-8')}")
+            logger.error(f"--> Kirin formatter stdout: \n{stdout}")
+            logger.error(f"--> Kirin formatter stderr: \n{stderr}")
+            return ""
+        formatted_dsl_text = stdout.replace("\r\n", "\n").strip()
+        if do_replace:
+            input_path.write_text(formatted_dsl_text, encoding="utf-8")
+            logger.info(f"{input_path} has been formatted")
+        else:
+            logger.info(f"-- Dsl formatting done.")
+        return formatted_dsl_text
+
+    @classmethod
+    def get_format_cache_tag(cls) -> str:
+        """
+        Get the checksum of the kirin cli jar, cached formats of other jars are invalidated once it changes.
         """
-        create a temporary file with the dsl text and format it
+        jar_hash = get_file_hash(Path(cls.kirin_cli_path))
+        if jar_hash != cls.format_cache_tag:
+            cls.format_cache.invalidate_other_tags(jar_hash)
+            cls.format_cache_tag = jar_hash
+        return jar_hash
+
+    @classmethod
+    def format_dsl_texts(cls, dsl_texts: list[str]) -> list[str]:
+        """
+        Format multiple dsl texts, looking up the format cache first and formatting only the missed ones.
+        :param dsl_texts: dsl texts to format
+        :return: formatted dsl texts in the same order, "" for the inputs that failed to be formatted
+        """
+        # check the configuration
+        cls.check_config()
+        cache_tag = cls.get_format_cache_tag()
+        cache_keys = [get_text_hash(cache_tag, dsl_text) for dsl_text in dsl_texts]
+        formatted_dsl_texts = [cls.format_cache.get(cache_key) or "" for cache_key in cache_keys]
+
+        missed_ids = [i for i, formatted_dsl_text in enumerate(formatted_dsl_texts) if not formatted_dsl_text]
+        if missed_ids:
+            missed_formatted_texts = cls._format_dsl_texts_uncached([dsl_texts[i] for i in missed_ids])
+            for i, formatted_dsl_text in zip(missed_ids, missed_formatted_texts):
+                formatted_dsl_texts[i] = formatted_dsl_text
+                if formatted_dsl_text:
+                    cls.format_cache.set(cache_keys[i], formatted_dsl_text, tag=cache_tag)
+        logger.info(
+            f"Kirin format cache: {len(dsl_texts) - len(missed_ids)}/{len(dsl_texts)} hits "
+            f"(process total: {cls.format_cache.stats_str()})"
+        )
+        return formatted_dsl_texts
+
+    @classmethod
+    def _format_dsl_texts_uncached(cls, dsl_texts: list[str]) -> list[str]:
         """
-        tmp_file = Path("kirin_ws/tmp/tmp.kirin")
-        if not tmp_file.parent.exists():
-            tmp_file.parent.mkdir(parents=True, exist_ok=True)
-        tmp_file.write_text(dsl_text, encoding="utf-8")
+        Format multiple dsl texts with a single JVM: the resident format server if enabled, otherwise a one-shot one.
+        Inputs without a server result (e.g. the server died) are formatted one by one.
+        :param dsl_texts: dsl texts to format
+        :return: formatted dsl texts in the same order, "" for the inputs that failed to be formatted
+        """
+        formatted_dsl_texts = [""] * len(dsl_texts)
+        with scratch_dir("fmt-") as tmp_dir:
+            input_paths = []
+            for i, dsl_text in enumerate(dsl_texts):
+                input_path = tmp_dir / f"tmp_{i + 1}.kirin"
+                input_path.write_text(dsl_text, encoding="utf-8")
+                input_paths.append(input_path)
+
+            format_res_list = None
+            if USE_KIRIN_FORMAT_SERVER:
+                format_server = KirinFormatServer.get()
+                format_res_list = format_server.format_files(input_paths) if format_server else None
+            elif len(input_paths) > 1:
+                format_server = KirinFormatServer(cwd=tmp_dir)
+                if format_server.ensure_started():
+                    format_res_list = format_server.format_files(input_paths)
+                format_server.close()
+
+            if format_res_list is None:
+                if len(input_paths) > 1:
+                    logger.warning(f"--> Kirin format server is not available, formatting dsls one by one...")
+                for i, input_path in enumerate(input_paths):
+                    formatted_dsl_texts[i] = cls.format_dsl_file(input_path, do_replace=False)
+            else:
+                for i, (input_path, format_res) in enumerate(zip(input_paths, format_res_list)):
+                    success, stdout, stderr = format_res
+                    if success:
+                        formatted_dsl_texts[i] = cls._parse_formatter_output(input_path, stdout, stderr)
+                    else:
+                        logger.error(f"--> Kirin formatter failed for #{i + 1} dsl: \n{dsl_texts[i]}")
+                        logger.error(f"--> Kirin format error output: {stderr}")
+            del_kirin_logs(tmp_dir)
+
+        return formatted_dsl_texts
 
-        formatted_dsl_text = cls.format_dsl_file(tmp_file, do_replace=False)
+    @classmethod
+    def format_dsl_text(cls, dsl_text: str) -> str:
+        """
+        create a temporary file with the dsl text in a private scratch dir and format it
+        """
+        formatted_dsl_text = cls.format_dsl_texts([dsl_text])[0]
         assert formatted_dsl_text, f"--> Kirin formatter failed for this dsl"
 
-        # delete the tmp file
-        # tmp_file.unlink()
         return formatted_dsl_text
 
 
@@ -1,31 +1,43 @@
-import time
+import time, json, asyncio, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque, OrderedDict
 from typing import Optional
-from litellm import completion, Usage
+from litellm import completion, acompletion, Usage
 
-from .config import OPENAI_BASE_URL, OPENAI_MODEL_NAME, OPENAI_API_KEY, LLM_PROVIDER
+from .config import OPENAI_BASE_URL, OPENAI_MODEL_NAME, OPENAI_API_KEY, LLM_PROVIDER, LLM_CACHE_MODE, LLM_CACHE_TTL
+from .config import LLM_MAX_IN_FLIGHT, LLM_RPM, LLM_TPM
+from ._cache import CACHE_DIR, SqliteCache, get_text_hash
 from ._logger import logger
 
+LLM_TEMPERATURE = 0.7
 
-def query_llm_v1(messages: list, model_name: str = OPENAI_MODEL_NAME) -> tuple[str, Optional[Usage]]:
+# "off": no cache; "readwrite": reuse and store responses; "replay": reuse responses only (read-only);
+# "refresh": always query the LLM and overwrite the cached responses
+LLM_CACHE_MODES = ["off", "readwrite", "replay", "refresh"]
+
+
+def _completion_kwargs(messages: list) -> dict:
     """
-    Query LLM with openai API
-    returns:
-        - response: The response text from the LLM.
-        - usage: The usage information of the API call.
+    Get the keyword arguments shared by completion and acompletion.
     """
-    assert model_name, f"Model name {model_name} not provided"
-
-    chat_completion = completion(
+    return dict(
         base_url=OPENAI_BASE_URL,
         api_key=OPENAI_API_KEY,
         model=OPENAI_MODEL_NAME,
         custom_llm_provider=LLM_PROVIDER,
         messages=messages,
-        temperature=0.7,
+        temperature=LLM_TEMPERATURE,
         stream=False,
         num_retries=3,
         retry_after=2,
     )
+
+
+def _parse_completion(chat_completion, model_name: str) -> tuple[str, Optional[Usage]]:
+    """
+    Get the response text and usage from the chat completion.
+    """
     response = chat_completion.choices[0].message.content
     if response is None:
         response = chat_completion.choices[0].message.reasoning_content
@@ -37,59 +49,362 @@ def query_llm_v1(messages: list, model_name: str = OPENAI_MODEL_NAME) -> tuple[s
     return response, chat_completion.usage
 
 
+def query_llm_v1(messages: list, model_name: str = OPENAI_MODEL_NAME) -> tuple[str, Optional[Usage]]:
+    """
+    Query LLM with openai API
+    returns:
+        - response: The response text from the LLM.
+        - usage: The usage information of the API call.
+    """
+    assert model_name, f"Model name {model_name} not provided"
+
+    chat_completion = completion(**_completion_kwargs(messages))
+    return _parse_completion(chat_completion, model_name)
+
+
+async def aquery_llm_v1(messages: list, model_name: str = OPENAI_MODEL_NAME) -> tuple[str, Optional[Usage]]:
+    """
+    Query LLM with openai API asynchronously, same as query_llm_v1.
+    """
+    assert model_name, f"Model name {model_name} not provided"
+
+    chat_completion = await acompletion(**_completion_kwargs(messages))
+    return _parse_completion(chat_completion, model_name)
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """
+    Roughly estimate the prompt tokens of the messages (4 chars per token).
+    """
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 1
+
+
+class LLMRateLimiter:
+    """
+    LLMRateLimiter limits the LLM requests of the process: in-flight requests, requests per minute and tokens per minute.
+    Waiting requests are served round-robin by owner (e.g. DSL id), so one owner cannot starve the others.
+    Limits of 0 mean unlimited.
+    """
+
+    def __init__(self, max_in_flight: int = 0, rpm: int = 0, tpm: int = 0):
+        self.max_in_flight = max_in_flight
+        self.rpm = rpm
+        self.tpm = tpm
+
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.request_window: deque[float] = deque()  # start times of requests in the last minute
+        self.token_window: deque[list] = deque()  # [start_time, tokens] of requests in the last minute
+        self.waiting_owners: OrderedDict[str, int] = OrderedDict()  # owner -> waiting count, in serving order
+
+    def scale(self, ratio: float) -> None:
+        """
+        Scale the limits, e.g. share the provider limits among worker processes.
+        """
+        with self.cond:
+            self.max_in_flight = max(1, int(self.max_in_flight * ratio)) if self.max_in_flight else 0
+            self.rpm = max(1, int(self.rpm * ratio)) if self.rpm else 0
+            self.tpm = max(1, int(self.tpm * ratio)) if self.tpm else 0
+
+    def _get_wait_time(self, est_tokens: int, now: float) -> float:
+        """
+        Get the seconds to wait before a request can be started (0 if it can start now).
+        """
+        while self.request_window and now - self.request_window[0] >= 60:
+            self.request_window.popleft()
+        while self.token_window and now - self.token_window[0][0] >= 60:
+            self.token_window.popleft()
+
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return 1.0  # woken up by release
+        wait_time = 0.0
+        if self.rpm and len(self.request_window) >= self.rpm:
+            wait_time = max(wait_time, 60 - (now - self.request_window[0]))
+        if self.tpm and self.token_window:
+            window_tokens = sum(record[1] for record in self.token_window)
+            if window_tokens + est_tokens > self.tpm:
+                wait_time = max(wait_time, 60 - (now - self.token_window[0][0]))
+        return wait_time
+
+    def acquire(self, owner: str, est_tokens: int) -> list:
+        """
+        Block until the request of the owner can be started.
+        :return: the token record of the request, to be passed to release
+        """
+        with self.cond:
+            self.waiting_owners[owner] = self.waiting_owners.get(owner, 0) + 1
+            while True:
+                now = time.time()
+                wait_time = self._get_wait_time(est_tokens, now)
+                if next(iter(self.waiting_owners)) == owner and wait_time <= 0:
+                    break
+                self.cond.wait(timeout=min(wait_time, 1.0) if wait_time > 0 else 1.0)
+
+            # serve the owner and move it to the end of the queue
+            waiting_count = self.waiting_owners.pop(owner) - 1
+            if waiting_count > 0:
+                self.waiting_owners[owner] = waiting_count
+            self.in_flight += 1
+            self.request_window.append(now)
+            token_record = [now, est_tokens]
+            self.token_window.append(token_record)
+            self.cond.notify_all()
+            return token_record
+
+    def release(self, token_record: list, used_tokens: Optional[int] = None) -> None:
+        """
+        Mark the request as finished and correct its token count with the real usage.
+        """
+        with self.cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                token_record[1] = used_tokens
+            self.cond.notify_all()
+
+
+class LLMSession:
+    """
+    LLMSession holds the LLM call records and the call budget of one run (e.g. one DSL).
+    It is bound to the current context by LLMWrapper.session, so concurrent runs (threads or tasks) do not mix up.
+    """
+
+    def __init__(self, name: str = "default", max_calls: int = 10):
+        self.name = name
+        self.max_calls = max_calls
+        # record: (api_type, time_cost, prompt_tokens, completion_tokens[, "cache-hit"])
+        self.call_chain: list[list[str]] = []
+        self.started_calls = 0  # includes in-flight calls, so that concurrent calls cannot overrun the budget
+        self.lock = threading.Lock()
+
+    def reserve_call(self) -> None:
+        """
+        Reserve a call of the budget, raise AssertionError if the budget is used up.
+        """
+        with self.lock:
+            assert self.started_calls <= self.max_calls, f"--> [LLM] API call limit reached: {self.started_calls}."
+            self.started_calls += 1
+
+    def reset(self) -> None:
+        """
+        Reset the records and the budget (records already reported in all_call_chains are kept there).
+        """
+        with self.lock:
+            self.call_chain = []
+            self.started_calls = 0
+
+
+_current_session: ContextVar[Optional[LLMSession]] = ContextVar("llm_session", default=None)
+
+
 class LLMWrapper:
     """
     A wrapper class for LLM API calls.
     """
 
-    # record: (api_type, time_cost, prompt_tokens, completion_tokens)
-    single_call_chain: list[list[str]] = []
+    # records of the calls outside any session
+    default_session = LLMSession()
+    # call chains of all sessions of the process (and the ones merged from worker processes)
     all_call_chains: list[list[list[str]]] = []
+    record_lock = threading.Lock()
+
+    # response cache: key = hash(model, provider, temperature, messages), see LLM_CACHE_MODE in the config
+    response_cache = SqliteCache(CACHE_DIR / "llm_response.db", max_bytes=512 * 1024 * 1024)
+
+    # shared by sync and async queries of the process
+    rate_limiter = LLMRateLimiter(max_in_flight=LLM_MAX_IN_FLIGHT, rpm=LLM_RPM, tpm=LLM_TPM)
+
+    @classmethod
+    def get_session(cls) -> LLMSession:
+        """
+        Get the session of the current context, the default session if none is active.
+        """
+        return _current_session.get() or cls.default_session
+
+    @classmethod
+    @contextmanager
+    def session(cls, name: str, max_calls: int = 10):
+        """
+        Scope the LLM call records and budget of the enclosed code (and the tasks/threads copying its context).
+        :param name: session name (e.g. DSL id), also used for fair rate limiting
+        :param max_calls: the call budget of the session
+        """
+        llm_session = LLMSession(name, max_calls)
+        token = _current_session.set(llm_session)
+        try:
+            yield llm_session
+        finally:
+            _current_session.reset(token)
 
     @classmethod
     def reset_all_record(cls) -> None:
         """
         Reset the number of API calls made.
         """
-        cls.single_call_chain.clear()
-        cls.all_call_chains.clear()
+        cls.default_session.reset()
+        with cls.record_lock:
+            cls.all_call_chains.clear()
 
     @classmethod
     def reset_single_record(cls) -> None:
         """
-        Reset the number of API calls made for a single data item.
+        Reset the number of API calls made in the current session.
         """
-        cls.single_call_chain.clear()
+        cls.get_session().reset()
 
     @classmethod
-    def query_llm_with_msg(cls, messages: list[dict], query_type: str = "default") -> str:
+    def merge_call_chain(cls, call_chain: list[list[str]]) -> None:
         """
-        [Entrance] Query LLM with user prompt and system prompt
+        Merge the call chain of a session run elsewhere (e.g. in a worker process).
+        """
+        if not call_chain:
+            return
+        with cls.record_lock:
+            cls.all_call_chains.append(call_chain)
+
+    @classmethod
+    def share_rate_limits(cls, worker_count: int) -> None:
+        """
+        Share the provider rate limits among worker_count processes (used as a process pool initializer).
+        """
+        cls.rate_limiter.scale(1 / max(worker_count, 1))
+
+    @classmethod
+    def _add_call_record(cls, call_record: list[str]) -> None:
+        """
+        Add a call record to the current session.
+        """
+        llm_session = cls.get_session()
+        with cls.record_lock:
+            # a session is reported in all_call_chains once it has records
+            if not llm_session.call_chain:
+                cls.all_call_chains.append(llm_session.call_chain)
+            llm_session.call_chain.append(call_record)
+
+    @classmethod
+    def get_cache_key(cls, messages: list[dict]) -> str:
+        """
+        Get the response cache key of the messages for the current model and provider.
+        """
+        messages_str = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        return get_text_hash(OPENAI_MODEL_NAME, str(LLM_PROVIDER), str(LLM_TEMPERATURE), messages_str)
+
+    @classmethod
+    def _get_cached_response(cls, messages: list[dict], query_type: str) -> tuple[str, Optional[str]]:
+        """
+        Look up the response cache according to LLM_CACHE_MODE.
+        :return: (cache_key, cached response or None)
+        """
+        assert LLM_CACHE_MODE in LLM_CACHE_MODES, f"Invalid LLM_CACHE_MODE {LLM_CACHE_MODE}, use {LLM_CACHE_MODES}"
+        cache_key = cls.get_cache_key(messages) if LLM_CACHE_MODE != "off" else ""
+        if LLM_CACHE_MODE in ["readwrite", "replay"]:
+            cached_res = cls.response_cache.get(cache_key, max_age=LLM_CACHE_TTL)
+            if cached_res is not None:
+                logger.info(f"LLM Cache Hit for '{query_type}' ({cls.response_cache.stats_str()})")
+                logger.info(f"LLM output for '{query_type}': \n{cached_res}")
+                # cache hits cost no tokens, mark them to keep the accounting honest
+                cls._add_call_record([query_type, "0 s", "0 it", "0 ot", "cache-hit"])
+                return cache_key, cached_res
+        return cache_key, None
+
+    @classmethod
+    def _record_response(
+        cls, cache_key: str, res: str, usage: Optional[Usage], time_cost: int, query_type: str
+    ) -> None:
+        """
+        Log the response, store it in the response cache if needed and update the LLM record.
         """
-        start_time = time.time()
-        res, usage = query_llm_v1(messages)
-        end_time = time.time()
-        time_cost = int(end_time - start_time)
         prompt_tokens = usage.prompt_tokens if usage else 0
         completion_tokens = usage.completion_tokens if usage else 0
         logger.info(f"LLM Inference Record: {time_cost} seconds, ({prompt_tokens}+{completion_tokens}) tokens")
         logger.info(f"LLM output for '{query_type}': \n{res}")
 
+        if LLM_CACHE_MODE in ["readwrite", "refresh"] and res:
+            cls.response_cache.set(cache_key, res, tag=OPENAI_MODEL_NAME)
+
         # update LLM record
-        if not cls.single_call_chain:
-            cls.all_call_chains.append([])
         call_record = [query_type, f"{time_cost} s", f"{prompt_tokens} it", f"{completion_tokens} ot"]
-        cls.single_call_chain.append(call_record)
-        cls.all_call_chains[-1].append(call_record)
+        cls._add_call_record(call_record)
+
+    @classmethod
+    def query_llm_with_msg(cls, messages: list[dict], query_type: str = "default", owner: Optional[str] = None) -> str:
+        """
+        [Entrance] Query LLM with user prompt and system prompt
+        """
+        cache_key, cached_res = cls._get_cached_response(messages, query_type)
+        if cached_res is not None:
+            return cached_res
+
+        owner = owner or cls.get_session().name
+        token_record = cls.rate_limiter.acquire(owner, estimate_tokens(messages))
+        usage = None
+        try:
+            start_time = time.time()
+            res, usage = query_llm_v1(messages)
+            end_time = time.time()
+        finally:
+            cls.rate_limiter.release(token_record, usage.total_tokens if usage else None)
+        cls._record_response(cache_key, res, usage, int(end_time - start_time), query_type)
 
         return res
 
     @classmethod
-    def query_llm(cls, user_prompt: str, system_prompt: Optional[str] = None, query_type: str = "default") -> str:
+    async def aquery_llm_with_msg(
+        cls, messages: list[dict], query_type: str = "default", owner: Optional[str] = None
+    ) -> str:
         """
-        [Entrance] Query LLM with user prompt and system prompt
+        [Entrance] Query LLM with messages asynchronously, sharing the rate limits with the sync queries.
+        """
+        cache_key, cached_res = cls._get_cached_response(messages, query_type)
+        if cached_res is not None:
+            return cached_res
+
+        owner = owner or cls.get_session().name
+        token_record = await cls._aacquire_rate_limit(owner, estimate_tokens(messages))
+        usage = None
+        try:
+            start_time = time.time()
+            res, usage = await aquery_llm_v1(messages)
+            end_time = time.time()
+        finally:
+            cls.rate_limiter.release(token_record, usage.total_tokens if usage else None)
+        cls._record_response(cache_key, res, usage, int(end_time - start_time), query_type)
+
+        return res
+
+    @classmethod
+    async def _aacquire_rate_limit(cls, owner: str, est_tokens: int) -> list:
         """
-        assert len(cls.single_call_chain) <= 10, f"--> [LLM] API call limit reached: {len(cls.single_call_chain)}."
+        Acquire the rate limits in a thread, without blocking the event loop.
+        The acquiring thread cannot be interrupted, so the token of a cancelled caller is released once acquired.
+        :return: the token record of the request, to be passed to release
+        """
+        lock = threading.Lock()
+        state = {"cancelled": False, "token_record": None}
+
+        def _acquire() -> list:
+            token_record = cls.rate_limiter.acquire(owner, est_tokens)
+            with lock:
+                if state["cancelled"]:
+                    cls.rate_limiter.release(token_record)
+                else:
+                    state["token_record"] = token_record
+            return token_record
+
+        try:
+            return await asyncio.to_thread(_acquire)
+        except asyncio.CancelledError:
+            with lock:
+                state["cancelled"] = True
+                if state["token_record"] is not None:
+                    cls.rate_limiter.release(state["token_record"])
+            raise
+
+    @classmethod
+    def _build_messages(cls, user_prompt: str, system_prompt: Optional[str] = None) -> list[dict]:
+        """
+        Build the messages and reserve a call of the session budget.
+        """
+        cls.get_session().reserve_call()
         if system_prompt is None:
             messages = [{"role": "user", "content": user_prompt}]
         else:
@@ -97,17 +412,46 @@ class LLMWrapper:
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ]
-        return cls.query_llm_with_msg(messages, query_type=query_type)
+        return messages
+
+    @classmethod
+    def query_llm(
+        cls,
+        user_prompt: str,
+        system_prompt: Optional[str] = None,
+        query_type: str = "default",
+        owner: Optional[str] = None,
+    ) -> str:
+        """
+        [Entrance] Query LLM with user prompt and system prompt
+        """
+        messages = cls._build_messages(user_prompt, system_prompt)
+        return cls.query_llm_with_msg(messages, query_type=query_type, owner=owner)
+
+    @classmethod
+    async def aquery_llm(
+        cls,
+        user_prompt: str,
+        system_prompt: Optional[str] = None,
+        query_type: str = "default",
+        owner: Optional[str] = None,
+    ) -> str:
+        """
+        [Entrance] Query LLM with user prompt and system prompt asynchronously
+        """
+        messages = cls._build_messages(user_prompt, system_prompt)
+        return await cls.aquery_llm_with_msg(messages, query_type=query_type, owner=owner)
 
     @classmethod
     def log_single_record(cls) -> None:
         """
-        Log the single record of API calls.
+        Log the records of API calls in the current session.
         """
+        call_chain = cls.get_session().call_chain
         wrapper = "*****" * 8
         full_record_str = f"\n{wrapper}\n"
-        full_record_str += f"==> Single LLM API Call Record (#{len(cls.single_call_chain)}):\n"
-        full_record_str += ", ".join(str(record) for record in cls.single_call_chain)
+        full_record_str += f"==> Single LLM API Call Record (#{len(call_chain)}):\n"
+        full_record_str += ", ".join(str(record) for record in call_chain)
         full_record_str += f"\n{wrapper}"
         logger.info(full_record_str)
 
@@ -117,7 +461,8 @@ class LLMWrapper:
         Log all records of API calls.
         """
         wrapper = "*****" * 8
-        call_count_list = list(map(len, cls.all_call_chains))
+        with cls.record_lock:
+            call_count_list = list(map(len, cls.all_call_chains))
         full_record_str = f"\n{wrapper}\n"
         full_record_str += f"==> All LLM API Call Record (#{sum(call_count_list)}):\n"
         full_record_str += ", ".join([str(count) for count in call_count_list])
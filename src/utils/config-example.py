@@ -7,10 +7,47 @@ KIRIN_JAVA_HOME = "xxxx"
 # dsl_kirin cli path
 KIRIN_CLI_PATH = "xxxx"
 
+# compile with a long-lived javac server (javax.tools) instead of launching javac for each compilation
+USE_JAVAC_SERVER = False
+
+# keep a resident Kirin formatter JVM instead of launching one for each batch of dsls to format
+USE_KIRIN_FORMAT_SERVER = False
+
+# concurrent kirin scans with the checkers sharded: 0 to decide by cores and free memory (each scan assumed to take
+# KIRIN_SHARD_MEMORY_MB, both shared among the --workers processes), 1 to scan in a single process
+KIRIN_SCAN_SHARDS = 0
+KIRIN_SHARD_MEMORY_MB = 2048
+
+# processes parsing tests for tree-sitter mock generation: 0 to decide by cores (at least TS_PARSE_MIN_FILES files per
+# process), 1 to parse in the current process
+TS_PARSE_WORKERS = 0
+TS_PARSE_MIN_FILES = 64
+
+# reuse mocks of third-party classes across workspaces (kirin_ws/cache/mock_kb.db), off by default since the mocks then
+# depend on the dsls processed before: set to True to enable, delete mock_kb.db to start over
+USE_MOCK_KB = False
+
+# flags of short-lived JVM launches (kirin cli, javac, jar): "default", "fast-startup" or a list of JVM flags
+JVM_PROFILE = "default"
+# share class data across launches with AppCDS archives in kirin_ws/cache/cds (dumped by the first launch)
+JVM_USE_CDS = False
+
+# root for per-call scratch workspaces (e.g. "/dev/shm" for tmpfs), None to use kirin_ws/tmp
+SCRATCH_ROOT = None
+
 # llm config
 OPENAI_BASE_URL = "xxxxx"
 OPENAI_MODEL_NAME = "xxxxx"
 
+# llm response cache: "off", "readwrite", "replay" (read-only) or "refresh"; cached responses expire after the ttl
+LLM_CACHE_MODE = "off"
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+# llm rate limits of all processes together (0 means unlimited): in-flight requests, requests and tokens per minute
+LLM_MAX_IN_FLIGHT = 8
+LLM_RPM = 0
+LLM_TPM = 0
+
 # api keys in env
 load_dotenv("src/.env", override=True)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
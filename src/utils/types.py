@@ -37,6 +37,18 @@ class DslValResDict(TypedDict):
     passed: list[str]  # [file_name, ...]
 
 
+class JavacDiagnostic(TypedDict):
+    kind: str  # ERROR, WARNING, MANDATORY_WARNING, NOTE, OTHER
+    file: str  # source file path, "" if not related to a file
+    line: int  # starting from 1, -1 if unknown
+    column: int  # starting from 1, -1 if unknown
+    code: str  # javac diagnostic key, e.g. compiler.err.cant.resolve.location
+    message: str
+    symbol: str  # missing or duplicate symbol/package, "" if not applicable
+    exception: str  # unreported or never thrown exception type, "" if not applicable
+    text: str  # the diagnostic in the default javac text format (with the source line and caret)
+
+
 """
 Used for node property knowledge collection
 """